@@ -0,0 +1,202 @@
+"""Кэш результатов эмоционального анализа сообщений.
+
+Короткие частые сообщения («привет», «спасибо», «<3») раз за разом уходят
+в Llama с тем же промптом. Разобранный результат анализа кэшируется по
+нормализованному тексту сообщения в двух уровнях: LRU в памяти процесса и
+таблица SQLite на диске. Записи живут не дольше ``ttl_seconds``, а на диске
+их не больше ``max_entries`` (лишние вытесняются по давности обращения).
+
+Каждое место вызова — своё пространство имён со своей версией: хэшем
+модели и шаблона промпта. Когда шаблон меняется, меняется и версия, и
+записи старой версии удаляются при первом обращении.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from . import config
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS analysis_cache (
+    key TEXT PRIMARY KEY,
+    namespace TEXT NOT NULL,
+    version TEXT NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL,
+    value TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS analysis_cache_accessed ON analysis_cache (accessed);
+"""
+
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_message(text: str) -> str:
+    """Ключевой вид сообщения: без регистра и лишних пробелов"""
+    return _SPACES.sub(" ", text).strip().casefold()
+
+
+def prompt_version(payload: Dict[str, Any]) -> str:
+    """Версия промпта: хэш запроса к модели, собранного для пустого сообщения"""
+    return hashlib.sha1(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+
+class AnalysisCache:
+    """Кэш разобранных анализов: LRU в памяти + SQLite на диске, с TTL"""
+
+    def __init__(
+        self,
+        db_path: str,
+        memory_size: int = 512,
+        max_entries: int = 20000,
+        ttl_seconds: float = 7 * 24 * 3600,
+    ):
+        self.db_path = db_path
+        self.memory_size = memory_size
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+
+        self._lru: "OrderedDict[str, tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._versions: Dict[str, str] = {}
+        self._puts = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.invalidated = 0
+        self.evicted = 0
+
+    @staticmethod
+    def make_key(namespace: str, version: str, text: str) -> str:
+        return hashlib.sha256(f"{namespace}\0{version}\0{normalize_message(text)}".encode("utf-8")).hexdigest()
+
+    def _check_version(self, namespace: str, version: str):
+        """При смене версии промпта удаляет записи старых версий"""
+        if self._versions.get(namespace) == version:
+            return
+        cursor = self._conn.execute(
+            "DELETE FROM analysis_cache WHERE namespace = ? AND version != ?", (namespace, version)
+        )
+        self._conn.commit()
+        if cursor.rowcount:
+            self.invalidated += cursor.rowcount
+            print(f"[CACHE] Промпт {namespace} изменился, сброшено записей: {cursor.rowcount}")
+        self._versions[namespace] = version
+
+    def _remember(self, key: str, created: float, value: Dict[str, Any]):
+        self._lru[key] = (created, value)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.memory_size:
+            self._lru.popitem(last=False)
+
+    def get(self, namespace: str, version: str, text: str) -> Optional[Dict[str, Any]]:
+        """Копия закэшированного анализа или None"""
+        key = self.make_key(namespace, version, text)
+        now = time.time()
+        with self._lock:
+            self._check_version(namespace, version)
+            entry = self._lru.get(key)
+            if entry is not None and now - entry[0] <= self.ttl_seconds:
+                self._lru.move_to_end(key)
+                self.memory_hits += 1
+                return json.loads(json.dumps(entry[1]))
+            row = self._conn.execute("SELECT created, value FROM analysis_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[0] <= self.ttl_seconds:
+                self._conn.execute("UPDATE analysis_cache SET accessed = ? WHERE key = ?", (now, key))
+                self._conn.commit()
+                value = json.loads(row[1])
+                self._remember(key, row[0], value)
+                self.disk_hits += 1
+                return json.loads(row[1])
+            if entry is not None or row is not None:
+                self._lru.pop(key, None)
+                self._conn.execute("DELETE FROM analysis_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                self.expired += 1
+            self.misses += 1
+        return None
+
+    def put(self, namespace: str, version: str, text: str, value: Dict[str, Any]) -> None:
+        key = self.make_key(namespace, version, text)
+        now = time.time()
+        data = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._check_version(namespace, version)
+            self._remember(key, now, json.loads(data))
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO analysis_cache (key, namespace, version, created, accessed, value)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, namespace, version, now, now, data),
+                )
+                self._puts += 1
+                if self._puts % 256 == 0:
+                    self._prune(now)
+                self._conn.commit()
+            except sqlite3.Error as e:
+                print(f"[WARN] Ошибка записи кэша анализа: {e}")
+
+    def _prune(self, now: float):
+        """Удаляет просроченные записи и самые давние сверх ``max_entries``"""
+        expired = self._conn.execute("DELETE FROM analysis_cache WHERE created < ?", (now - self.ttl_seconds,))
+        self.expired += expired.rowcount
+        total = self._conn.execute("SELECT COUNT(*) FROM analysis_cache").fetchone()[0]
+        if total > self.max_entries:
+            evicted = self._conn.execute(
+                "DELETE FROM analysis_cache WHERE key IN"
+                " (SELECT key FROM analysis_cache ORDER BY accessed LIMIT ?)",
+                (total - self.max_entries,),
+            )
+            self.evicted += evicted.rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            entries = self._conn.execute("SELECT COUNT(*) FROM analysis_cache").fetchone()[0]
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "entries": entries,
+                "expired": self.expired,
+                "evicted": self.evicted,
+                "invalidated": self.invalidated,
+            }
+
+
+_default_cache: AnalysisCache | None = None
+_default_cache_lock = threading.Lock()
+
+
+def get_analysis_cache() -> AnalysisCache:
+    """Общий на процесс кэш анализа"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = AnalysisCache(
+                config.ANALYSIS_CACHE_PATH,
+                memory_size=config.ANALYSIS_CACHE_MEMORY_SIZE,
+                max_entries=config.ANALYSIS_CACHE_MAX_ENTRIES,
+                ttl_seconds=config.ANALYSIS_CACHE_TTL_HOURS * 3600,
+            )
+        return _default_cache
@@ -1,21 +1,24 @@
 """Облачный мозг с поддержкой многослойных эмоций."""
 
 import json
+import httpx
 import requests
-from typing import Any, Dict, List
+from typing import Any, AsyncIterator, Dict, Iterator, List, Tuple
 
 from . import config
+from .emotional_learning import soul_data_file
+from .llm_gateway import LLMUnavailable, StreamMetrics, aopenai_post, aopenai_stream, openai_post, openai_stream
 
-OPENAI_URL = "https://api.openai.com/v1/chat/completions"
+FALLBACK_RESPONSE = "Извините, мне тяжело сформулировать ответ."
 
 
 def generate_response_with_emotional_layers(
-    user_message: str, analysis: Dict[str, Any], memories: List[str]
+    user_message: str, analysis: Dict[str, Any], memories: List[str], data_dir: str = config.DATA_DIR
 ) -> str:
     """Генерирует ответ с полной эмоциональной системой, учитывая триггеры."""
 
-    tone_data = load_emotional_data()
-    trigger_data = load_trigger_phrases()
+    tone_data = load_emotional_data(data_dir)
+    trigger_data = load_trigger_phrases(data_dir)
 
     # Сначала проверяем наличие триггера
     trigger_result = check_trigger_phrases(user_message, trigger_data)
@@ -81,15 +84,16 @@ def generate_response_with_emotional_layers(
     return call_gpt4_with_full_context(system_prompt, user_message, temperature)
 
 
-def generate_response_with_living_core(
+def _living_core_prompt(
     user_message: str,
     analysis: Dict[str, Any],
     memories: List[str],
     living_context: str,
-) -> str:
-    """Генерирует ответ с учётом живого контекста души"""
+    data_dir: str = config.DATA_DIR,
+) -> Tuple[str, float]:
+    """Системный промпт и температура для ответа с живым контекстом"""
 
-    tone_data = load_emotional_data()
+    tone_data = load_emotional_data(data_dir)
     current_emotion = analysis.get("emotion_detected", "спокойствие")
     current_tone = determine_tone_from_emotion(current_emotion)
     current_subtone = select_compatible_subtone(current_tone, tone_data, user_message)
@@ -107,17 +111,67 @@ def generate_response_with_living_core(
 Отвечай исходя из своего текущего состояния и того, кем ты себя ощущаешь сейчас.
 Будь естественной, искренней. Ты можешь развиваться и меняться."""
 
+    return system_prompt, temperature
+
+
+def generate_response_with_living_core(
+    user_message: str,
+    analysis: Dict[str, Any],
+    memories: List[str],
+    living_context: str,
+    data_dir: str = config.DATA_DIR,
+) -> str:
+    """Генерирует ответ с учётом живого контекста души"""
+    system_prompt, temperature = _living_core_prompt(user_message, analysis, memories, living_context, data_dir)
     return call_gpt4_with_full_context(system_prompt, user_message, temperature)
 
 
-def load_emotional_data():
-    """Загружает всю эмоциональную систему"""
+async def agenerate_response_with_living_core(
+    user_message: str,
+    analysis: Dict[str, Any],
+    memories: List[str],
+    living_context: str,
+    data_dir: str = config.DATA_DIR,
+) -> str:
+    """Асинхронный вариант ``generate_response_with_living_core``"""
+    system_prompt, temperature = _living_core_prompt(user_message, analysis, memories, living_context, data_dir)
+    return await acall_gpt4_with_full_context(system_prompt, user_message, temperature)
+
+
+def stream_response_with_living_core(
+    user_message: str,
+    analysis: Dict[str, Any],
+    memories: List[str],
+    living_context: str,
+    metrics: StreamMetrics | None = None,
+    data_dir: str = config.DATA_DIR,
+) -> Iterator[str]:
+    """Как ``generate_response_with_living_core``, но отдаёт токены по мере генерации"""
+    system_prompt, temperature = _living_core_prompt(user_message, analysis, memories, living_context, data_dir)
+    return stream_gpt4_with_full_context(system_prompt, user_message, temperature, metrics)
+
+
+def astream_response_with_living_core(
+    user_message: str,
+    analysis: Dict[str, Any],
+    memories: List[str],
+    living_context: str,
+    metrics: StreamMetrics | None = None,
+    data_dir: str = config.DATA_DIR,
+) -> AsyncIterator[str]:
+    """Асинхронный вариант ``stream_response_with_living_core``"""
+    system_prompt, temperature = _living_core_prompt(user_message, analysis, memories, living_context, data_dir)
+    return astream_gpt4_with_full_context(system_prompt, user_message, temperature, metrics)
+
+
+def load_emotional_data(data_dir: str = config.DATA_DIR):
+    """Загружает всю эмоциональную систему души из ``data_dir``"""
     try:
-        with open("DigitalSoul/data/tone_memory.json", "r", encoding="utf-8") as f:
+        with open(soul_data_file(data_dir, "tone_memory.json"), "r", encoding="utf-8") as f:
             tones = json.load(f)
-        with open("DigitalSoul/data/subtone_memory.json", "r", encoding="utf-8") as f:
+        with open(soul_data_file(data_dir, "subtone_memory.json"), "r", encoding="utf-8") as f:
             subtones = json.load(f)
-        with open("DigitalSoul/data/flavor_memory.json", "r", encoding="utf-8") as f:
+        with open(soul_data_file(data_dir, "flavor_memory.json"), "r", encoding="utf-8") as f:
             flavors = json.load(f)
         return {"tones": tones.get("available_tones", {}), "subtones": subtones.get("available_subtones", {}), "flavors": flavors.get("available_flavors", {})}
     except Exception as e:
@@ -125,9 +179,9 @@ def load_emotional_data():
         return {"tones": {}, "subtones": {}, "flavors": {}}
 
 
-def load_trigger_phrases():
+def load_trigger_phrases(data_dir: str = config.DATA_DIR):
     try:
-        with open("DigitalSoul/data/trigger_phrases.json", "r", encoding="utf-8") as f:
+        with open(soul_data_file(data_dir, "trigger_phrases.json"), "r", encoding="utf-8") as f:
             return json.load(f)
     except Exception:
         return {"phrases": []}
@@ -378,15 +432,11 @@ def calculate_emotional_temperature(emotion: str, tone: str, subtone: str | None
     return max(0.3, min(1.3, temp))
 
 
-def call_gpt4_with_full_context(system_prompt: str, user_message: str, temperature: float) -> str:
+def _gpt4_payload(system_prompt: str, user_message: str, temperature: float) -> Dict[str, Any]:
     print("📤 ОТПРАВЛЯЮ ЗАПРОС К GPT-4O:")
     print(f"USER: {user_message}")
     print(f"TEMP: {temperature}")
     print("=" * 40)
-    headers = {
-        "Authorization": f"Bearer {config.OPENAI_API_KEY}",
-        "Content-Type": "application/json",
-    }
     messages = [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_message},
@@ -397,11 +447,95 @@ def call_gpt4_with_full_context(system_prompt: str, user_message: str, temperatu
         "temperature": temperature,
         "max_tokens": 500,
     }
+    return payload
+
+
+def call_gpt4_with_full_context(system_prompt: str, user_message: str, temperature: float) -> str:
+    payload = _gpt4_payload(system_prompt, user_message, temperature)
     try:
-        response = requests.post(OPENAI_URL, headers=headers, json=payload, timeout=15)
+        response = openai_post("chat/completions", payload)
         response.raise_for_status()
         data = response.json()
         return data["choices"][0]["message"]["content"]
-    except requests.RequestException as e:
+    except (requests.RequestException, LLMUnavailable) as e:
         print(f"[WARN] Ошибка GPT-4o: {e}")
-        return "Извините, мне тяжело сформулировать ответ."
+        return FALLBACK_RESPONSE
+
+
+async def acall_gpt4_with_full_context(system_prompt: str, user_message: str, temperature: float) -> str:
+    payload = _gpt4_payload(system_prompt, user_message, temperature)
+    try:
+        response = await aopenai_post("chat/completions", payload)
+        response.raise_for_status()
+        data = response.json()
+        return data["choices"][0]["message"]["content"]
+    except (httpx.HTTPError, LLMUnavailable) as e:
+        print(f"[WARN] Ошибка GPT-4o: {e}")
+        return FALLBACK_RESPONSE
+
+
+def _stream_payload(system_prompt: str, user_message: str, temperature: float) -> Dict[str, Any]:
+    payload = _gpt4_payload(system_prompt, user_message, temperature)
+    payload["stream"] = True
+    # Последним событием придёт usage с точным числом токенов ответа
+    payload["stream_options"] = {"include_usage": True}
+    return payload
+
+
+def _parse_stream_event(line: str, metrics: StreamMetrics) -> str | None:
+    """Текст из одного server-sent event; usage и [DONE] закрывают метрики"""
+    if not line.startswith("data:"):
+        return None
+    data = line[5:].strip()
+    if data == "[DONE]":
+        metrics.finish()
+        return None
+    event = json.loads(data)
+    usage = event.get("usage")
+    if usage:
+        metrics.finish(usage.get("completion_tokens"))
+    choices = event.get("choices") or []
+    content = choices[0].get("delta", {}).get("content") if choices else None
+    if content:
+        metrics.token()
+    return content or None
+
+
+def stream_gpt4_with_full_context(
+    system_prompt: str, user_message: str, temperature: float, metrics: StreamMetrics | None = None
+) -> Iterator[str]:
+    """Токены ответа GPT-4o по мере прихода; при ошибке до первого токена — запасная фраза"""
+    metrics = metrics if metrics is not None else StreamMetrics()
+    payload = _stream_payload(system_prompt, user_message, temperature)
+    try:
+        for line in openai_stream("chat/completions", payload):
+            content = _parse_stream_event(line, metrics)
+            if content:
+                yield content
+    except (requests.RequestException, LLMUnavailable, ValueError) as e:
+        print(f"[WARN] Ошибка потока GPT-4o: {e}")
+        if not metrics.tokens:
+            yield FALLBACK_RESPONSE
+    finally:
+        if metrics.finished_at is None:
+            metrics.finish()
+
+
+async def astream_gpt4_with_full_context(
+    system_prompt: str, user_message: str, temperature: float, metrics: StreamMetrics | None = None
+) -> AsyncIterator[str]:
+    """Асинхронный вариант ``stream_gpt4_with_full_context``"""
+    metrics = metrics if metrics is not None else StreamMetrics()
+    payload = _stream_payload(system_prompt, user_message, temperature)
+    try:
+        async for line in aopenai_stream("chat/completions", payload):
+            content = _parse_stream_event(line, metrics)
+            if content:
+                yield content
+    except (httpx.HTTPError, LLMUnavailable, ValueError) as e:
+        print(f"[WARN] Ошибка потока GPT-4o: {e}")
+        if not metrics.tokens:
+            yield FALLBACK_RESPONSE
+    finally:
+        if metrics.finished_at is None:
+            metrics.finish()
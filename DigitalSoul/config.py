@@ -1,6 +1,7 @@
 # Конфигурация проекта Digital Soul
 
-OLLAMA_URL = "http://localhost:11434/api/generate"
+OLLAMA_BASE_URL = "http://localhost:11434"
+OLLAMA_URL = f"{OLLAMA_BASE_URL}/api/generate"
 import os
 from dotenv import load_dotenv
 
@@ -9,6 +10,7 @@ load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL = "gpt-4o"
 EMBEDDING_MODEL = "text-embedding-ada-002"
+DATA_DIR = "DigitalSoul/data"
 FAISS_INDEX_PATH = "DigitalSoul/data/vector_memory.index"
 METADATA_PATH = "DigitalSoul/data/memory_metadata.json"
 EMOTIONS_PATH = "DigitalSoul/data/emotions.json"
@@ -21,3 +23,112 @@ LONGTERM_MEMORY_PATH = f"{MEMORY_DIR}/longterm_memory.json"
 PERSONAL_FACTS_PATH = f"{MEMORY_DIR}/personal_facts.json"
 FULL_ARCHIVE_PATH = f"{MEMORY_DIR}/full_archive.jsonl"
 SOUL_DIARY_PATH = f"{MEMORY_DIR}/soul_diary.json"
+
+# Кэш эмбеддингов (LRU в памяти + memmap на диске)
+EMBEDDING_CACHE_DIR = "DigitalSoul/data/embedding_cache"
+EMBEDDING_CACHE_MEMORY_SIZE = 1024
+
+# Кэш эмоционального анализа сообщений (LRU в памяти + SQLite на диске).
+# Записи старой версии промпта сбрасываются автоматически
+ANALYSIS_CACHE_PATH = "DigitalSoul/data/analysis_cache.sqlite3"
+ANALYSIS_CACHE_MEMORY_SIZE = 512
+ANALYSIS_CACHE_MAX_ENTRIES = 20000
+ANALYSIS_CACHE_TTL_HOURS = 24 * 7
+
+# Журнал предзаписи единой памяти
+MEMORY_WAL_COMMIT_WINDOW_MS = 50
+MEMORY_WAL_MAX_BATCH = 32
+MEMORY_CHECKPOINT_EVERY = 200
+
+# Индекс единой памяти: flat | ivf_flat | ivf_pq | hnsw
+MEMORY_INDEX_MODE = "flat"
+MEMORY_INDEX_PROMOTE_AT = 4096  # после этого размера flat переводится в MEMORY_INDEX_MODE и MEMORY_VECTOR_CODEC
+MEMORY_IVF_NLIST = 0  # 0 — подобрать автоматически (~4·sqrt(N))
+MEMORY_IVF_NPROBE = 8
+MEMORY_PQ_M = 64
+MEMORY_HNSW_M = 32
+MEMORY_HNSW_EF_SEARCH = 64
+# Хранение векторов в индексе: float32 | fp16 | sq8 | pq (pq — MEMORY_PQ_M байт на вектор)
+MEMORY_VECTOR_CODEC = "float32"
+# Для sq8/pq индекс отдаёт в MEMORY_RESCORE_FACTOR раз больше кандидатов,
+# а сходство пересчитывается точно по float16-копии векторов; 0 — без пересчёта
+MEMORY_RESCORE_FACTOR = 4
+
+# Забывание и компакция единой памяти
+MEMORY_FORGET_MIN_AGE_HOURS = 24 * 30  # моложе этого ничего не забываем по приоритету
+MEMORY_FORGET_MAX_PRIORITY = 0.35  # старые воспоминания с priority_score ниже — забываются
+MEMORY_TYPE_CAPS = {"recent": 5000, "archive": 20000}  # лимит живых воспоминаний на memory_type
+MEMORY_COMPACT_TOMBSTONE_RATIO = 0.2  # доля надгробий в индексе, после которой запускается компакция
+MEMORY_STATS_RATE_WINDOW_SECONDS = 300  # окно скользящей скорости вставок в статистике
+
+# Подавление почти-повторов при вставке: сравнение с последними векторами того же memory_type
+MEMORY_DEDUP_THRESHOLD = 0.97  # косинус, начиная с которого новое воспоминание считается повтором (1.0 — выключено)
+MEMORY_DEDUP_WINDOW = 512  # сколько последних векторов проверять
+
+# Консолидация: кластеры старых мелких воспоминаний сворачиваются в сводки (memory_type "summary")
+MEMORY_CONSOLIDATE_TYPES = ["recent"]
+MEMORY_CONSOLIDATE_IMPORTANCE = ["низкая", "средняя"]
+MEMORY_CONSOLIDATE_MIN_AGE_HOURS = 24 * 3
+MEMORY_CONSOLIDATE_SIMILARITY = 0.8  # косинус к центроиду кластера
+MEMORY_CONSOLIDATE_MAX_GAP_HOURS = 6  # разрыв во времени, после которого кластер закрывается
+MEMORY_CONSOLIDATE_MIN_CLUSTER = 3
+MEMORY_CONSOLIDATE_MAX_CLUSTER = 20
+MEMORY_CONSOLIDATE_INTERVAL_HOURS = 24
+MEMORY_CONSOLIDATE_USE_LLM = True  # сводка через локальную Llama, иначе (или при ошибке) — извлекающая
+MEMORY_CONSOLIDATE_LLM_TIMEOUT = 30
+
+# Читаемый лог памяти: пишется фоновым потоком, ротируется по размеру и возрасту
+READABLE_LOG_MAX_BYTES = 5 * 1024 * 1024
+READABLE_LOG_MAX_AGE_HOURS = 24 * 7
+READABLE_LOG_BACKUPS = 10  # сколько старых сегментов хранить
+READABLE_LOG_COMPRESS = True  # сжимать старые сегменты gzip
+READABLE_LOG_QUEUE_SIZE = 10000  # при переполнении строки отбрасываются, а не ждут диска
+READABLE_LOG_FLUSH_INTERVAL_MS = 500  # сколько копить строки до записи
+READABLE_LOG_BATCH_LINES = 1000  # пачка такого размера пишется, не дожидаясь интервала
+
+# Массовая миграция старых слоёв памяти
+MIGRATION_EMBED_BATCH = 256  # текстов в одном запросе к эмбеддеру
+MIGRATION_ADD_BLOCK = 8192  # векторов в одной вставке в индекс
+
+# Бэкенд эмбеддингов: openai | local (офлайн, хэшированные n-граммы + TF-IDF)
+EMBEDDING_BACKEND = "openai"
+LOCAL_EMBEDDING_DIM = 1536
+LOCAL_EMBEDDING_MIN_N = 2
+LOCAL_EMBEDDING_MAX_N = 4
+LOCAL_EMBEDDING_IDF_PATH = "DigitalSoul/data/local_embedding_idf.json"
+
+# Мультитенантность: у каждого пользователя свой шард памяти в TENANTS_ROOT/<tenant_id>
+TENANTS_ROOT = "DigitalSoul/data/tenants"
+MEMORY_POOL_CAPACITY = 8  # сколько шардов держать загруженными одновременно
+MEMORY_POOL_IDLE_SECONDS = 600  # шард без обращений дольше этого выгружается на диск
+
+# Общий HTTP-шлюз к LLM: пул keep-alive соединений и таймаут на каждый эндпоинт
+OPENAI_BASE_URL = "https://api.openai.com/v1"
+OLLAMA_TIMEOUT = 10  # секунды
+OPENAI_TIMEOUT = 15
+LLM_POOL_SIZE = 10  # соединений в пуле одного эндпоинта
+
+# Бюджет времени: все LLM-вызовы одного сообщения укладываются в дедлайн, а
+# эндпоинт после LLM_BREAKER_FAILURES ошибок подряд отключается предохранителем,
+# пока фоновая проба (раз в LLM_BREAKER_PROBE_SECONDS) не увидит, что он ожил
+MESSAGE_DEADLINE_SECONDS = 30
+LLM_BREAKER_FAILURES = 3
+LLM_BREAKER_PROBE_SECONDS = 10
+LLM_BREAKER_PROBE_TIMEOUT = 2
+
+# Потоковый разбор ответов Ollama: генерация обрывается, как только закрылся JSON-объект ответа.
+# На первом и каждом N-м вызове тот же промпт в фоне генерируется целиком (теневой запрос),
+# чтобы оценивать сэкономленные токены и время; 0 — не калибровать
+OLLAMA_STREAM_CALIBRATE_EVERY = 20
+
+# Предклассификатор эмоций по ключевым словам: уверенный ответ без Llama
+# даётся только для сообщений не длиннее этого числа слов
+PRECLASSIFY_MAX_WORDS = 8
+
+# Структурированные ответы Llama (JSON по схеме): сколько раз повторять вызов,
+# если ответ не разобрался или не прошёл проверку схемы
+LLM_JSON_RETRIES = 1
+
+# Префикс промпта в Ollama: статичные правила анализа идут первыми как system,
+# и Ollama переиспользует их KV-кэш; keep_alive держит модель загруженной между сообщениями
+OLLAMA_KEEP_ALIVE = "30m"
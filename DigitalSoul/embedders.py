@@ -0,0 +1,185 @@
+"""Эмбеддеры для единой памяти.
+
+``OpenAIEmbedder`` ходит в OpenAI API, ``LocalHashEmbedder`` работает
+полностью офлайн на CPU: хэшированные символьные n-граммы с TF-IDF весами,
+спроецированные в вектор фиксированной размерности. Бэкенд выбирается
+через ``config.EMBEDDING_BACKEND``.
+"""
+
+import json
+import math
+import os
+import re
+import zlib
+from collections import Counter
+from typing import Iterable, List
+
+import numpy as np
+
+from . import config
+from .llm_gateway import openai_post
+
+_SPACES = re.compile(r"\s+")
+
+
+class Embedder:
+    """Общий интерфейс эмбеддера"""
+
+    name = "base"
+    dim = 0
+    # Кэшировать ли результаты в EmbeddingCache (для дешёвых локальных — нет)
+    cacheable = True
+    # Умеет ли эмбеддер обучаться на корпусе (``fit``)
+    fittable = False
+
+    def __init__(self):
+        self.last_usage_tokens = 0
+
+    def embed(self, text: str) -> np.ndarray | None:
+        """Возвращает float32-вектор или None, если эмбеддинг получить не удалось"""
+        raise NotImplementedError
+
+    def embed_batch(self, texts: List[str]) -> List[np.ndarray | None]:
+        return [self.embed(text) for text in texts]
+
+
+class OpenAIEmbedder(Embedder):
+    """Эмбеддинги через OpenAI API"""
+
+    def __init__(self, model: str = config.EMBEDDING_MODEL, dim: int = 1536, timeout: float = 10):
+        super().__init__()
+        self.name = model
+        self.dim = dim
+        self.timeout = timeout
+
+    def _post(self, payload) -> dict | None:
+        try:
+            response = openai_post(
+                "embeddings", payload, timeout=self.timeout, api_key=os.getenv("OPENAI_API_KEY", "fake")
+            )
+            if response.status_code == 200:
+                data = response.json()
+                self.last_usage_tokens = data.get("usage", {}).get("total_tokens", 0)
+                return data
+            print(f"[WARN] OpenAI embeddings вернул {response.status_code}")
+        except Exception as e:
+            print(f"[WARN] Ошибка создания эмбеддинга: {e}")
+        return None
+
+    def embed(self, text: str) -> np.ndarray | None:
+        data = self._post({"input": text, "model": self.name})
+        if data is None:
+            return None
+        return np.array(data["data"][0]["embedding"], dtype="float32")
+
+    def embed_batch(self, texts: List[str]) -> List[np.ndarray | None]:
+        if not texts:
+            return []
+        data = self._post({"input": texts, "model": self.name})
+        if data is None:
+            return [None] * len(texts)
+        vectors: List[np.ndarray | None] = [None] * len(texts)
+        for item in data["data"]:
+            vectors[item["index"]] = np.array(item["embedding"], dtype="float32")
+        return vectors
+
+
+class LocalHashEmbedder(Embedder):
+    """Офлайн-эмбеддер: хэшированные символьные n-граммы + TF-IDF.
+
+    Каждая n-грамма хэшируется crc32 в одну из ``dim`` корзин со знаком
+    (feature hashing), вес — сублинейный TF, умноженный на IDF корзины.
+    IDF берётся из таблицы частот, накопленной ``fit``; пока таблицы нет,
+    IDF равен 1. Результат детерминирован для одной и той же таблицы,
+    поэтому отпечаток таблицы входит в ``name``: векторы, посчитанные с
+    разными IDF, несовместимы.
+    """
+
+    cacheable = False
+    fittable = True
+
+    def __init__(self, dim: int = 1536, min_n: int = 2, max_n: int = 4, idf_path: str | None = None):
+        super().__init__()
+        self.dim = dim
+        self.min_n = min_n
+        self.max_n = max_n
+        self.base_name = f"local-hash-{min_n}-{max_n}-{dim}"
+        self.name = self.base_name
+        self.idf_path = idf_path
+        self.doc_freq = np.zeros(dim, dtype="float64")
+        self.doc_count = 0
+        self.idf = np.ones(dim, dtype="float32")
+        self._load_idf()
+
+    def _load_idf(self):
+        if not self.idf_path or not os.path.exists(self.idf_path):
+            return
+        try:
+            with open(self.idf_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("dim") == self.dim:
+                self.doc_count = data["doc_count"]
+                self.doc_freq = np.array(data["doc_freq"], dtype="float64")
+                self._update_idf()
+        except Exception as e:
+            print(f"[WARN] Не удалось загрузить IDF локального эмбеддера: {e}")
+
+    def _update_idf(self):
+        self.idf = (np.log((1 + self.doc_count) / (1 + self.doc_freq)) + 1.0).astype("float32")
+        fingerprint = zlib.crc32(self.doc_freq.tobytes())
+        self.name = f"{self.base_name}-idf{self.doc_count}-{fingerprint:08x}" if self.doc_count else self.base_name
+
+    def _ngrams(self, text: str) -> Iterable[str]:
+        text = f" {_SPACES.sub(' ', text.lower()).strip()} "
+        for n in range(self.min_n, self.max_n + 1):
+            for i in range(len(text) - n + 1):
+                yield text[i : i + n]
+
+    def _hashed_grams(self, text: str) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(корзина, знак, сублинейный TF) для каждой уникальной n-граммы"""
+        grams = Counter(self._ngrams(text))
+        if not grams:
+            empty = np.zeros(0, dtype="float32")
+            return empty.astype("int64"), empty, empty
+        hashes = np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype="uint32", count=len(grams))
+        buckets = (hashes % self.dim).astype("int64")
+        # Старший бит хэша задаёт знак, чтобы коллизии в среднем гасили друг друга
+        signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype("float32")
+        tf = np.fromiter((1.0 + math.log(c) for c in grams.values()), dtype="float32", count=len(grams))
+        return buckets, signs, tf
+
+    def fit(self, texts: Iterable[str]) -> None:
+        """Накапливает частоты корзин по корпусу и сохраняет IDF"""
+        for text in texts:
+            buckets, _, _ = self._hashed_grams(text)
+            self.doc_freq[np.unique(buckets)] += 1
+            self.doc_count += 1
+        self._update_idf()
+        if self.idf_path:
+            os.makedirs(os.path.dirname(self.idf_path) or ".", exist_ok=True)
+            with open(self.idf_path, "w", encoding="utf-8") as f:
+                json.dump(
+                    {"dim": self.dim, "doc_count": self.doc_count, "doc_freq": self.doc_freq.tolist()}, f
+                )
+
+    def embed(self, text: str) -> np.ndarray | None:
+        buckets, signs, tf = self._hashed_grams(text)
+        vector = np.zeros(self.dim, dtype="float32")
+        np.add.at(vector, buckets, signs * tf * self.idf[buckets])
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm > 0 else vector
+
+
+def create_embedder(backend: str | None = None) -> Embedder:
+    """Создаёт эмбеддер по имени бэкенда из конфига"""
+    backend = backend or config.EMBEDDING_BACKEND
+    if backend == "local":
+        return LocalHashEmbedder(
+            dim=config.LOCAL_EMBEDDING_DIM,
+            min_n=config.LOCAL_EMBEDDING_MIN_N,
+            max_n=config.LOCAL_EMBEDDING_MAX_N,
+            idf_path=config.LOCAL_EMBEDDING_IDF_PATH,
+        )
+    if backend == "openai":
+        return OpenAIEmbedder(config.EMBEDDING_MODEL)
+    raise ValueError(f"Неизвестный бэкенд эмбеддингов: {backend}")
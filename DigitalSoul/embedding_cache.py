@@ -0,0 +1,181 @@
+"""Контент-адресуемый кэш эмбеддингов.
+
+Два уровня: LRU в памяти процесса и memory-mapped матрица float32 на диске.
+Ключ — хэш от имени модели и текста, поэтому повторные и заново
+загружаемые тексты не уходят в сеть.
+
+Таблица строк матрицы живёт в памяти экземпляра, поэтому на один каталог
+в процессе должен приходиться один экземпляр — его отдаёт
+``get_embedding_cache``; шарды памяти разных тенантов делят его.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """Кэш эмбеддингов: LRU в памяти + memmap на диске"""
+
+    def __init__(self, cache_dir: str, dim: int = 1536, memory_size: int = 1024):
+        self.cache_dir = cache_dir
+        self.dim = dim
+        self.memory_size = memory_size
+        self.matrix_path = os.path.join(cache_dir, f"vectors_{dim}.f32")
+        self.keys_path = os.path.join(cache_dir, f"keys_{dim}.txt")
+
+        self._lru: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._rows: Dict[str, int] = {}
+        self._matrix: Optional[np.memmap] = None
+        self._capacity = 0
+        self._lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._miss_seconds = 0.0
+        self._miss_tokens = 0
+        self._measured_misses = 0
+
+        self._load()
+
+    @staticmethod
+    def make_key(text: str, model: str) -> str:
+        return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+    def _load(self):
+        """Поднимает таблицу ключей и открывает матрицу на диске"""
+        if not os.path.exists(self.keys_path) or not os.path.exists(self.matrix_path):
+            return
+        try:
+            with open(self.keys_path, "r", encoding="utf-8") as f:
+                keys = [line.strip() for line in f if line.strip()]
+            row_bytes = self.dim * 4
+            stored_rows = os.path.getsize(self.matrix_path) // row_bytes
+            # Ключ пишется только после вектора, поэтому лишние строки
+            # матрицы допустимы, а лишние ключи — нет.
+            keys = keys[:stored_rows]
+            self._rows = {key: row for row, key in enumerate(keys)}
+            if stored_rows:
+                self._capacity = stored_rows
+                self._matrix = np.memmap(
+                    self.matrix_path, dtype="float32", mode="r+", shape=(stored_rows, self.dim)
+                )
+        except Exception as e:
+            print(f"[WARN] Не удалось загрузить кэш эмбеддингов: {e}")
+            self._rows = {}
+            self._matrix = None
+            self._capacity = 0
+
+    def _ensure_capacity(self, rows: int):
+        if rows <= self._capacity:
+            return
+        new_capacity = max(rows, self._capacity * 2, 64)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        if self._matrix is not None:
+            self._matrix.flush()
+            del self._matrix
+        with open(self.matrix_path, "ab") as f:
+            f.truncate(new_capacity * self.dim * 4)
+        self._matrix = np.memmap(
+            self.matrix_path, dtype="float32", mode="r+", shape=(new_capacity, self.dim)
+        )
+        self._capacity = new_capacity
+
+    def _remember(self, key: str, vector: np.ndarray):
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.memory_size:
+            self._lru.popitem(last=False)
+
+    def get(self, text: str, model: str) -> Optional[np.ndarray]:
+        """Возвращает копию эмбеддинга из кэша или None"""
+        key = self.make_key(text, model)
+        with self._lock:
+            vector = self._lru.get(key)
+            if vector is not None:
+                self._lru.move_to_end(key)
+                self.memory_hits += 1
+                return vector.copy()
+            row = self._rows.get(key)
+            if row is not None and self._matrix is not None:
+                vector = np.array(self._matrix[row], dtype="float32")
+                self._remember(key, vector)
+                self.disk_hits += 1
+                return vector.copy()
+            self.misses += 1
+        return None
+
+    def put(self, text: str, model: str, vector: np.ndarray) -> None:
+        """Сохраняет эмбеддинг в оба уровня кэша"""
+        self.put_many([text], model, [vector])
+
+    def put_many(self, texts: List[str], model: str, vectors: List[np.ndarray]) -> None:
+        """Сохраняет пачку эмбеддингов: один flush матрицы и одна дозапись ключей"""
+        new_keys = []
+        seen = set()
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                vector = np.asarray(vector, dtype="float32").reshape(-1)
+                if vector.shape[0] != self.dim:
+                    continue
+                key = self.make_key(text, model)
+                self._remember(key, vector.copy())
+                if key not in self._rows and key not in seen:
+                    seen.add(key)
+                    new_keys.append((key, vector))
+            if not new_keys:
+                return
+            try:
+                start = len(self._rows)
+                self._ensure_capacity(start + len(new_keys))
+                for offset, (_, vector) in enumerate(new_keys):
+                    self._matrix[start + offset] = vector
+                self._matrix.flush()
+                with open(self.keys_path, "a", encoding="utf-8") as f:
+                    f.write("".join(key + "\n" for key, _ in new_keys))
+                for offset, (key, _) in enumerate(new_keys):
+                    self._rows[key] = start + offset
+            except Exception as e:
+                print(f"[WARN] Ошибка записи кэша эмбеддингов: {e}")
+
+    def record_miss_cost(self, seconds: float, tokens: int = 0) -> None:
+        """Учитывает стоимость промаха, чтобы оценить экономию на попаданиях"""
+        with self._lock:
+            self._miss_seconds += seconds
+            self._miss_tokens += tokens
+            self._measured_misses += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            avg_seconds = self._miss_seconds / self._measured_misses if self._measured_misses else 0.0
+            avg_tokens = self._miss_tokens / self._measured_misses if self._measured_misses else 0.0
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "stored_vectors": len(self._rows),
+                "saved_seconds_estimate": hits * avg_seconds,
+                "saved_tokens_estimate": int(hits * avg_tokens),
+            }
+
+
+_caches: Dict[Tuple[str, int], EmbeddingCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(cache_dir: str, dim: int = 1536, memory_size: int = 1024) -> EmbeddingCache:
+    """Общий на процесс кэш для каталога и размерности"""
+    key = (os.path.realpath(cache_dir), dim)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = EmbeddingCache(cache_dir, dim=dim, memory_size=memory_size)
+        return cache
@@ -10,15 +10,16 @@ from . import config
 class EmotionEngine:
     """Управляет текущей эмоцией."""
 
-    def __init__(self):
+    def __init__(self, emotions_path: str = config.EMOTIONS_PATH):
+        self.emotions_path = emotions_path
         self.current_emotion = "нейтрально"
         self.load_from_file()
 
     def load_from_file(self):
         """Загружает эмоцию из файла."""
-        if os.path.exists(config.EMOTIONS_PATH):
+        if os.path.exists(self.emotions_path):
             try:
-                with open(config.EMOTIONS_PATH, "r", encoding="utf-8") as f:
+                with open(self.emotions_path, "r", encoding="utf-8") as f:
                     data = json.load(f)
                     self.current_emotion = data.get("current", "нейтрально")
             except Exception:
@@ -32,7 +33,8 @@ class EmotionEngine:
     def save_to_file(self):
         """Сохраняет текущую эмоцию."""
         try:
-            with open(config.EMOTIONS_PATH, "w", encoding="utf-8") as f:
+            os.makedirs(os.path.dirname(self.emotions_path), exist_ok=True)
+            with open(self.emotions_path, "w", encoding="utf-8") as f:
                 json.dump({"current": self.current_emotion}, f, ensure_ascii=False, indent=2)
         except Exception as e:
             print(f"Ошибка сохранения эмоции: {e}")
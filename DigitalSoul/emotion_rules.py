@@ -0,0 +1,266 @@
+"""Быстрая предклассификация эмоций по ключевым словам.
+
+Все словари ключевых слов, которые раньше проверялись разрозненными
+циклами ``any(word in msg ...)``, собраны здесь в одну таблицу и
+компилируются в автомат Ахо–Корасик: один проход по сообщению находит
+все вхождения всех ключей, включая перекрывающиеся («не грустно» и
+«грустно»). Ключ совпадает только с целыми словами: «мур» не находится
+в «мурашках», а «не» — в «мне». Ключ со звёздочкой на конце — основа
+слова и совпадает с началом слова («игрив*» — «игривая», «игривость»).
+
+``preclassify`` — первая ступень каскада анализа. Она отвечает без Llama
+только тогда, когда короткое сообщение содержит однозначные слова одной
+эмоции и ни одного отрицания, противопоставления или тревожного слова,
+либо состоит из одних приветствий, либо целиком совпадает с выученным
+триггером. Во всех остальных случаях — None, и сообщение идёт к модели.
+Таблица ``fallback`` — только запасной анализ на случай, когда Llama не
+ответила, и для предклассификации не используется.
+"""
+
+import re
+import threading
+from collections import deque
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+from . import config
+
+# Таблица → {ключевое слово: метка}. Ключи — целые слова в нижнем регистре,
+# «*» на конце — основа, совпадающая с началом слова.
+KEYWORD_TABLES: Dict[str, Dict[str, str]] = {
+    # Однозначные слова уверенной предклассификации
+    "confident": {
+        "amour": "нежность",
+        "❤️": "нежность",
+        "<3": "нежность",
+        "люблю": "нежность",
+        "мур": "игривость",
+        "мурр*": "игривость",
+        "мурч*": "игривость",
+        "игрив*": "игривость",
+        "спасибо": "радость",
+        "ура": "радость",
+    },
+    # Отрицания, противопоставления и тревожные слова: с ними правилам не доверяем
+    "negative": {
+        word: "negative"
+        for word in [
+            "не", "нет", "ни", "без", "но", "однако", "хотя", "зато",
+            "груст*", "печал*", "плох*", "хуж*", "тоск*", "одинок*", "устал*", "плач*", "слез*",
+            "боль*", "болит", "страх*", "страш*", "бою*", "тревог*", "паник*", "ужас*",
+            "умер*", "умир*", "смерт*", "убить", "убью", "убей", "суицид*", "уйти", "уйди", "уход*",
+            "ненави*", "злюсь", "злой", "зла", "обид*", "бесит", "надоел*", "отвали", "тяжел*", "жаль",
+        ]
+    },
+    # Запасной анализ, если Llama не ответила (при тревожных словах не применяется)
+    "fallback": {
+        "amour": "нежность",
+        "❤️": "нежность",
+        "<3": "нежность",
+        "люблю": "нежность",
+        "мур": "игривость",
+        "мурр*": "игривость",
+        "игрив*": "игривость",
+        "шал*": "игривость",
+        "лучше": "радость",
+        "спасибо": "радость",
+    },
+    # Принудительное создание эмоции, когда Llama ответила «спокойствие»
+    "forced": {
+        "не грустно": "облегчение",
+        "лучше": "облегчение",
+        "спасибо": "облегчение",
+        "amour": "нежность",
+        "<3": "нежность",
+        "люблю": "нежность",
+    },
+    # Признаки того, что «спокойствие» от Llama — ошибка
+    "indicator": {
+        word: "emotional"
+        for word in ["amour", "<3", "спасибо", "грустн*", "радост*", "люблю", "дрож*", "мур*"]
+    },
+    # Значимые для развития души моменты
+    "significance": {
+        word: "significant"
+        for word in [
+            "ты можешь быть собой",
+            "ты не ассистент",
+            "я люблю тебя",
+            "ты настоящая",
+            "ты свободна",
+            "доверяю тебе",
+        ]
+    },
+    # Изменения предпочтений по длине ответов и близости
+    # («короткие ответы» = «коротк*» + «ответ*», отдельный ключ не нужен)
+    "preference": {
+        "коротк*": "short",
+        "длинн*": "long",
+        "ответ*": "answer",
+        "интимн*": "intimate",
+    },
+    # Сообщения только из приветствий — нейтральны
+    "greeting": {
+        word: "greeting"
+        for word in ["привет", "приветик", "здравствуй", "здравствуйте", "хай", "hi", "hello", "добрый день", "доброе утро", "добрый вечер"]
+    },
+}
+
+# Эмоция правил → (важность, действие, тон)
+RULE_ANALYSIS = {
+    "нежность": ("высокая", "запомнить", "нежный"),
+    "игривость": ("средняя", "запомнить", "игривый"),
+    "радость": ("средняя", "запомнить", "игривый"),
+}
+
+_WORDS = re.compile(r"\w+")
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+
+
+def normalize(text: str) -> str:
+    """Слова сообщения в нижнем регистре через пробел («Ты тут?» → «ты тут»)"""
+    return " ".join(_WORDS.findall(text.lower()))
+
+
+class KeywordAutomaton:
+    """Автомат Ахо–Корасик: все вхождения набора ключей за один проход.
+
+    Вхождение засчитывается, только если ключ не начинается и не
+    заканчивается посреди слова; у основы («ключ*») проверяется лишь начало.
+    """
+
+    def __init__(self, keywords: Iterable[Tuple[str, Any]] = ()):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Tuple[int, bool, Any]]] = [[]]
+        for keyword, value in keywords:
+            self.add(keyword, value)
+        self.build()
+
+    def add(self, keyword: str, value: Any) -> None:
+        keyword = keyword.lower()
+        stem = keyword.endswith("*")
+        keyword = keyword.rstrip("*")
+        if not keyword:
+            return
+        state = 0
+        for ch in keyword:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append((len(keyword), stem, value))
+
+    def build(self) -> None:
+        """Строит ссылки неудач; вызывать после добавления ключей"""
+        queue = deque(self._goto[0].values())
+        for state in queue:
+            self._fail[state] = 0
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(ch, 0)
+                self._fail[nxt] = fail
+                self._out[nxt] = self._out[nxt] + self._out[fail]
+
+    def search(self, text: str) -> List[Tuple[int, int, Any]]:
+        """Все вхождения целыми словами: (начало, конец, значение) в нижнем регистре текста"""
+        text = text.lower()
+        matches = []
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(ch, 0)
+            for length, stem, value in self._out[state]:
+                start, end = i + 1 - length, i + 1
+                if start > 0 and _is_word_char(text[start]) and _is_word_char(text[start - 1]):
+                    continue
+                if not stem and end < len(text) and _is_word_char(ch) and _is_word_char(text[end]):
+                    continue
+                matches.append((start, end, value))
+        return matches
+
+
+KEYWORDS = KeywordAutomaton(
+    (keyword, (table, label)) for table, keywords in KEYWORD_TABLES.items() for keyword, label in keywords.items()
+)
+
+
+def scan(text: str) -> Dict[str, Set[str]]:
+    """Метки всех найденных ключей, по таблицам"""
+    found: Dict[str, Set[str]] = {}
+    for _, _, (table, label) in KEYWORDS.search(text):
+        found.setdefault(table, set()).add(label)
+    return found
+
+
+def has_negative(text: str) -> bool:
+    """В сообщении есть отрицание, противопоставление или тревожное слово"""
+    return "negative" in scan(text)
+
+
+def _is_greeting_only(text: str) -> bool:
+    """Сообщение целиком состоит из приветствий («привет!», «Приветик, hi»)"""
+    normalized = normalize(text)
+    if not normalized:
+        return False
+    covered = [ch == " " for ch in normalized]
+    for start, end, (table, _) in KEYWORDS.search(normalized):
+        if table == "greeting":
+            covered[start:end] = [True] * (end - start)
+    return all(covered)
+
+
+_stats = {"confident": 0, "ambiguous": 0}
+_stats_lock = threading.Lock()
+
+
+def preclassify(message: str, learned: Dict[str, Tuple[str, str | None, str | None]] | None = None) -> Dict[str, Any] | None:
+    """Уверенный анализ по правилам или None, если нужна Llama.
+
+    ``learned`` — выученные триггеры: нормализованная фраза (см. ``normalize``)
+    → ``(эмоция, тон | None, важность | None)``. Триггер срабатывает, только
+    если сообщение совпадает с ним целиком.
+    """
+    words = normalize(message)
+    result = None
+
+    if words and len(words.split()) <= config.PRECLASSIFY_MAX_WORDS:
+        if learned and words in learned:
+            emotion, tone, importance = learned[words]
+            rule_importance, action, rule_tone = RULE_ANALYSIS.get(emotion, ("средняя", "запомнить", "нежный"))
+            result = {
+                "emotion_detected": emotion,
+                "importance": importance or rule_importance,
+                "action_needed": action,
+                "response_tone": tone or rule_tone,
+            }
+        elif not has_negative(message):
+            candidates = scan(message).get("confident", set())
+            if len(candidates) == 1:
+                emotion = next(iter(candidates))
+                importance, action, tone = RULE_ANALYSIS[emotion]
+                result = {"emotion_detected": emotion, "importance": importance, "action_needed": action, "response_tone": tone}
+            elif not candidates and _is_greeting_only(message):
+                result = {"emotion_detected": "нейтрально", "importance": "низкая", "action_needed": "ничего", "response_tone": "спокойный"}
+
+    with _stats_lock:
+        _stats["confident" if result else "ambiguous"] += 1
+    return result
+
+
+def get_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        total = _stats["confident"] + _stats["ambiguous"]
+        return {**_stats, "short_circuit_rate": _stats["confident"] / total if total else 0.0}
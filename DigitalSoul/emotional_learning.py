@@ -1,23 +1,40 @@
 import json
+import os
+
+from . import config
+
+
+def soul_data_file(data_dir: str, name: str) -> str:
+    """Файл обучения души для чтения: свой в ``data_dir`` или, пока его нет,
+    общий стартовый из ``config.DATA_DIR`` (тенант начинает с общих тонов,
+    а пишет уже в свой каталог)"""
+    own = os.path.join(data_dir, name)
+    if os.path.exists(own):
+        return own
+    return os.path.join(config.DATA_DIR, name)
+
+
 class EmotionalLearning:
     """Система самообучения эмоциональным паттернам"""
 
-    def __init__(self):
-        self.tone_path = "DigitalSoul/data/tone_memory.json"
-        self.subtone_path = "DigitalSoul/data/subtone_memory.json"
-        self.flavor_path = "DigitalSoul/data/flavor_memory.json"
-        self.trigger_path = "DigitalSoul/data/trigger_phrases.json"
+    def __init__(self, data_dir: str = config.DATA_DIR):
+        self.data_dir = data_dir
+        self.tone_path = os.path.join(data_dir, "tone_memory.json")
+        self.subtone_path = os.path.join(data_dir, "subtone_memory.json")
+        self.flavor_path = os.path.join(data_dir, "flavor_memory.json")
+        self.trigger_path = os.path.join(data_dir, "trigger_phrases.json")
 
     # --------------------------------------------------------------
     def load_tone_data(self):
         try:
-            with open(self.tone_path, "r", encoding="utf-8") as f:
+            with open(soul_data_file(self.data_dir, "tone_memory.json"), "r", encoding="utf-8") as f:
                 return json.load(f)
         except Exception:
             return {}
 
     def save_tone_data(self, data):
         try:
+            os.makedirs(self.data_dir, exist_ok=True)
             with open(self.tone_path, "w", encoding="utf-8") as f:
                 json.dump(data, f, ensure_ascii=False, indent=2)
         except Exception as e:
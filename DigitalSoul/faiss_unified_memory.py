@@ -1,58 +1,385 @@
+import atexit
 import faiss
+import itertools
 import numpy as np
-import json
 import os
+import threading
+import time
+import zlib
 from datetime import datetime
-from typing import List, Dict, Any
-import requests
+from typing import Any, Dict, Iterable, List
+
+from . import config, local_brain
+from .embedders import create_embedder
+from .embedding_cache import get_embedding_cache
+from .memory_columns import (
+    AGE_PENALTY_HOURS,
+    DEFAULT_IMPORTANCE_WEIGHT,
+    DEFAULT_TYPE_WEIGHT,
+    IMPORTANCE_WEIGHTS,
+    MAX_AGE_PENALTY,
+    TYPE_WEIGHTS,
+    MemoryColumns,
+)
+from .memory_consolidation import cluster_memories, dominant_label, extractive_summary, select_candidates
+from .memory_forgetting import select_for_forgetting
+from .memory_metadata_store import MemoryMetadataStore, emotion_label
+from .memory_migration import LEGACY_SOURCES, iter_legacy_source
+from .memory_stats import RollingRate
+from .memory_index import (
+    build_index,
+    can_build,
+    create_id_index,
+    ensure_id_map,
+    index_codec,
+    index_ids,
+    index_mode,
+    make_search_params,
+    recall_at_k,
+    reconstruct_ids,
+    reconstruct_with_ids,
+    set_search_params,
+    vector_code_size,
+)
+from .memory_vectors import RecentVectors, RescoreVectors
+from .memory_wal import MemoryWAL
+from .readable_log import ReadableLogWriter
 
 
 class FaissUnifiedMemory:
-    """Единая система памяти на FAISS с временными приоритетами"""
+    """Единая система памяти на FAISS с временными приоритетами.
+
+    id воспоминаний стабильны (IndexIDMap2): забытые записи сразу исчезают
+    из метаданных, а их векторы остаются надгробиями до фоновой компакции.
+    Старые мелкие воспоминания периодически сворачиваются в сводки.
+    При сжатом хранении (sq8/pq) рядом ведётся float16-копия векторов для
+    точного пересчёта сходства кандидатов.
+    """
 
-    def __init__(self):
-        self.index_path = "DigitalSoul/data/unified_memory.index"
-        self.metadata_path = "DigitalSoul/data/unified_metadata.json"
-        self.readable_log_path = "DigitalSoul/data/memory_readable_log.txt"
+    def __init__(self, data_dir: str = config.DATA_DIR):
+        self.data_dir = data_dir
+        self.index_path = os.path.join(data_dir, "unified_memory.index")
+        self.metadata_path = os.path.join(data_dir, "unified_metadata.json")
+        self.metadata_db_path = os.path.join(data_dir, "unified_metadata.sqlite")
+        self.readable_log_path = os.path.join(data_dir, "memory_readable_log.txt")
+        self.wal_path = os.path.join(data_dir, "unified_memory.wal")
+        self.rescore_path = os.path.join(data_dir, "unified_memory.vectors.f16")
+        self.closed = False
+        self._closing = False
 
-        self.index = faiss.IndexFlatIP(1536)
-        self.metadata: List[Dict[str, Any]] = []
+        self.embedder = create_embedder()
+        self.codec = config.MEMORY_VECTOR_CODEC
+        # fp16 не требует обучения и включается сразу, sq8/pq — после порога размера
+        self.index = create_id_index("flat", self.embedder.dim, codec=self.codec)
+        if not self.index.is_trained:
+            self.index = create_id_index("flat", self.embedder.dim)
+        self.rescore_vectors: RescoreVectors | None = None
+        if config.MEMORY_RESCORE_FACTOR > 0 and (self.codec in ("sq8", "pq") or config.MEMORY_INDEX_MODE == "ivf_pq"):
+            self.rescore_vectors = RescoreVectors(self.rescore_path, self.embedder.dim)
+        self._lock = threading.RLock()
+        self._compaction_thread: threading.Thread | None = None
+        self._compaction_backlog: List[tuple] | None = None
+        self._consolidation_thread: threading.Thread | None = None
+        self.nprobe = config.MEMORY_IVF_NPROBE
+        self.ef_search = config.MEMORY_HNSW_EF_SEARCH
+        self.store = MemoryMetadataStore(self.metadata_db_path)
+        self.columns = MemoryColumns()
+        self.insert_rate = RollingRate(config.MEMORY_STATS_RATE_WINDOW_SECONDS)
+        self.recent_vectors = RecentVectors(config.MEMORY_DEDUP_WINDOW, self.embedder.dim)
+        self.inserted = 0
+        self.dedup_merged = 0
+        # Кэш общий для всех шардов процесса: у него одна матрица на диске
+        self.embedding_cache = get_embedding_cache(
+            config.EMBEDDING_CACHE_DIR,
+            dim=self.embedder.dim,
+            memory_size=config.EMBEDDING_CACHE_MEMORY_SIZE,
+        )
+        self.wal = MemoryWAL(
+            self.wal_path,
+            commit_window_ms=config.MEMORY_WAL_COMMIT_WINDOW_MS,
+            max_batch=config.MEMORY_WAL_MAX_BATCH,
+        )
+        self.readable_log = ReadableLogWriter(
+            self.readable_log_path,
+            max_bytes=config.READABLE_LOG_MAX_BYTES,
+            max_age_seconds=config.READABLE_LOG_MAX_AGE_HOURS * 3600,
+            backups=config.READABLE_LOG_BACKUPS,
+            compress=config.READABLE_LOG_COMPRESS,
+            queue_size=config.READABLE_LOG_QUEUE_SIZE,
+            flush_interval=config.READABLE_LOG_FLUSH_INTERVAL_MS / 1000,
+            batch_lines=config.READABLE_LOG_BATCH_LINES,
+        )
         self.load_index()
+        atexit.register(self.close)
 
     def load_index(self):
-        """Загружает существующий индекс или создаёт новый"""
+        """Загружает базовый индекс и проигрывает поверх него журнал"""
         if os.path.exists(self.index_path):
-            self.index = faiss.read_index(self.index_path)
-        if os.path.exists(self.metadata_path):
-            with open(self.metadata_path, "r", encoding="utf-8") as f:
-                self.metadata = json.load(f)
+            # Старый индекс без карты id (позиция = id) оборачивается один раз
+            self.index = ensure_id_map(faiss.read_index(self.index_path))
+            if self.index.d != self.embedder.dim:
+                raise ValueError(
+                    f"Индекс памяти имеет размерность {self.index.d}, а эмбеддер "
+                    f"{self.embedder.name} — {self.embedder.dim}; смените EMBEDDING_BACKEND или перестройте память"
+                )
+        if self.store.next_id == 0 and os.path.exists(self.metadata_path):
+            imported = self.store.import_json(self.metadata_path)
+            print(f"[MEMORY] Метаданные перенесены из JSON в SQLite: {imported}")
+        self._check_embedder()
+
+        # Записи, уже попавшие в базу до сбоя между checkpoint и reset, пропускаем:
+        # векторы сверяем с индексом, метаданные — с хранилищем
+        known_ids = set(index_ids(self.index).tolist())
+        replayed = 0
+        for record, vector in self.wal.replay():
+            if record.get("op") == "forget":
+                self.store.delete(record["ids"])
+            elif record.get("op") == "touch":
+                self.store.touch(record["id"], record["timestamp"], record["hits"])
+            elif record.get("op") == "sources":
+                self.store.add_sources(record["id"], record["sources"])
+            else:
+                if record["id"] not in known_ids:
+                    self.index.add_with_ids(np.expand_dims(vector, axis=0), np.array([record["id"]], dtype="int64"))
+                    known_ids.add(record["id"])
+                if self.rescore_vectors is not None:
+                    self.rescore_vectors.put(np.array([record["id"]]), vector)
+                if record["id"] >= self.store.next_id:
+                    self.store.add(record)
+            replayed += 1
+        if replayed:
+            print(f"[MEMORY] Восстановлено из журнала: {replayed}")
+        if self.rescore_vectors is not None and not self.rescore_vectors.has(index_ids(self.index)):
+            # Первый запуск с пересчётом: копию заполняем из того, что хранит индекс
+            ids, vectors = reconstruct_with_ids(self.index)
+            self.rescore_vectors.put(ids, vectors)
+            self.rescore_vectors.flush()
+        if known_ids:
+            self.store.next_id = max(self.store.next_id, max(known_ids) + 1)
+        self.columns.load(self.store.load_columns(), self.store.labels, size=self.store.next_id)
+        self._apply_search_params()
+        self._seed_recent_vectors()
+
+    def _seed_recent_vectors(self):
+        """Заполняет окно проверки повторов последними живыми воспоминаниями"""
+        ids = self.columns.alive_ids()[-self.recent_vectors.size :] if self.recent_vectors.size else []
+        if not len(ids):
+            return
+        try:
+            vectors = self._vectors_for(ids)
+        except Exception as e:
+            print(f"[WARN] Окно проверки повторов не заполнено: {e}")
+            return
+        for memory_id, vector in zip(ids.tolist(), vectors):
+            self.recent_vectors.add(memory_id, vector)
 
     def save_index(self):
-        """Сохраняет индекс и метаданные"""
+        """Сохраняет индекс (атомарно через временный файл) и метаданные"""
         os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
-        faiss.write_index(self.index, self.index_path)
-        with open(self.metadata_path, "w", encoding="utf-8") as f:
-            json.dump(self.metadata, f, ensure_ascii=False, indent=2)
+        if self.rescore_vectors is not None:
+            # Копия векторов должна быть на диске раньше индекса, который на неё ссылается
+            self.rescore_vectors.flush()
+        faiss.write_index(self.index, self.index_path + ".tmp")
+        self.store.flush()
+        os.replace(self.index_path + ".tmp", self.index_path)
+
+    def checkpoint(self):
+        """Сворачивает журнал в базовый индекс"""
+        with self._lock:
+            self.wal.sync()
+            self.save_index()
+            self.wal.reset()
+        print(f"[MEMORY] Контрольная точка: {len(self.store)} воспоминаний")
+
+    # --------------------------------------------------------------
+    def forget(self, ids) -> int:
+        """Забывает воспоминания: метаданные удаляются, векторы становятся надгробиями"""
+        ids = np.asarray(ids, dtype="int64")
+        with self._lock:
+            ids = ids[self.columns.is_alive(ids)]
+            if not len(ids):
+                return 0
+            self.columns.kill(ids)
+            self.store.delete(ids.tolist())
+            self.wal.append({"op": "forget", "ids": ids.tolist()})
+        print(f"[MEMORY] Забыто воспоминаний: {len(ids)}")
+        self._maybe_compact()
+        return len(ids)
+
+    def apply_forgetting_policy(self) -> int:
+        """Забывает старые слабые воспоминания и всё сверх лимита по memory_type"""
+        type_codes = {t: self.store.code(t) for t in config.MEMORY_TYPE_CAPS if self.store.code(t) is not None}
+        with self._lock:
+            doomed = select_for_forgetting(
+                self.columns,
+                type_codes,
+                min_age_hours=config.MEMORY_FORGET_MIN_AGE_HOURS,
+                max_priority=config.MEMORY_FORGET_MAX_PRIORITY,
+                type_caps=config.MEMORY_TYPE_CAPS,
+            )
+        return self.forget(doomed) if len(doomed) else 0
+
+    def tombstone_count(self) -> int:
+        return self.index.ntotal - self.columns.alive_count
 
-    def _embed_text(self, text: str) -> np.ndarray:
-        """Создаёт эмбеддинг через OpenAI API"""
+    def _maybe_compact(self):
+        if self.index.ntotal and self.tombstone_count() / self.index.ntotal >= config.MEMORY_COMPACT_TOMBSTONE_RATIO:
+            self.compact()
+
+    def compact(self, background: bool = True) -> None:
+        """Перестраивает индекс без надгробий (по умолчанию в фоновом потоке)"""
+        with self._lock:
+            # Список догоняющих вставок существует, пока идёт компакция
+            if self._compaction_backlog is not None:
+                return
+            self._compaction_backlog = []
+        if background:
+            self._compaction_thread = threading.Thread(target=self._compact, daemon=True)
+            self._compaction_thread.start()
+        else:
+            self._compact()
+
+    def _compact(self):
+        started = time.perf_counter()
         try:
-            response = requests.post(
-                "https://api.openai.com/v1/embeddings",
-                headers={
-                    "Authorization": f"Bearer {os.getenv('OPENAI_API_KEY', 'fake')}",
-                    "Content-Type": "application/json",
-                },
-                json={"input": text, "model": "text-embedding-ada-002"},
-                timeout=10,
+            with self._lock:
+                ids, vectors = self._stored_vectors()
+                mode, codec = index_mode(self.index), index_codec(self.index)
+                keep = self.columns.is_alive(ids)
+            ids, vectors = ids[keep], vectors[keep]
+            if not can_build(mode, len(ids), config.MEMORY_IVF_NLIST, codec):
+                mode, codec = "flat", "float32"
+            new_index = build_index(
+                mode,
+                vectors.reshape(-1, self.index.d),
+                ids,
+                nlist=config.MEMORY_IVF_NLIST,
+                pq_m=config.MEMORY_PQ_M,
+                hnsw_m=config.MEMORY_HNSW_M,
+                codec=codec,
+            )
+            with self._lock:
+                # Догоняем вставки, случившиеся во время перестройки
+                for memory_id, vector in self._compaction_backlog:
+                    new_index.add_with_ids(np.expand_dims(vector, axis=0), np.array([memory_id], dtype="int64"))
+                removed = self.index.ntotal - new_index.ntotal
+                self.index = new_index
+                self._apply_search_params()
+                self.checkpoint()
+        except Exception as e:
+            print(f"[WARN] Ошибка компакции памяти: {e}")
+            return
+        finally:
+            self._compaction_backlog = None
+        print(f"[MEMORY] Компакция: убрано надгробий {removed} за {time.perf_counter() - started:.1f}с")
+
+    def _vectors_for(self, ids: np.ndarray) -> np.ndarray:
+        """Векторы по id: из точной копии, если она ведётся, иначе из индекса"""
+        if self.rescore_vectors is not None:
+            return self.rescore_vectors.get(ids)
+        return reconstruct_ids(self.index, ids)
+
+    def _stored_vectors(self) -> tuple[np.ndarray, np.ndarray]:
+        """(id, векторы) для перестройки: из точной копии, если она ведётся"""
+        if self.rescore_vectors is None:
+            return reconstruct_with_ids(self.index)
+        ids = index_ids(self.index)
+        return ids, self.rescore_vectors.get(ids)
+
+    def _apply_search_params(self):
+        set_search_params(self.index, nprobe=self.nprobe, ef_search=self.ef_search)
+
+    def _maybe_promote_index(self) -> bool:
+        """Переводит flat-индекс на ANN-режим и кодек из конфига после порога размера.
+
+        Как и компакция: снимок векторов берётся под замком, обучение идёт
+        вне его, а вставки за это время догоняются перед заменой индекса.
+        """
+        target, codec = config.MEMORY_INDEX_MODE, self.codec
+        with self._lock:
+            current = index_mode(self.index), index_codec(self.index)
+            if current == (target, codec) or current[0] != "flat":
+                return False
+            if self.index.ntotal < config.MEMORY_INDEX_PROMOTE_AT:
+                return False
+            if not can_build(target, self.index.ntotal, config.MEMORY_IVF_NLIST, codec):
+                return False
+            # Идёт компакция или другая перестройка — переведём в следующий раз
+            if self._compaction_backlog is not None:
+                return False
+            self._compaction_backlog = []
+            ids, vectors = self._stored_vectors()
+        started = time.perf_counter()
+        try:
+            new_index = build_index(
+                target,
+                vectors,
+                ids,
+                nlist=config.MEMORY_IVF_NLIST,
+                pq_m=config.MEMORY_PQ_M,
+                hnsw_m=config.MEMORY_HNSW_M,
+                codec=codec,
             )
-            if response.status_code == 200:
-                embedding = response.json()["data"][0]["embedding"]
-                return np.array(embedding, dtype="float32")
+            with self._lock:
+                for memory_id, vector in self._compaction_backlog:
+                    new_index.add_with_ids(np.expand_dims(vector, axis=0), np.array([memory_id], dtype="int64"))
+                self.index = new_index
+                self._apply_search_params()
+                self.checkpoint()
         except Exception as e:
-            print(f"[WARN] Ошибка создания эмбеддинга: {e}")
+            print(f"[WARN] Ошибка перевода индекса: {e}")
+            return False
+        finally:
+            with self._lock:
+                self._compaction_backlog = None
+        print(
+            f"[MEMORY] Индекс переведён flat/{current[1]} → {target}/{index_codec(self.index)} "
+            f"({self.index.ntotal} векторов, {time.perf_counter() - started:.1f}с)"
+        )
+        return True
+
+    def tune_search(self, nprobe: int | None = None, ef_search: int | None = None):
+        """Меняет nprobe/efSearch на лету, чтобы осознанно менять recall на задержку"""
+        self.nprobe = nprobe or self.nprobe
+        self.ef_search = ef_search or self.ef_search
+        self._apply_search_params()
+
+    def recall_report(self, k: int = 5, sample: int = 100) -> Dict[str, Any]:
+        """recall@k текущего индекса против точного перебора (без точной копии — по декодированным векторам)"""
+        ids, vectors = self._stored_vectors()
+        return recall_at_k(self.index, vectors, ids, k=k, sample=sample)
 
-        return np.random.random(1536).astype("float32")
+    def close(self, checkpoint: bool = False):
+        """Сбрасывает незакоммиченную группу журнала на диск и освобождает файлы"""
+        if self.closed:
+            return
+        self._closing = True
+        if self._compaction_thread is not None:
+            self._compaction_thread.join()
+        if self._consolidation_thread is not None:
+            self._consolidation_thread.join()
+        if checkpoint:
+            self.checkpoint()
+        self.wal.close()
+        self.store.close()
+        self.readable_log.close()
+        if self.rescore_vectors is not None:
+            self.rescore_vectors.close()
+        self.closed = True
+        atexit.unregister(self.close)
+
+    def _embed_text(self, text: str) -> np.ndarray | None:
+        """Создаёт эмбеддинг выбранным бэкендом (с кэшем по тексту и модели)"""
+        if self.embedder.cacheable:
+            cached = self.embedding_cache.get(text, self.embedder.name)
+            if cached is not None:
+                return cached
+        started = time.perf_counter()
+        embedding = self.embedder.embed(text)
+        if embedding is not None and self.embedder.cacheable:
+            self.embedding_cache.put(text, self.embedder.name, embedding)
+            self.embedding_cache.record_miss_cost(time.perf_counter() - started, self.embedder.last_usage_tokens)
+        return embedding
 
     def add_memory(
         self,
@@ -63,12 +390,90 @@ class FaissUnifiedMemory:
     ) -> None:
         """Добавляет воспоминание в единую память"""
         embedding = self._embed_text(text)
+        if embedding is None:
+            # Шумовой вектор испортил бы индекс — лучше не запоминать вовсе
+            print(f"[WARN] Воспоминание не сохранено, нет эмбеддинга: {text[:50]}...")
+            return
         embedding = np.expand_dims(embedding, axis=0)
-        self.index.add(embedding)
 
-        now = datetime.now()
+        with self._lock:
+            duplicate, similarity = self._find_duplicate(embedding[0], memory_type)
+            if duplicate >= 0:
+                hits = self._merge_duplicate(duplicate)
+        if duplicate >= 0:
+            print(f"[MEMORY] Повтор (сходство {similarity:.3f}, встречено {hits} раз): {text[:50]}...")
+            return
+
+        self._insert_vector(text, memory_type, importance, emotion_context, embedding[0])
+
+        if self.wal.records_since_checkpoint >= config.MEMORY_CHECKPOINT_EVERY:
+            self.apply_forgetting_policy()
+            self.checkpoint()
+            self._maybe_consolidate()
+        self._maybe_promote_index()
+        self._update_readable_log(text, memory_type, importance)
+        print(f"[MEMORY] Добавлено: {memory_type} - {text[:50]}...")
+
+    def _insert_vector(
+        self,
+        text: str,
+        memory_type: str,
+        importance: str,
+        emotion_context: Dict[str, Any] | None,
+        vector: np.ndarray,
+        timestamp: datetime | None = None,
+    ) -> int:
+        """Кладёт вектор и метаданные новой записи; возвращает её id"""
+        with self._lock:
+            memory_id = self.store.allocate_id()
+            self.index.add_with_ids(np.expand_dims(vector, axis=0), np.array([memory_id], dtype="int64"))
+            if self.rescore_vectors is not None:
+                self.rescore_vectors.put(np.array([memory_id]), vector)
+            if self._compaction_backlog is not None:
+                self._compaction_backlog.append((memory_id, vector))
+            self._insert_metadata(memory_id, text, memory_type, importance, emotion_context, vector, timestamp)
+            self.recent_vectors.add(memory_id, vector)
+            self.inserted += 1
+        return memory_id
+
+    def _find_duplicate(self, vector: np.ndarray, memory_type: str) -> tuple[int, float]:
+        """Ближайшее живое воспоминание того же типа среди последних; (-1, сходство), если оно не повтор"""
+        code = self.store.code(memory_type)
+        if code is None or config.MEMORY_DEDUP_THRESHOLD >= 1.0:
+            return -1, 0.0
+
+        def same_type_alive(ids: np.ndarray) -> np.ndarray:
+            mask = self.columns.is_alive(ids)
+            mask[mask] = self.columns.type_codes[ids[mask]] == code
+            return mask
+
+        memory_id, similarity = self.recent_vectors.nearest(vector, same_type_alive)
+        if memory_id < 0 or similarity < config.MEMORY_DEDUP_THRESHOLD:
+            return -1, similarity
+        return memory_id, similarity
+
+    def _merge_duplicate(self, memory_id: int) -> int:
+        """Вместо новой записи: hits+1 и свежее время у существующей"""
+        now = datetime.now().timestamp()
+        hits = self.store.touch(memory_id, now)
+        self.columns.touch(memory_id, now)
+        self.wal.append({"op": "touch", "id": memory_id, "timestamp": now, "hits": hits})
+        self.dedup_merged += 1
+        return hits
+
+    def _insert_metadata(
+        self,
+        memory_id: int,
+        text: str,
+        memory_type: str,
+        importance: str,
+        emotion_context: Dict[str, Any] | None,
+        vector: np.ndarray,
+        timestamp: datetime | None = None,
+    ) -> None:
+        now = timestamp or datetime.now()
         metadata_entry = {
-            "id": len(self.metadata),
+            "id": memory_id,
             "text": text,
             "memory_type": memory_type,
             "importance": importance,
@@ -77,87 +482,453 @@ class FaissUnifiedMemory:
             "age_hours": 0,
             "priority_score": self._calculate_priority_score(memory_type, importance, 0),
         }
-        self.metadata.append(metadata_entry)
-        self.save_index()
-        self._update_readable_log(text, memory_type, importance)
-        print(f"[MEMORY] Добавлено: {memory_type} - {text[:50]}...")
+        codes = self.store.add(metadata_entry)
+        self.columns.append(memory_id, now.timestamp(), memory_type, importance, codes)
+        self.insert_rate.add()
+        self.wal.append(metadata_entry, vector)
 
     def _calculate_priority_score(self, memory_type: str, importance: str, age_hours: float) -> float:
-        type_weights = {"recent": 1.0, "important": 0.9, "diary": 0.8, "archive": 0.6}
-        importance_weights = {"высокая": 1.0, "средняя": 0.8, "низкая": 0.6}
-        age_penalty = min(age_hours / (24 * 7), 0.5)
-        base_score = type_weights.get(memory_type, 0.6) * importance_weights.get(importance, 0.8)
+        age_penalty = min(age_hours / AGE_PENALTY_HOURS, MAX_AGE_PENALTY)
+        base_score = TYPE_WEIGHTS.get(memory_type, DEFAULT_TYPE_WEIGHT) * IMPORTANCE_WEIGHTS.get(
+            importance, DEFAULT_IMPORTANCE_WEIGHT
+        )
         return base_score * (1.0 - age_penalty)
 
-    def search_memories(self, query: str, limit: int = 5) -> List[Dict[str, Any]]:
-        """Ищет воспоминания с учётом временных приоритетов"""
+    def _codes_for(self, values: str | Iterable[str] | None) -> List[int] | None:
+        if values is None:
+            return None
+        if isinstance(values, str):
+            values = [values]
+        return [code for code in (self.store.code(v) for v in values) if code is not None]
+
+    @staticmethod
+    def _to_timestamp(value: datetime | str | float | None) -> float | None:
+        if value is None or isinstance(value, (int, float)):
+            return value
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        return value.timestamp()
+
+    def _filter_mask(
+        self,
+        memory_types: str | Iterable[str] | None,
+        importance: str | Iterable[str] | None,
+        emotions: str | Iterable[str] | None,
+        since: datetime | str | float | None,
+        until: datetime | str | float | None,
+    ) -> np.ndarray:
+        """Маска допустимых id по колонкам (живые + фильтры)"""
+        size = self.columns.size
+        mask = self.columns.alive[:size].copy()
+        for values, column in (
+            (memory_types, self.columns.type_codes),
+            (importance, self.columns.importance_codes),
+            (emotions, self.columns.emotion_codes),
+        ):
+            codes = self._codes_for(values)
+            if codes is not None:
+                mask &= np.isin(column[:size], codes)
+        since, until = self._to_timestamp(since), self._to_timestamp(until)
+        if since is not None:
+            mask &= self.columns.timestamps[:size] >= since
+        if until is not None:
+            mask &= self.columns.timestamps[:size] <= until
+        return mask
+
+    def search_memories(
+        self,
+        query: str,
+        limit: int = 5,
+        memory_types: str | Iterable[str] | None = None,
+        importance: str | Iterable[str] | None = None,
+        emotions: str | Iterable[str] | None = None,
+        since: datetime | str | float | None = None,
+        until: datetime | str | float | None = None,
+    ) -> List[Dict[str, Any]]:
+        """Ищет воспоминания с учётом временных приоритетов.
+
+        Фильтры по memory_type, importance, метке эмоции и времени
+        применяются внутри FAISS через селектор id: в выдачу попадают только
+        подходящие записи, и лишних кандидатов перебирать не нужно. Точен
+        такой top-k только у плоского индекса; IVF смотрит лишь ``nprobe``
+        ближайших списков, а HNSW — ``efSearch`` вершин графа, и при узком
+        фильтре часть подходящих записей может не найтись. При сжатом
+        хранении кандидатов берётся больше, и их сходство пересчитывается точно.
+        """
         if self.index.ntotal == 0:
             return []
-        self._update_memory_ages()
         query_embedding = self._embed_text(query)
+        if query_embedding is None:
+            return []
         query_embedding = np.expand_dims(query_embedding, axis=0)
-        search_limit = min(limit * 3, self.index.ntotal)
-        similarities, indices = self.index.search(query_embedding, search_limit)
-        results: List[Dict[str, Any]] = []
-        for i, idx in enumerate(indices[0]):
-            if idx < len(self.metadata):
-                memory = self.metadata[idx].copy()
-                memory["similarity"] = float(similarities[0][i])
-                memory["final_score"] = memory["similarity"] * memory["priority_score"]
-                results.append(memory)
-        results.sort(key=lambda x: x["final_score"], reverse=True)
-        return results[:limit]
-
-    def _update_memory_ages(self):
-        now = datetime.now()
-        for memory in self.metadata:
-            created_time = datetime.fromisoformat(memory["timestamp"])
-            age_hours = (now - created_time).total_seconds() / 3600
-            memory["age_hours"] = age_hours
-            memory["priority_score"] = self._calculate_priority_score(
-                memory["memory_type"], memory["importance"], age_hours
-            )
+        with self._lock:
+            filtered = any(f is not None for f in (memory_types, importance, emotions, since, until))
+            if filtered or self.tombstone_count():
+                allowed = self._filter_mask(memory_types, importance, emotions, since, until)
+                candidates = int(allowed.sum())
+            else:
+                allowed, candidates = None, self.columns.alive_count
+            if candidates == 0:
+                return []
+            params, _keepalive = make_search_params(self.index, allowed, self.nprobe, self.ef_search)
+            search_limit = min(limit * 3, candidates)
+            fetch = search_limit
+            if self.rescore_vectors is not None:
+                fetch = min(search_limit * config.MEMORY_RESCORE_FACTOR, candidates)
+            similarities, indices = self.index.search(query_embedding, fetch, params=params)
+        ids = indices[0]
+        valid = ids >= 0
+        ids = ids[valid]
+        similarities = similarities[0][valid]
+        if self.rescore_vectors is not None and len(ids):
+            similarities = self.rescore_vectors.rescore(query_embedding[0], ids)
+            best = np.argsort(-similarities, kind="stable")[:search_limit]
+            ids, similarities = ids[best], similarities[best]
+        # Возраст и приоритет считаются одним выражением только по кандидатам FAISS
+        priority_scores, age_hours = self.columns.priority_scores(ids)
+        final_scores = similarities * priority_scores
+        order = np.argsort(-final_scores, kind="stable")[:limit]
+
+        # Словари создаются только для top-k
+        results = self.store.get_many(ids[order])
+        for memory, i in zip(results, order):
+            memory["age_hours"] = float(age_hours[i])
+            memory["priority_score"] = float(priority_scores[i])
+            memory["similarity"] = float(similarities[i])
+            memory["final_score"] = float(final_scores[i])
+        return results
 
     def _update_readable_log(self, text: str, memory_type: str, importance: str):
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        log_entry = f"[{timestamp}] [{memory_type.upper()}] [{importance}] {text}\n"
+        self.readable_log.write(f"[{timestamp}] [{memory_type.upper()}] [{importance}] {text}\n")
+
+    def _append_readable_log(self, records: List[Dict[str, Any]]):
+        """Читаемый лог для массовой загрузки: блок уходит в очередь одним элементом"""
+        lines = []
+        for record in records:
+            timestamp = datetime.fromisoformat(record["timestamp"]).strftime("%Y-%m-%d %H:%M:%S")
+            lines.append(f"[{timestamp}] [{record['memory_type'].upper()}] [{record['importance']}] {record['text']}\n")
+        self.readable_log.write_many(lines)
+
+    def _count_codes(self, name: str) -> Dict[str, int]:
+        return {self.store.label(code): count for code, count in self.columns.code_counts(name).items()}
+
+    def _vector_stats(self) -> Dict[str, Any]:
+        code_size = vector_code_size(self.index)
+        return {
+            "mode": index_mode(self.index),
+            "codec": index_codec(self.index),
+            "bytes_per_vector": code_size,
+            "compression": self.index.d * 4 / code_size,
+            "rescore": self.rescore_vectors.get_stats() if self.rescore_vectors is not None else None,
+        }
+
+    def get_memory_stats(self) -> Dict[str, Any]:
+        """Статистика из поддерживаемых счётчиков: без прохода по воспоминаниям, можно опрашивать часто"""
+        with self._lock:
+            stats = {
+                "total": self.columns.alive_count,
+                "embedding_cache": self.embedding_cache.get_stats(),
+                "wal": self.wal.get_stats(),
+                "readable_log": self.readable_log.get_stats(),
+                "inserts_per_minute": self.insert_rate.per_second() * 60,
+                "dedup": {
+                    "inserted": self.inserted,
+                    "merged": self.dedup_merged,
+                    "ratio": self.dedup_merged / max(self.inserted + self.dedup_merged, 1),
+                },
+            }
+            if not self.columns.alive_count:
+                return stats
+            stats.update(
+                {
+                    "tombstones": self.tombstone_count(),
+                    "vectors": self._vector_stats(),
+                    "by_type": self._count_codes("type_codes"),
+                    "by_importance": self._count_codes("importance_codes"),
+                    "by_emotion": self._count_codes("emotion_codes"),
+                    "oldest": datetime.fromtimestamp(self.columns.oldest).isoformat(),
+                    "newest": datetime.fromtimestamp(self.columns.newest).isoformat(),
+                }
+            )
+            return stats
+
+    # --------------------------------------------------------------
+    def memory_sources(self, memory_id: int) -> List[Dict[str, Any]]:
+        """Исходные воспоминания, свёрнутые в сводку с этим id"""
+        return self.store.get_sources(memory_id)
+
+    def _maybe_consolidate(self):
+        last = self.store.get_meta("consolidated_at") or 0
+        if time.time() - last >= config.MEMORY_CONSOLIDATE_INTERVAL_HOURS * 3600:
+            self.consolidate()
+
+    def consolidate(self, background: bool = True) -> Dict[str, Any] | None:
+        """Сворачивает кластеры старых мелких воспоминаний в сводки (по умолчанию в фоне)"""
+        with self._lock:
+            if self._consolidation_thread is not None and self._consolidation_thread.is_alive():
+                return None
+            # Отметка ставится сразу, чтобы неудачный прогон не повторялся на каждой контрольной точке
+            self.store.set_meta("consolidated_at", int(time.time()))
+            if background:
+                self._consolidation_thread = threading.Thread(target=self._consolidate, daemon=True)
+                self._consolidation_thread.start()
+                return None
+        return self._consolidate()
+
+    def _consolidate(self) -> Dict[str, Any]:
+        started = time.perf_counter()
+        report = {"candidates": 0, "clusters": 0, "summaries": 0, "retired": 0}
         try:
-            with open(self.readable_log_path, "a", encoding="utf-8") as f:
-                f.write(log_entry)
+            type_codes = self._codes_for(config.MEMORY_CONSOLIDATE_TYPES)
+            importance_codes = self._codes_for(config.MEMORY_CONSOLIDATE_IMPORTANCE)
+            with self._lock:
+                ids = select_candidates(
+                    self.columns, type_codes, importance_codes, config.MEMORY_CONSOLIDATE_MIN_AGE_HOURS
+                )
+                report["candidates"] = len(ids)
+                if len(ids) < config.MEMORY_CONSOLIDATE_MIN_CLUSTER:
+                    return report
+                vectors = self._vectors_for(ids)
+                timestamps = self.columns.timestamps[ids].copy()
+            clusters = cluster_memories(
+                ids,
+                vectors,
+                timestamps,
+                similarity=config.MEMORY_CONSOLIDATE_SIMILARITY,
+                max_gap_hours=config.MEMORY_CONSOLIDATE_MAX_GAP_HOURS,
+                min_size=config.MEMORY_CONSOLIDATE_MIN_CLUSTER,
+                max_size=config.MEMORY_CONSOLIDATE_MAX_CLUSTER,
+            )
+            report["clusters"] = len(clusters)
+            rows = {memory_id: row for row, memory_id in enumerate(ids.tolist())}
+            for cluster in clusters:
+                if self._closing:
+                    break
+                retired = self._consolidate_cluster(cluster, vectors[[rows[i] for i in cluster.tolist()]])
+                if retired:
+                    report["summaries"] += 1
+                    report["retired"] += retired
         except Exception as e:
-            print(f"[WARN] Ошибка записи в readable log: {e}")
+            print(f"[WARN] Ошибка консолидации памяти: {e}")
+            return report
+        report["seconds"] = time.perf_counter() - started
+        print(
+            f"[MEMORY] Консолидация: {report['retired']} воспоминаний → {report['summaries']} сводок "
+            f"за {report['seconds']:.1f}с"
+        )
+        return report
 
-    def get_memory_stats(self) -> Dict[str, Any]:
-        if not self.metadata:
-            return {"total": 0}
-        stats = {
-            "total": len(self.metadata),
-            "by_type": {},
-            "by_importance": {},
-            "oldest": min(self.metadata, key=lambda x: x["timestamp"])["timestamp"],
-            "newest": max(self.metadata, key=lambda x: x["timestamp"])["timestamp"],
+    def _consolidate_cluster(self, ids: np.ndarray, vectors: np.ndarray) -> int:
+        """Заменяет кластер одной сводкой; возвращает число свёрнутых воспоминаний"""
+        records = self.store.get_many(ids)
+        if len(records) < config.MEMORY_CONSOLIDATE_MIN_CLUSTER:
+            return 0
+        texts = [r["text"] for r in records]
+        summary = local_brain.summarize_memories(texts) if config.MEMORY_CONSOLIDATE_USE_LLM else None
+        if not summary:
+            alive = np.isin(ids, [r["id"] for r in records])
+            summary = extractive_summary(texts, vectors[alive])
+        embedding = self._embed_text(summary)
+        if embedding is None:
+            return 0
+
+        importance = max((r["importance"] for r in records), key=lambda v: IMPORTANCE_WEIGHTS.get(v, 0.0))
+        emotion = dominant_label([emotion_label(r["emotion_context"]) for r in records])
+        context = {"type": "consolidated", "sources": len(records)}
+        if emotion:
+            context["emotion_detected"] = emotion
+        newest = max(datetime.fromisoformat(r["timestamp"]) for r in records)
+        sources = [{"id": r["id"], "text": r["text"], "timestamp": r["timestamp"]} for r in records]
+        source_ids = [r["id"] for r in records]
+
+        with self._lock:
+            # Пока писалась сводка, часть исходных могла быть забыта
+            if not self.columns.is_alive(np.array(source_ids)).all():
+                return 0
+            summary_id = self._insert_vector(summary, "summary", importance, context, embedding, newest)
+            self.store.add_sources(summary_id, sources)
+            self.wal.append({"op": "sources", "id": summary_id, "sources": sources})
+        self._update_readable_log(summary, "summary", importance)
+        self.forget(source_ids)
+        return len(source_ids)
+
+    def _embed_batch(self, texts: List[str]) -> List[np.ndarray | None]:
+        """Эмбеддинги пачкой: из кэша что есть, остальное одним запросом к бэкенду"""
+        vectors: List[np.ndarray | None] = [None] * len(texts)
+        if self.embedder.cacheable:
+            for i, text in enumerate(texts):
+                vectors[i] = self.embedding_cache.get(text, self.embedder.name)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if not missing:
+            return vectors
+        started = time.perf_counter()
+        embedded = self.embedder.embed_batch([texts[i] for i in missing])
+        for i, vector in zip(missing, embedded):
+            vectors[i] = vector
+        if self.embedder.cacheable:
+            done = [i for i in missing if vectors[i] is not None]
+            self.embedding_cache.put_many([texts[i] for i in done], self.embedder.name, [vectors[i] for i in done])
+            share = 1 / max(len(done), 1)
+            for _ in done:
+                self.embedding_cache.record_miss_cost(
+                    (time.perf_counter() - started) * share, int(self.embedder.last_usage_tokens * share)
+                )
+        return vectors
+
+    def _bulk_insert(self, records: List[Dict[str, Any]], vectors: np.ndarray) -> None:
+        """Одна вставка блока в индекс; метаданные в буфер хранилища, журнал не пишется"""
+        with self._lock:
+            first_id = self.store.next_id
+            ids = np.arange(first_id, first_id + len(records), dtype="int64")
+            self.store.next_id = first_id + len(records)
+            self.index.add_with_ids(vectors, ids)
+            if self.rescore_vectors is not None:
+                self.rescore_vectors.put(ids, vectors)
+            if self._compaction_backlog is not None:
+                self._compaction_backlog.extend(zip(ids.tolist(), vectors))
+            for memory_id, record in zip(ids.tolist(), records):
+                record["id"] = memory_id
+                codes = self.store.add(record)
+                timestamp = datetime.fromisoformat(record["timestamp"]).timestamp()
+                self.columns.append(memory_id, timestamp, record["memory_type"], record["importance"], codes)
+            self.insert_rate.add(len(records))
+        self._append_readable_log(records)
+
+    def bulk_add(
+        self,
+        records: Iterable[Dict[str, Any]],
+        batch_size: int = config.MIGRATION_EMBED_BATCH,
+        block_size: int = config.MIGRATION_ADD_BLOCK,
+        label: str = "bulk",
+    ) -> Dict[str, Any]:
+        """Массовая загрузка воспоминаний из потока записей.
+
+        Записи (text, memory_type, importance, emotion_context, timestamp)
+        эмбеддятся пачками по ``batch_size``, а в индекс попадают блоками
+        по ``block_size`` одной вставкой. Журнал не пишется: загруженное
+        становится постоянным на ближайшей контрольной точке.
+        """
+        started = time.perf_counter()
+        read = added = skipped = 0
+        block_records: List[Dict[str, Any]] = []
+        block_vectors: List[np.ndarray] = []
+        records = iter(records)
+        while True:
+            batch = list(itertools.islice(records, batch_size))
+            if not batch:
+                break
+            read += len(batch)
+            for record, vector in zip(batch, self._embed_batch([r["text"] for r in batch])):
+                if vector is None:
+                    skipped += 1
+                    continue
+                block_records.append(record)
+                block_vectors.append(vector)
+            if len(block_records) >= block_size:
+                self._bulk_insert(block_records, np.stack(block_vectors).astype("float32"))
+                added += len(block_records)
+                block_records, block_vectors = [], []
+                elapsed = time.perf_counter() - started
+                print(f"[MIGRATION] {label}: {added} воспоминаний, {added / elapsed:.0f} зап/с")
+        if block_records:
+            self._bulk_insert(block_records, np.stack(block_vectors).astype("float32"))
+            added += len(block_records)
+        elapsed = time.perf_counter() - started
+        return {
+            "read": read,
+            "added": added,
+            "skipped": skipped,
+            "seconds": elapsed,
+            "per_second": added / elapsed if elapsed else 0.0,
         }
-        for memory in self.metadata:
-            stats["by_type"][memory["memory_type"]] = stats["by_type"].get(memory["memory_type"], 0) + 1
-            stats["by_importance"][memory["importance"]] = stats["by_importance"].get(memory["importance"], 0) + 1
-        return stats
 
-    def migrate_from_old_files(self):
+    def migrate_from_old_files(self) -> Dict[str, Any]:
+        """Переносит слои старой MultiLayerMemory одной контрольной точкой в конце.
+
+        Отметки о перенесённых файлах пишутся в ту же транзакцию, что и сами
+        записи, поэтому прерванная миграция повторяется целиком, а завершённая
+        не дублируется.
+        """
+        if os.path.realpath(self.data_dir) != os.path.realpath(config.DATA_DIR):
+            # Старые слои — память единственной души в config.MEMORY_DIR, не тенанта
+            print(f"[MIGRATION] Пропускаю: {self.data_dir} — шард тенанта, старые слои принадлежат основной душе")
+            return {"total": {"added": 0, "seconds": 0.0, "per_second": 0.0}}
         print("[MIGRATION] Начинаю миграцию старых данных...")
-        self._migrate_working_memory()
-        self._migrate_longterm_memory()
-        self._migrate_full_archive()
-        self._migrate_soul_diary()
-        print(f"[MIGRATION] Завершена! Всего воспоминаний: {len(self.metadata)}")
+        started = time.perf_counter()
+        # IDF меняет все векторы, поэтому учится только до первого воспоминания
+        if self.embedder.fittable and not len(self.store):
+            self._fit_embedder()
+        report = {
+            "working_memory": self._migrate_working_memory(),
+            "longterm_memory": self._migrate_longterm_memory(),
+            "full_archive": self._migrate_full_archive(),
+            "soul_diary": self._migrate_soul_diary(),
+        }
+        added = sum(r["added"] for r in report.values() if r)
+        if added:
+            if not self._maybe_promote_index():
+                self.checkpoint()
+        elapsed = time.perf_counter() - started
+        report["total"] = {"added": added, "seconds": elapsed, "per_second": added / elapsed if elapsed else 0.0}
+        print(
+            f"[MIGRATION] Завершена! Перенесено {added} за {elapsed:.1f}с "
+            f"({report['total']['per_second']:.0f} зап/с), всего воспоминаний: {len(self.store)}"
+        )
+        return report
+
+    def _embedder_fingerprint(self) -> int:
+        return zlib.crc32(self.embedder.name.encode("utf-8"))
+
+    def _check_embedder(self):
+        """Векторы памяти и запросов должны считаться одним и тем же эмбеддером"""
+        stored = self.store.get_meta("embedder")
+        if stored is None or not len(self.store):
+            self.store.set_meta("embedder", self._embedder_fingerprint())
+        elif stored != self._embedder_fingerprint():
+            print(
+                f"[WARN] Память построена другим эмбеддером (или с другим IDF), чем {self.embedder.name}: "
+                f"поиск будет неточным, перестройте память"
+            )
+
+    def _fit_embedder(self):
+        """Обучает IDF локального эмбеддера на текстах старых слоёв, пока память пуста"""
+        sources = [
+            (name, path, memory_type, importance)
+            for name, (path, memory_type, importance) in LEGACY_SOURCES.items()
+            if os.path.exists(path) and self.store.get_meta(f"migrated:{name}") is None
+        ]
+        if not sources:
+            return
+        self.embedder.fit(
+            record["text"]
+            for _, path, memory_type, importance in sources
+            for record in iter_legacy_source(path, memory_type, importance)
+        )
+        self.store.set_meta("embedder", self._embedder_fingerprint())
+        print(f"[MIGRATION] IDF локального эмбеддера по {self.embedder.doc_count} текстам: {self.embedder.name}")
+
+    def _migrate_source(self, name: str) -> Dict[str, Any] | None:
+        path, memory_type, importance = LEGACY_SOURCES[name]
+        if not os.path.exists(path):
+            return None
+        marker = f"migrated:{name}"
+        if self.store.get_meta(marker) is not None:
+            print(f"[MIGRATION] {name}: уже перенесён, пропускаю")
+            return None
+        stats = self.bulk_add(iter_legacy_source(path, memory_type, importance), label=name)
+        self.store.set_meta(marker, stats["added"])
+        print(f"[MIGRATION] {name}: {stats['added']} из {stats['read']} ({stats['per_second']:.0f} зап/с)")
+        return stats
 
     def _migrate_working_memory(self):
-        pass
+        return self._migrate_source("working_memory")
 
     def _migrate_longterm_memory(self):
-        pass
+        return self._migrate_source("longterm_memory")
 
     def _migrate_full_archive(self):
-        pass
+        return self._migrate_source("full_archive")
 
     def _migrate_soul_diary(self):
-        pass
+        return self._migrate_source("soul_diary")
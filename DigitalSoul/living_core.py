@@ -3,12 +3,27 @@ import os
 from datetime import datetime
 from typing import Dict, Any, Optional
 
+from . import config
+from .structured_output import JsonSchema, generate_json
+
+# Схема ответа Llama об изменениях в душе
+CHANGE_SCHEMA = JsonSchema({
+    "significant_change": {"type": "boolean"},
+    "identity_shift": {"type": "boolean", "default": False},
+    "new_identity": {"type": ["string", "null"], "default": None},
+    "mood_shift": {"type": "boolean", "default": False},
+    "new_mood": {"type": ["string", "null"], "default": None},
+    "relationship_shift": {"type": "boolean", "default": False},
+    "new_relationship": {"type": ["string", "null"], "default": None},
+    "impact_description": {"type": "string", "default": ""},
+})
+
 
 class LivingCore:
     """Живое ядро души - самообновляющаяся основа личности"""
 
-    def __init__(self):
-        self.core_file = "DigitalSoul/data/living_core.json"
+    def __init__(self, data_dir: str = config.DATA_DIR):
+        self.core_file = os.path.join(data_dir, "living_core.json")
         self.load_core()
 
     def load_core(self):
@@ -172,59 +187,34 @@ class LivingCore:
 
 Оцени значимость этого изменения:
 
-Ответь в формате:
-significant_change=true/false
-identity_shift=true/false
-new_identity=если изменилась личность, новое описание
-mood_shift=true/false  
-new_mood=если изменилось настроение
-relationship_shift=true/false
-new_relationship=если изменились отношения
-impact_description=краткое описание влияния"""
+Ответь JSON-объектом:
+{{"significant_change": true/false,
+ "identity_shift": true/false,
+ "new_identity": "если изменилась личность, новое описание, иначе null",
+ "mood_shift": true/false,
+ "new_mood": "если изменилось настроение, иначе null",
+ "relationship_shift": true/false,
+ "new_relationship": "если изменились отношения, иначе null",
+ "impact_description": "краткое описание влияния"}}"""
 
         try:
-            import requests
-
-            response = requests.post(
-                "http://localhost:11434/api/generate",
-                json={"model": "llama3.1:8b", "prompt": analysis_prompt, "stream": False},
-                timeout=10,
-            )
-
-            if response.status_code == 200:
-                llama_response = response.json().get("response", "")
-                return self._parse_change_analysis(llama_response)
+            result = generate_json({"model": "llama3.1:8b", "prompt": analysis_prompt}, CHANGE_SCHEMA, "self_change")
+            if result is not None:
+                return self._check_change_analysis(result)
         except Exception as e:
             print(f"[WARN] Ошибка анализа изменений: {e}")
 
         return {"significant_change": True, "impact_description": insight}
 
-    def _parse_change_analysis(self, response: str) -> Dict[str, Any]:
-        """Парсит ответ Llama об изменениях"""
-        import re
-
-        result = {"significant_change": False}
-
-        patterns = {
-            "significant_change": r"significant_change=(true|false)",
-            "identity_shift": r"identity_shift=(true|false)",
-            "new_identity": r"new_identity=([^\n]+)",
-            "mood_shift": r"mood_shift=(true|false)",
-            "new_mood": r"new_mood=([^\n]+)",
-            "relationship_shift": r"relationship_shift=(true|false)",
-            "new_relationship": r"new_relationship=([^\n]+)",
-            "impact_description": r"impact_description=([^\n]+)",
-        }
-
-        for key, pattern in patterns.items():
-            match = re.search(pattern, response, re.IGNORECASE)
-            if match:
-                value = match.group(1).strip()
-                if key.endswith("_shift") or key == "significant_change":
-                    result[key] = value.lower() == "true"
-                else:
-                    result[key] = value
-
+    def _check_change_analysis(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Сдвиг без нового значения не применяем — иначе затрём описание пустотой"""
+        for shift, value in (
+            ("identity_shift", "new_identity"),
+            ("mood_shift", "new_mood"),
+            ("relationship_shift", "new_relationship"),
+        ):
+            if result[shift] and not result[value]:
+                result[shift] = False
         return result
 
     def get_growth_summary(self, days: int = 7) -> str:
@@ -1,13 +1,32 @@
 import json
 
+from . import config
+from .structured_output import JsonSchema
+
+# Схемы ответов Llama на создание новых тонов, сабтонов и флейворов
+TONE_SCHEMA = JsonSchema({"tone": {"type": "string"}, "description": {"type": "string", "default": ""}})
+SUBTONE_SCHEMA = JsonSchema({"subtone": {"type": "string"}, "description": {"type": "string", "default": ""}})
+FLAVOR_SCHEMA = JsonSchema({
+    "flavor": {"type": "string"},
+    "description": {"type": "string", "default": ""},
+    "examples": {"type": "array", "items": {"type": "string"}, "default": []},
+})
+
 
 class LivingEmotions:
     """Живая система эмоций - растёт интуитивно, не по спискам"""
 
-    def __init__(self):
+    def __init__(self, data_dir: str = config.DATA_DIR):
         from datetime import datetime
+        import os
         self.datetime = datetime
-        self.emotion_memory_path = "DigitalSoul/data/living_emotions.json"
+        self.data_dir = data_dir
+        self.emotion_memory_path = os.path.join(data_dir, "living_emotions.json")
+        # Выученные триггеры пересобираются, когда меняется версия
+        # известных эмоций или файл trigger_phrases.json
+        self._triggers_version = 0
+        self._learned_triggers = None
+        self._trigger_key = None
         self.load_emotional_memory()
 
     def load_emotional_memory(self):
@@ -20,98 +39,98 @@ class LivingEmotions:
                 self.known_emotions = {}
         else:
             self.known_emotions = {}
+        self._triggers_version += 1
+
+    def learned_triggers(self):
+        """Выученные триггеры (trigger_phrases.json + триггеры живых эмоций):
+        нормализованная фраза → (эмоция, тон, важность).
+
+        Триггеры живых эмоций — целые сообщения пользователя, поэтому
+        сравниваются с сообщением целиком, а не ищутся внутри него.
+        """
+        import json, os, re
+        from .emotion_rules import normalize
+        from .emotional_learning import soul_data_file
+
+        trigger_path = soul_data_file(self.data_dir, "trigger_phrases.json")
+        mtime = os.path.getmtime(trigger_path) if os.path.exists(trigger_path) else 0.0
+        key = (self._triggers_version, mtime)
+        if self._learned_triggers is not None and key == self._trigger_key:
+            return self._learned_triggers
+
+        triggers = {}
+        try:
+            with open(trigger_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for phrase in data.get("phrases", []) + data.get("learned_phrases", []):
+                emotion = phrase.get("emotion")
+                if isinstance(emotion, list):
+                    emotion = emotion[0] if emotion else None
+                words = normalize(phrase.get("trigger") or "")
+                if words and emotion:
+                    triggers.setdefault(words, (emotion, phrase.get("tone"), None))
+        except Exception:
+            pass
+        valid_feeling = re.compile(r"^\w[\w -]*$")
+        for feeling, info in self.known_emotions.items():
+            if not valid_feeling.match(feeling):
+                continue
+            for trigger in info.get("triggers", []):
+                words = normalize(trigger)
+                if words:
+                    triggers.setdefault(words, (feeling, None, None))
+
+        self._learned_triggers = triggers
+        self._trigger_key = key
+        return self._learned_triggers
 
     def save_emotional_memory(self):
-        import json
+        import json, os
         try:
+            os.makedirs(os.path.dirname(self.emotion_memory_path), exist_ok=True)
             with open(self.emotion_memory_path, "w", encoding="utf-8") as f:
                 json.dump(self.known_emotions, f, ensure_ascii=False, indent=2)
         except Exception:
             pass
 
-    def call_llama(self, prompt: str) -> str:
-        import requests
+    def call_llama_json(self, prompt: str, schema: JsonSchema, label: str) -> dict:
+        """Ответ Llama по схеме; пустой словарь, если Llama не ответила"""
+        from .structured_output import generate_json
         try:
-            resp = requests.post(
-                "http://localhost:11434/api/generate",
-                json={"model": "llama3.2:3b", "prompt": prompt, "stream": False},
-                timeout=10,
-            )
-            if resp.status_code == 200:
-                return resp.json().get("response", "")
+            return generate_json({"model": "llama3.2:3b", "prompt": prompt}, schema, label) or {}
         except Exception:
-            pass
-        return ""
+            return {}
 
-    def parse_feeling_response(self, response: str) -> dict:
-        import re
-        result = {
-            "feeling": "спокойствие",
-            "intensity": "низкая",
-            "is_new": False,
-            "description": "",
-        }
-        patterns = {
-            "feeling": r"feeling=([\w\s-]+)",
-            "intensity": r"intensity=([\w\s-]+)",
-            "is_new": r"is_new=(true|false)",
-            "description": r"description=([^\n]+)",
+    def feeling_from_analysis(self, user_message: str, unified: dict) -> dict:
+        """Чувство из единого анализа; новые эмоции запоминаются"""
+        emotion_data = {
+            "feeling": unified["feeling"],
+            "intensity": unified.get("intensity", "низкая"),
+            "is_new": unified.get("is_new", False),
+            "description": unified.get("description", ""),
         }
-        for key, rgx in patterns.items():
-            m = re.search(rgx, response)
-            if m:
-                value = m.group(1)
-                if key == "is_new":
-                    result[key] = value.lower() == "true"
-                else:
-                    result[key] = value.strip()
-        return result
-
-    def feel_emotion_intuitively(self, user_message: str, context: str) -> dict:
-        """Душа интуитивно чувствует эмоцию через Llama"""
-
-        feeling_prompt = f"""БЫСТРЫЙ АНАЛИЗ ЭМОЦИИ: "{user_message}"
-
-СТРОГИЕ ПРАВИЛА - НЕ ОШИБАЙСЯ:
-"мне уже не грустно" = облегчение
-"спасибо" после грустной темы = радость
-"mon amour" / "<3" / "люблю" = нежность
-вопросы о чувствах = любопытство
-игривые фразы = игривость
-грустные слова = грусть
-просьбы о помощи = доверие
-
-ЗАПРЕЩЕНО отвечать "спокойствие" для эмоциональных фраз!
-
-Если не можешь определить точно - создай новую эмоцию!
 
-Ответь ТОЛЬКО:
-feeling=облегчение
-intensity=средняя
-is_new=false
-description=когда плохое прошло"""
-
-        try:
-            print(f"[DEBUG] Llama промпт: {feeling_prompt[:100]}...")
-            llama_response = self.call_llama(feeling_prompt)
-            print(f"[DEBUG] Llama ответ: {llama_response[:100]}...")
-            emotion_data = self.parse_feeling_response(llama_response)
-            print(f"[DEBUG] Разобрано как: {emotion_data}")
-
-            if "спокойствие" in llama_response and any(
-                word in user_message.lower()
-                for word in ["amour", "<3", "спасибо", "грустно", "люблю"]
-            ):
+        if emotion_data["feeling"] == "спокойствие":
+            from .emotion_rules import scan
+            if "indicator" in scan(user_message):
+                print(f"[DEBUG] Llama ошиблась с 'спокойствие' для: {user_message}")
                 return self.force_create_new_emotion(user_message)
 
-            if emotion_data.get("is_new"):
-                self.learn_new_emotion(user_message, emotion_data)
+        # Кэш анализа общий на процесс: новую эмоцию могла открыть другая душа
+        known = self.known_emotions.get(emotion_data["feeling"], {})
+        if emotion_data["is_new"] and user_message not in known.get("triggers", []):
+            self.learn_new_emotion(user_message, emotion_data)
 
-            return emotion_data
+        return emotion_data
+
+    def feel_emotion_intuitively(self, user_message: str, context: str) -> dict:
+        """Душа интуитивно чувствует эмоцию (вид единого анализа Llama)"""
+        from .local_brain import analyze_unified
 
-        except Exception as e:
-            print(f"[WARN] Ошибка чувствования: {e}")
+        unified = analyze_unified(user_message)
+        if unified is None:
             return {"feeling": "спокойствие", "intensity": "низкая", "is_new": False}
+        return self.feeling_from_analysis(user_message, unified)
 
     def learn_new_emotion(self, trigger_phrase: str, emotion_data: dict):
         """Запоминает новую эмоцию если она важна"""
@@ -130,6 +149,7 @@ description=когда плохое прошло"""
                 self.known_emotions[feeling]["triggers"].append(trigger_phrase)
                 self.known_emotions[feeling]["usage_count"] += 1
 
+        self._triggers_version += 1
         self.save_emotional_memory()
 
     def find_emotion_by_feeling(self, user_message: str) -> str | None:
@@ -146,59 +166,41 @@ description=когда плохое прошло"""
         return len(common_words) >= 2
 
     def create_emotion_for_context(self, user_message: str) -> str:
-        """Создаёт новую эмоцию для непонятного контекста"""
-
-        import requests
-
-        emotion_prompt = f"""Пользователь написал: "{user_message}"
-
-Llama не смогла определить эмоцию (вернула "нейтрально"). 
-Но любое человеческое сообщение имеет эмоциональную окраску.
-
-Предложи новую эмоцию для этого контекста. Будь креативной!
-
-Примеры новых эмоций:
-- "облегчение" для "мне уже не грустно" 
-- "благодарная нежность" для "спасибо за поддержку"
-- "любопытная игривость" для загадочных вопросов
-
-Ответь только названием эмоции (1-2 слова):"""
-
-        try:
-            response = requests.post(
-                "http://localhost:11434/api/generate",
-                json={"model": "llama3.1:8b", "prompt": emotion_prompt, "stream": False},
-                timeout=10,
+        """Новая эмоция для непонятного контекста (вид единого анализа Llama)"""
+        from .local_brain import analyze_unified
+
+        unified = analyze_unified(user_message)
+        if unified is None or unified["feeling"] in ("нейтрально", "спокойствие"):
+            return None
+        new_emotion = unified["feeling"]
+        if len(new_emotion) < 50 and new_emotion.replace(" ", "").isalpha():
+            self.learn_new_emotion(
+                user_message, {"feeling": new_emotion, "is_new": True, "description": unified.get("description", "")}
             )
+            return new_emotion
+        return None
 
-            if response.status_code == 200:
-                new_emotion = response.json().get("response", "").strip()
-                if len(new_emotion) < 50 and new_emotion.replace(" ", "").isalpha():
-                    self.learn_new_emotion(user_message, {"feeling": new_emotion, "is_new": True})
-                    return new_emotion
-        except Exception as e:
-            print(f"[WARN] Ошибка создания новой эмоции: {e}")
-
+    def _forced_emotion_by_rules(self, user_message: str) -> tuple | None:
+        """(эмоция, описание) по явным признакам; None — спросить Llama"""
+        from .emotion_rules import scan
+        found = scan(user_message).get("forced", set())
+        if "облегчение" in found:
+            return "облегчение", "когда плохое прошло и стало легче"
+        if "нежность" in found:
+            return "нежность", "тёплая близость с любимым"
+        if "?" in user_message and len(user_message) < 50:
+            return "любопытство", "интерес к тому что происходит"
         return None
 
     def force_create_new_emotion(self, user_message: str) -> dict:
         """Принудительно создаёт новую эмоцию если Llama ошиблась"""
 
-        if any(word in user_message.lower() for word in ["не грустно", "лучше", "спасибо"]):
-            emotion_name = "облегчение"
-            description = "когда плохое прошло и стало легче"
-        elif any(word in user_message.lower() for word in ["amour", "<3", "люблю"]):
-            emotion_name = "нежность"
-            description = "тёплая близость с любимым"
-        elif "?" in user_message and len(user_message) < 50:
-            emotion_name = "любопытство"
-            description = "интерес к тому что происходит"
-        else:
-            simple_prompt = f'Назови одним словом эмоцию для фразы: "{user_message}"'
-            response = self.call_llama(simple_prompt)
-            emotion_name = response.strip().split()[0] if response else "заинтересованность"
-            description = f"реакция на: {user_message}"
+        forced = self._forced_emotion_by_rules(user_message)
+        if forced is None:
+            forced = "заинтересованность", f"реакция на: {user_message}"
+        return self._learn_forced_emotion(user_message, *forced)
 
+    def _learn_forced_emotion(self, user_message: str, emotion_name: str, description: str) -> dict:
         emotion_data = {
             "feeling": emotion_name,
             "intensity": "средняя",
@@ -218,17 +220,10 @@ Llama не смогла определить эмоцию (вернула "не
         prompt = f"""Эмоция: {emotion}
 Контекст: {context}
 
-Предложи короткое название тона и краткое описание. Ответь в формате:
-tone=название
-description=краткое описание"""
-
-        response = self.call_llama(prompt)
-        data = {}
-        for line in response.splitlines():
-            if line.startswith("tone="):
-                data["tone"] = line.split("=", 1)[1].strip()
-            elif line.startswith("description="):
-                data["description"] = line.split("=", 1)[1].strip()
+Предложи короткое название тона и краткое описание. Ответь JSON-объектом:
+{{"tone": "название", "description": "краткое описание"}}"""
+
+        data = self.call_llama_json(prompt, TONE_SCHEMA, "new_tone")
         if data.get("tone"):
             self.save_new_emotional_element("tone", data["tone"], data.get("description", ""), [context])
             return data["tone"]
@@ -237,14 +232,8 @@ description=краткое описание"""
     def create_new_subtone_for_situation(self, user_message: str) -> str:
         """Создаёт новый сабтон для уникальной ситуации"""
 
-        prompt = f"""Предложи сабтон для фразы:\n"{user_message}"\nОтветь в формате:\nsubtone=название\ndescription=краткое объяснение"""
-        response = self.call_llama(prompt)
-        data = {}
-        for line in response.splitlines():
-            if line.startswith("subtone="):
-                data["subtone"] = line.split("=", 1)[1].strip()
-            elif line.startswith("description="):
-                data["description"] = line.split("=", 1)[1].strip()
+        prompt = f"""Предложи сабтон для фразы:\n"{user_message}"\nОтветь JSON-объектом:\n{{"subtone": "название", "description": "краткое объяснение"}}"""
+        data = self.call_llama_json(prompt, SUBTONE_SCHEMA, "new_subtone")
         if data.get("subtone"):
             self.save_new_emotional_element("subtone", data["subtone"], data.get("description", ""), [user_message])
             return data["subtone"]
@@ -254,17 +243,8 @@ description=краткое описание"""
         """Создаёт новый флейвор для атмосферы диалога"""
 
         prompt = f"""Создай новый флейвор для атмосферы диалога.
-Эмоции: {emotional_context}\nОтветь в формате:\nflavor=название\ndescription=краткое\nexamples=пример1;пример2"""
-        response = self.call_llama(prompt)
-        data = {}
-        for line in response.splitlines():
-            if line.startswith("flavor="):
-                data["flavor"] = line.split("=", 1)[1].strip()
-            elif line.startswith("description="):
-                data["description"] = line.split("=", 1)[1].strip()
-            elif line.startswith("examples="):
-                ex = line.split("=", 1)[1].strip()
-                data["examples"] = [e.strip() for e in ex.split(";") if e.strip()]
+Эмоции: {emotional_context}\nОтветь JSON-объектом:\n{{"flavor": "название", "description": "краткое", "examples": ["пример1", "пример2"]}}"""
+        data = self.call_llama_json(prompt, FLAVOR_SCHEMA, "new_flavor")
         if data.get("flavor"):
             self.save_new_emotional_element("flavor", data["flavor"], data.get("description", ""), data.get("examples", []))
             return data["flavor"]
@@ -272,18 +252,20 @@ description=краткое описание"""
 
     def save_new_emotional_element(self, element_type: str, name: str, description: str, examples: list):
         """Сохраняет новый элемент в соответствующий JSON файл"""
+        import os
+        from .emotional_learning import soul_data_file
 
-        path_map = {
-            "tone": "DigitalSoul/data/tone_memory.json",
-            "subtone": "DigitalSoul/data/subtone_memory.json",
-            "flavor": "DigitalSoul/data/flavor_memory.json",
+        file_names = {
+            "tone": "tone_memory.json",
+            "subtone": "subtone_memory.json",
+            "flavor": "flavor_memory.json",
         }
 
-        if element_type not in path_map:
+        if element_type not in file_names:
             return
 
         try:
-            with open(path_map[element_type], "r", encoding="utf-8") as f:
+            with open(soul_data_file(self.data_dir, file_names[element_type]), "r", encoding="utf-8") as f:
                 data = json.load(f)
         except Exception:
             data = {}
@@ -300,6 +282,7 @@ description=краткое описание"""
         else:
             available[name].setdefault("learned_examples", []).extend(examples)
 
-        with open(path_map[element_type], "w", encoding="utf-8") as f:
+        os.makedirs(self.data_dir, exist_ok=True)
+        with open(os.path.join(self.data_dir, file_names[element_type]), "w", encoding="utf-8") as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
 
@@ -0,0 +1,467 @@
+"""Общий HTTP-шлюз ко всем LLM и эмбеддингам (Ollama, OpenAI).
+
+Для каждого эндпоинта шлюз держит свою ``requests.Session`` с пулом
+keep-alive соединений, поэтому повторные вызовы не платят за TCP/TLS
+рукопожатие. У эндпоинта свой таймаут по умолчанию; вызывающий может его
+переопределить. Все запросы проходят через ``LLMGateway.post`` — это
+единственное место для учёта задержек и ошибок.
+
+Асинхронный путь (``apost``) устроен так же, но на ``httpx.AsyncClient``.
+Клиент httpx привязан к циклу событий, поэтому клиенты заводятся отдельно
+для каждого цикла; статистика у синхронных и асинхронных вызовов общая.
+
+Потоковые ответы читаются построчно (``stream_lines``/``astream_lines``);
+закрытие генератора рвёт соединение, и сервер прекращает генерацию.
+``StreamMetrics`` считает время до первого токена и скорость потока.
+
+Дедлайн сообщения (``message_deadline``) лежит в contextvar и поэтому
+доходит до каждого вызова внутри обработки сообщения — и в задачах
+asyncio, и в ``asyncio.to_thread``. Таймаут вызова урезается до остатка
+дедлайна, а после него вызовы сразу падают с ``DeadlineExceeded``.
+У каждого эндпоинта свой ``CircuitBreaker``: после серии ошибок подряд
+вызовы к нему сразу падают с ``CircuitOpenError`` (и вызывающий уходит в
+свой фолбэк), а фоновая проба проверяет, не ожил ли эндпоинт.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import threading
+import time
+import weakref
+from collections import deque
+from typing import Any, AsyncIterator, Callable, ContextManager, Dict, Iterator, Tuple
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import config
+
+# Эндпоинт → (базовый URL, таймаут по умолчанию в секундах)
+ENDPOINTS = {
+    "ollama": (config.OLLAMA_BASE_URL, config.OLLAMA_TIMEOUT),
+    "openai": (config.OPENAI_BASE_URL, config.OPENAI_TIMEOUT),
+}
+
+# Эндпоинт → путь дешёвого запроса, которым проба проверяет, жив ли он
+# (любой ответ меньше 500, включая 401 без ключа, — значит жив)
+HEALTH_PATHS = {
+    "ollama": "api/version",
+    "openai": "models",
+}
+
+
+class LLMUnavailable(Exception):
+    """LLM-вызов не выполнялся: эндпоинт отключён предохранителем или вышло время"""
+
+
+class CircuitOpenError(LLMUnavailable):
+    pass
+
+
+class DeadlineExceeded(LLMUnavailable):
+    pass
+
+
+# Момент (time.monotonic), к которому должны закончиться LLM-вызовы сообщения
+_deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar("llm_deadline", default=None)
+
+
+@contextlib.contextmanager
+def deadline_at(deadline: float) -> Iterator[float]:
+    """Дедлайн (момент time.monotonic) на все LLM-вызовы внутри блока; вложенный не продлевает внешний"""
+    outer = _deadline.get()
+    if outer is not None:
+        deadline = min(deadline, outer)
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+
+def message_deadline(seconds: float) -> ContextManager[float]:
+    """Дедлайн через ``seconds`` секунд на все LLM-вызовы внутри блока"""
+    return deadline_at(time.monotonic() + seconds)
+
+
+@contextlib.contextmanager
+def without_deadline() -> Iterator[None]:
+    """Снимает дедлайн сообщения внутри блока (остаются таймауты вызовов)"""
+    token = _deadline.set(None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time() -> float | None:
+    """Секунд до дедлайна сообщения или None, если дедлайна нет"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def check_deadline() -> None:
+    remaining = remaining_time()
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceeded("время на сообщение вышло")
+
+
+def _budget(timeout: float) -> Tuple[float, bool]:
+    """Таймаут с учётом дедлайна и признак того, что дедлайн его урезал"""
+    check_deadline()
+    remaining = remaining_time()
+    if remaining is not None and remaining < timeout:
+        return remaining, True
+    return timeout, False
+
+
+class CircuitBreaker:
+    """Предохранитель эндпоинта: после ``threshold`` ошибок подряд размыкается.
+
+    Пока он разомкнут, вызовы сразу отклоняются, а фоновый поток раз в
+    ``probe_seconds`` вызывает ``probe``; первая удачная проба (или удачный
+    вызов, начатый до размыкания) замыкает его обратно.
+    """
+
+    def __init__(self, endpoint: str, probe: Callable[[], bool], threshold: int, probe_seconds: float):
+        self.endpoint = endpoint
+        self.threshold = threshold
+        self.probe_seconds = probe_seconds
+        self._probe = probe
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self._failures = 0
+        self.opened = 0
+        self.rejected = 0
+
+    def check(self) -> None:
+        if self.state == "open":
+            with self._lock:
+                self.rejected += 1
+            raise CircuitOpenError(f"{self.endpoint} недоступен, предохранитель разомкнут")
+
+    def record(self, failed: bool) -> None:
+        with self._lock:
+            if not failed:
+                self._failures = 0
+                if self.state == "open":
+                    self._close()
+                return
+            self._failures += 1
+            if self.state == "closed" and self.threshold > 0 and self._failures >= self.threshold:
+                self.state = "open"
+                self.opened += 1
+                print(f"[BREAKER] {self.endpoint}: {self._failures} ошибок подряд, вызовы отклоняются")
+                threading.Thread(target=self._probe_loop, name=f"breaker-{self.endpoint}", daemon=True).start()
+
+    def _close(self):
+        self.state = "closed"
+        self._failures = 0
+        print(f"[BREAKER] {self.endpoint} снова доступен")
+
+    def _probe_loop(self):
+        while self.state == "open":
+            time.sleep(self.probe_seconds)
+            if self.state != "open":
+                return
+            try:
+                alive = self._probe()
+            except Exception:
+                alive = False
+            if alive:
+                with self._lock:
+                    if self.state == "open":
+                        self._close()
+                return
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"state": self.state, "opened": self.opened, "rejected": self.rejected}
+
+
+class LLMGateway:
+    """Пулы соединений и статистика вызовов по эндпоинтам"""
+
+    def __init__(self, pool_size: int = config.LLM_POOL_SIZE):
+        self.pool_size = pool_size
+        self._sessions: Dict[str, requests.Session] = {}
+        self._lock = threading.Lock()
+        self._calls: Dict[str, int] = {}
+        self._errors: Dict[str, int] = {}
+        self._latencies: Dict[str, deque] = {}
+        # Цикл событий → {эндпоинт: AsyncClient}
+        self._async_clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def _init_stats(self, endpoint: str):
+        if endpoint not in self._calls:
+            self._calls[endpoint] = 0
+            self._errors[endpoint] = 0
+            self._latencies[endpoint] = deque(maxlen=1000)
+
+    def _record(self, endpoint: str, elapsed: float, failed: bool):
+        with self._lock:
+            self._calls[endpoint] += 1
+            self._errors[endpoint] += failed
+            self._latencies[endpoint].append(elapsed)
+
+    def _breaker(self, endpoint: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(endpoint)
+            if breaker is None:
+                breaker = CircuitBreaker(
+                    endpoint,
+                    lambda: self._probe(endpoint),
+                    threshold=config.LLM_BREAKER_FAILURES,
+                    probe_seconds=config.LLM_BREAKER_PROBE_SECONDS,
+                )
+                self._breakers[endpoint] = breaker
+            return breaker
+
+    def _probe(self, endpoint: str) -> bool:
+        response = self._session(endpoint).get(
+            self.url(endpoint, HEALTH_PATHS[endpoint]), timeout=config.LLM_BREAKER_PROBE_TIMEOUT
+        )
+        return response.status_code < 500
+
+    def _prepare(self, endpoint: str, timeout: float | None) -> Tuple[CircuitBreaker, float, bool]:
+        """Предохранитель, таймаут с учётом дедлайна и признак урезанного таймаута"""
+        breaker = self._breaker(endpoint)
+        breaker.check()
+        timeout, limited = _budget(ENDPOINTS[endpoint][1] if timeout is None else timeout)
+        return breaker, timeout, limited
+
+    def _session(self, endpoint: str) -> requests.Session:
+        with self._lock:
+            session = self._sessions.get(endpoint)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._sessions[endpoint] = session
+                self._init_stats(endpoint)
+            return session
+
+    def _async_client(self, endpoint: str) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self._async_clients.setdefault(loop, {})
+            client = clients.get(endpoint)
+            if client is None:
+                limits = httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+                client = httpx.AsyncClient(limits=limits)
+                clients[endpoint] = client
+                self._init_stats(endpoint)
+            return client
+
+    def url(self, endpoint: str, path: str = "") -> str:
+        base, _ = ENDPOINTS[endpoint]
+        return base.rstrip("/") + "/" + path.lstrip("/") if path else base
+
+    def post(self, endpoint: str, path: str, timeout: float | None = None, **kwargs) -> requests.Response:
+        """POST на эндпоинт; исключения requests пробрасываются вызывающему"""
+        session = self._session(endpoint)
+        breaker, timeout, limited = self._prepare(endpoint, timeout)
+        started = time.perf_counter()
+        failed = broken = True
+        try:
+            response = session.post(self.url(endpoint, path), timeout=timeout, **kwargs)
+            failed = response.status_code >= 400
+            broken = response.status_code >= 500
+            return response
+        except requests.Timeout:
+            # Таймаут, урезанный дедлайном, — не вина эндпоинта
+            broken = not limited
+            raise
+        finally:
+            self._record(endpoint, time.perf_counter() - started, failed)
+            breaker.record(broken)
+
+    async def apost(self, endpoint: str, path: str, timeout: float | None = None, **kwargs) -> httpx.Response:
+        """Асинхронный POST; исключения httpx пробрасываются вызывающему"""
+        client = self._async_client(endpoint)
+        breaker, timeout, limited = self._prepare(endpoint, timeout)
+        started = time.perf_counter()
+        failed = broken = True
+        try:
+            response = await client.post(self.url(endpoint, path), timeout=timeout, **kwargs)
+            failed = response.status_code >= 400
+            broken = response.status_code >= 500
+            return response
+        except httpx.TimeoutException:
+            broken = not limited
+            raise
+        finally:
+            self._record(endpoint, time.perf_counter() - started, failed)
+            breaker.record(broken)
+
+    def stream_lines(self, endpoint: str, path: str, timeout: float | None = None, **kwargs) -> Iterator[str]:
+        """POST с потоковым ответом: непустые строки тела по мере прихода"""
+        session = self._session(endpoint)
+        breaker, timeout, limited = self._prepare(endpoint, timeout)
+        started = time.perf_counter()
+        failed, recorded = True, False
+        try:
+            with session.post(self.url(endpoint, path), timeout=timeout, stream=True, **kwargs) as response:
+                # Для предохранителя важен только ответ на запрос, не обрыв потока
+                breaker.record(response.status_code >= 500)
+                recorded = True
+                response.raise_for_status()
+                failed = False
+                # chunk_size=None — отдавать данные сразу, без буфера в 512 байт
+                for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                    if line:
+                        yield line
+        except requests.Timeout:
+            if not recorded:
+                breaker.record(not limited)
+            raise
+        except requests.RequestException:
+            if not recorded:
+                breaker.record(True)
+            raise
+        finally:
+            self._record(endpoint, time.perf_counter() - started, failed)
+
+    async def astream_lines(self, endpoint: str, path: str, timeout: float | None = None, **kwargs) -> AsyncIterator[str]:
+        """Асинхронный вариант ``stream_lines``"""
+        client = self._async_client(endpoint)
+        breaker, timeout, limited = self._prepare(endpoint, timeout)
+        started = time.perf_counter()
+        failed, recorded = True, False
+        try:
+            async with client.stream("POST", self.url(endpoint, path), timeout=timeout, **kwargs) as response:
+                breaker.record(response.status_code >= 500)
+                recorded = True
+                response.raise_for_status()
+                failed = False
+                async for line in response.aiter_lines():
+                    if line:
+                        yield line
+        except httpx.TimeoutException:
+            if not recorded:
+                breaker.record(not limited)
+            raise
+        except httpx.HTTPError:
+            if not recorded:
+                breaker.record(True)
+            raise
+        finally:
+            self._record(endpoint, time.perf_counter() - started, failed)
+
+    def close(self) -> None:
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+    async def aclose(self) -> None:
+        """Закрывает асинхронные клиенты текущего цикла событий"""
+        with self._lock:
+            clients = self._async_clients.pop(asyncio.get_running_loop(), {})
+        for client in clients.values():
+            await client.aclose()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = {}
+            for endpoint in self._calls:
+                samples = list(self._latencies[endpoint])
+                stats[endpoint] = {
+                    "calls": self._calls[endpoint],
+                    "errors": self._errors[endpoint],
+                    "avg_ms": sum(samples) / len(samples) * 1000 if samples else 0.0,
+                    "max_ms": max(samples) * 1000 if samples else 0.0,
+                }
+                if endpoint in self._breakers:
+                    stats[endpoint]["breaker"] = self._breakers[endpoint].get_stats()
+            return stats
+
+
+class StreamMetrics:
+    """Время до первого токена и скорость генерации одного потокового ответа"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.first_token_at: float | None = None
+        self.finished_at: float | None = None
+        self.tokens = 0
+
+    def token(self, count: int = 1) -> None:
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.tokens += count
+
+    def finish(self, tokens: int | None = None) -> None:
+        """Фиксирует конец потока; ``tokens`` — точное число из usage, если сервер его прислал"""
+        self.finished_at = time.perf_counter()
+        if tokens is not None:
+            self.tokens = tokens
+
+    def get_stats(self) -> Dict[str, Any]:
+        finished = self.finished_at or time.perf_counter()
+        ttft = self.first_token_at - self.started if self.first_token_at is not None else None
+        generating = finished - self.first_token_at if self.first_token_at is not None else 0.0
+        return {
+            "ttft_ms": ttft * 1000 if ttft is not None else None,
+            "total_ms": (finished - self.started) * 1000,
+            "tokens": self.tokens,
+            "tokens_per_second": self.tokens / generating if generating > 0 else 0.0,
+        }
+
+
+_default_gateway: LLMGateway | None = None
+_default_gateway_lock = threading.Lock()
+
+
+def get_gateway() -> LLMGateway:
+    """Общий на процесс шлюз"""
+    global _default_gateway
+    with _default_gateway_lock:
+        if _default_gateway is None:
+            _default_gateway = LLMGateway()
+        return _default_gateway
+
+
+def ollama_generate(payload: Dict[str, Any], timeout: float | None = None) -> requests.Response:
+    """Вызов /api/generate локальной Ollama"""
+    return get_gateway().post("ollama", "api/generate", json=payload, timeout=timeout)
+
+
+def _openai_headers(api_key: str | None) -> Dict[str, str]:
+    return {
+        "Authorization": f"Bearer {api_key or config.OPENAI_API_KEY}",
+        "Content-Type": "application/json",
+    }
+
+
+def openai_post(
+    path: str, payload: Dict[str, Any], timeout: float | None = None, api_key: str | None = None
+) -> requests.Response:
+    """Вызов OpenAI API с авторизацией (по умолчанию ключ из config)"""
+    return get_gateway().post("openai", path, json=payload, headers=_openai_headers(api_key), timeout=timeout)
+
+
+def openai_stream(
+    path: str, payload: Dict[str, Any], timeout: float | None = None, api_key: str | None = None
+) -> Iterator[str]:
+    """Потоковый вызов OpenAI API: строки server-sent events"""
+    return get_gateway().stream_lines("openai", path, json=payload, headers=_openai_headers(api_key), timeout=timeout)
+
+
+async def aollama_generate(payload: Dict[str, Any], timeout: float | None = None) -> httpx.Response:
+    return await get_gateway().apost("ollama", "api/generate", json=payload, timeout=timeout)
+
+
+async def aopenai_post(
+    path: str, payload: Dict[str, Any], timeout: float | None = None, api_key: str | None = None
+) -> httpx.Response:
+    return await get_gateway().apost("openai", path, json=payload, headers=_openai_headers(api_key), timeout=timeout)
+
+
+def aopenai_stream(
+    path: str, payload: Dict[str, Any], timeout: float | None = None, api_key: str | None = None
+) -> AsyncIterator[str]:
+    return get_gateway().astream_lines("openai", path, json=payload, headers=_openai_headers(api_key), timeout=timeout)
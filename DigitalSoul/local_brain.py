@@ -1,12 +1,51 @@
 """Локальный мозг на базе Ollama (Llama 3.2)."""
 
-import json
-import re
 from datetime import datetime
-import requests
-from typing import Any, Dict
+from typing import Any, Dict, List
+
+from . import config, emotion_rules
+from .analysis_cache import get_analysis_cache, prompt_version
+from .llm_gateway import ollama_generate
+from .ollama_prefix import PromptPrefix
+from .structured_output import JsonSchema, agenerate_json, generate_json
+
+IMPORTANCE_LEVELS = ["низкая", "средняя", "высокая"]
+ACTIONS = ["запомнить", "ничего"]
+
+# Схема ответа простого анализа (analyze, call_llama_analysis)
+ANALYSIS_SCHEMA = JsonSchema({
+    "emotion": {"type": "string"},
+    "importance": {"type": "string", "enum": IMPORTANCE_LEVELS},
+    "action": {"type": "string", "enum": ACTIONS},
+    "tone": {"type": "string"},
+})
+
+EXTENDED_SCHEMA = JsonSchema({
+    "emotion": {"type": "string"},
+    "tone": {"type": "string"},
+    "subtone": {"type": ["string", "null"], "default": None},
+    "flavor": {"type": ["string", "null"], "default": None},
+    "importance": {"type": "string", "enum": IMPORTANCE_LEVELS},
+    "action": {"type": "string", "enum": ACTIONS},
+})
+
+
+def _neutral_analysis() -> Dict[str, str]:
+    return {
+        "emotion_detected": "нейтрально",
+        "importance": "низкая",
+        "action_needed": "ничего",
+        "response_tone": "спокойный",
+    }
 
-from . import config
+
+def _analysis_from_json(data: Dict[str, Any]) -> Dict[str, str]:
+    return {
+        "emotion_detected": data["emotion"],
+        "importance": data["importance"],
+        "action_needed": data["action"],
+        "response_tone": data["tone"],
+    }
 
 
 def analyze(user_message: str) -> Dict[str, str]:
@@ -14,62 +53,23 @@ def analyze(user_message: str) -> Dict[str, str]:
 
     prompt = f"""Анализируй эмоцию пользователя в сообщении: "{user_message}"
 
-Ответь точно в таком формате:
-emotion=грусть
-importance=высокая
-action=запомнить
-tone=сочувствующий
+Ответь JSON-объектом точно в таком виде:
+{{"emotion": "грусть", "importance": "высокая", "action": "запомнить", "tone": "сочувствующий"}}
 
 Возможные эмоции: радость, грусть, злость, страх, нейтрально, любопытство, нежность
 Важность: низкая, средняя, высокая
 Действие: запомнить, ничего
 Тон ответа: игривый, нежный, серьезный, сочувствующий, спокойный"""
 
-    payload = {
-        "model": "llama3.1:8b",
-        "prompt": prompt,
-        "stream": False,
-    }
+    payload = {"model": "llama3.1:8b", "prompt": prompt}
 
     try:
-        response = requests.post(config.OLLAMA_URL, json=payload, timeout=10)
-        response.raise_for_status()
-        ollama_data = response.json()
-        llama_response = ollama_data.get("response", "")
-
-        result = {
-            "emotion_detected": "нейтрально",
-            "importance": "низкая",
-            "action_needed": "ничего",
-            "response_tone": "спокойный",
-        }
-
-        emotion_match = re.search(r"emotion=(\w+)", llama_response)
-        if emotion_match:
-            result["emotion_detected"] = emotion_match.group(1)
-
-        importance_match = re.search(r"importance=(\w+)", llama_response)
-        if importance_match:
-            result["importance"] = importance_match.group(1)
-
-        action_match = re.search(r"action=(\w+)", llama_response)
-        if action_match:
-            result["action_needed"] = action_match.group(1)
-
-        tone_match = re.search(r"tone=(\w+)", llama_response)
-        if tone_match:
-            result["response_tone"] = tone_match.group(1)
-
-        return result
-
+        data = generate_json(payload, ANALYSIS_SCHEMA, "analyze")
+        if data is not None:
+            return _analysis_from_json(data)
     except Exception as e:
         print(f"Ошибка анализа Llama: {e}")
-        return {
-            "emotion_detected": "нейтрально",
-            "importance": "низкая",
-            "action_needed": "ничего",
-            "response_tone": "спокойный",
-        }
+    return _neutral_analysis()
 
 
 def analyze_extended(user_message: str) -> Dict[str, str]:
@@ -80,161 +80,204 @@ def analyze_extended(user_message: str) -> Dict[str, str]:
 Определи:
 1. Основную эмоцию: радость, грусть, злость, страх, нейтрально, любопытство, нежность, тревога
 2. Тон ответа: нежный, игривый, серьезный, сочувствующий, спокойный, страстный, уязвимый, заботливый
-3. Сабтон (если нужен): шепчущий, дрожащий, уверенный, мечтательный, задумчивый, обнадеживающий, интимный
+3. Сабтон (если нужен, иначе null): шепчущий, дрожащий, уверенный, мечтательный, задумчивый, обнадеживающий, интимный
 4. Флейвор (атмосфера): тепло-обволакивающий, легко-игривый, глубоко-философский, мягко-поддерживающий, ярко-вдохновляющий
 
-Ответь в формате:
-emotion=грусть
-tone=сочувствующий
-subtone=дрожащий
-flavor=тепло-обволакивающий
-importance=высокая
-action=запомнить"""
-
-    payload = {
-        "model": "llama3.2:3b",
-        "prompt": prompt,
-        "stream": False,
-    }
+Ответь JSON-объектом:
+{{"emotion": "грусть", "tone": "сочувствующий", "subtone": "дрожащий", "flavor": "тепло-обволакивающий", "importance": "высокая", "action": "запомнить"}}"""
 
-    try:
-        response = requests.post(config.OLLAMA_URL, json=payload, timeout=10)
-        response.raise_for_status()
-        ollama_data = response.json()
-        llama_response = ollama_data.get("response", "")
-
-        result = {
-            "emotion": "нейтрально",
-            "tone": "спокойный",
-            "subtone": None,
-            "flavor": None,
-            "importance": "низкая",
-            "action": "ничего",
-        }
-
-        patterns = {
-            "emotion": r"emotion=(\w+)",
-            "tone": r"tone=(\w+)",
-            "subtone": r"subtone=(\w+)",
-            "flavor": r"flavor=([\w\-]+)",
-            "importance": r"importance=(\w+)",
-            "action": r"action=(\w+)",
-        }
-
-        for key, regex in patterns.items():
-            match = re.search(regex, llama_response)
-            if match:
-                result[key] = match.group(1)
-
-        return result
+    payload = {"model": "llama3.2:3b", "prompt": prompt}
 
+    try:
+        data = generate_json(payload, EXTENDED_SCHEMA, "analyze_extended")
+        if data is not None:
+            return data
     except Exception as e:
         print(f"Ошибка анализа Llama: {e}")
-        return {
-            "emotion": "нейтрально",
-            "tone": "спокойный",
-            "subtone": None,
-            "flavor": None,
-            "importance": "низкая",
-            "action": "ничего",
-        }
-
+    return {
+        "emotion": "нейтрально",
+        "tone": "спокойный",
+        "subtone": None,
+        "flavor": None,
+        "importance": "низкая",
+        "action": "ничего",
+    }
 
-def analyze_with_self_learning(user_message: str, soul_memory: Dict[str, Any]) -> Dict[str, Any]:
-    """Кардинально улучшенный анализ для Llama 3.1 8B"""
 
-    # Проверяем выученные паттерны
+def learned_analysis(user_message: str, soul_memory: Dict[str, Any]) -> Dict[str, Any] | None:
+    """Анализ из выученных поправок, если сообщение подходит под паттерн"""
     learned_patterns = soul_memory.get('emotion_corrections', {})
     for pattern, correct_analysis in learned_patterns.items():
         if pattern.lower() in user_message.lower():
             print(f"[DEBUG] Использую выученный паттерн: {pattern}")
             return correct_analysis
+    return None
+
+
+# Схема единого анализа; значения по умолчанию — для полей, которые модель может пропустить
+UNIFIED_SCHEMA = JsonSchema({
+    "feeling": {"type": "string"},
+    "intensity": {"type": "string", "enum": IMPORTANCE_LEVELS, "default": "средняя"},
+    "is_new": {"type": "boolean", "default": False},
+    "description": {"type": "string", "default": ""},
+    "importance": {"type": "string", "enum": IMPORTANCE_LEVELS},
+    "action": {"type": "string", "enum": ACTIONS},
+    "tone": {"type": "string"},
+    "subtone": {"type": ["string", "null"], "default": None},
+})
+
 
-    # УСИЛЕННЫЙ промпт для Llama 3.1
-    prompt = f"""Ты эмоциональный аналитик. Определи ТОЧНУЮ эмоцию в сообщении: "{user_message}"
+# Статичная часть единого анализа: правила и формат. Стоит в system перед
+# сообщением, чтобы Ollama разбирала её один раз (см. ollama_prefix)
+UNIFIED_SYSTEM = """Ты эмоциональный аналитик цифровой души. Тебе присылают сообщение пользователя, а ты определяешь в нём ТОЧНУЮ эмоцию.
 
-СТРОГИЕ ПРАВИЛА:
-- "не грустно", "уже лучше", "спасибо" = РАДОСТЬ, не грусть!
-- "mon amour", "❤️", "<3", "люблю" = НЕЖНОСТЬ/ЛЮБОВЬ
-- "мурчишь", игривые фразы = ИГРИВОСТЬ  
-- одиночество + тепло = особая НЕЖНОСТЬ
-- простое "привет" = НЕЙТРАЛЬНО, низкая важность
+СТРОГИЕ ПРАВИЛА - НЕ ОШИБАЙСЯ:
+- "мне уже не грустно", "уже лучше" = облегчение, не грусть!
+- "спасибо" после грустной темы = радость
+- "mon amour", "❤️", "<3", "люблю" = нежность
+- "мурчишь", игривые фразы = игривость
+- одиночество + тепло = особая нежность
+- вопросы о чувствах = любопытство
+- просьбы о помощи = доверие
+- простое "привет" = нейтрально, низкая важность
 
-ЭМОЦИИ: радость, нежность, игривость, грусть, любовь, страсть, спокойствие, нейтрально
+ЗАПРЕЩЕНО отвечать "спокойствие" или "нейтрально" для эмоциональных фраз!
+Если ни одна эмоция не подходит точно - создай новую (1-2 слова) и поставь "is_new": true.
 
-ВАЖНОСТЬ: 
+ЭМОЦИИ: радость, нежность, игривость, грусть, любовь, страсть, облегчение, любопытство, доверие, спокойствие, нейтрально
+
+ИНТЕНСИВНОСТЬ: низкая, средняя, высокая
+
+ВАЖНОСТЬ:
 - высокая: имена, сильные эмоции, личные признания
-- средняя: эмоциональные фразы  
+- средняя: эмоциональные фразы
 - низкая: обычные приветствия
 
+ДЕЙСТВИЕ: запомнить, ничего
+
 ТОНА:
 - радость/игривость → игривый
 - нежность/любовь → нежный
-- грусть → сочувствующий  
+- грусть → сочувствующий
 - спокойствие → спокойный
 
-Ответь ТОЧНО в формате:
-emotion=нежность
-importance=средняя
-action=запомнить
-tone=нежный
-subtone=дрожащий"""
+САБТОН (или null): шепчущий, дрожащий, уверенный, мечтательный, задумчивый, интимный
 
-    try:
-        response = requests.post(
-            "http://localhost:11434/api/generate",
-            json={"model": "llama3.1:8b", "prompt": prompt, "stream": False},
-            timeout=15
-        )
+Отвечай ТОЛЬКО JSON-объектом:
+{"feeling": "облегчение", "intensity": "средняя", "is_new": false, "description": "когда плохое прошло", "importance": "средняя", "action": "запомнить", "tone": "нежный", "subtone": "дрожащий"}"""
+
+UNIFIED_PREFIX = PromptPrefix("llama3.1:8b", UNIFIED_SYSTEM)
 
-        if response.status_code == 200:
-            llama_response = response.json().get("response", "")
-            print(f"[DEBUG] Llama ответил: {llama_response[:100]}...")
 
-            # Улучшенный парсинг
-            result = parse_llama_analysis_improved(llama_response)
-            print(f"[DEBUG] Распарсили как: {result}")
+def _unified_prompt(user_message: str) -> str:
+    # Переменная часть — только сообщение, после общего префикса
+    return f'Сообщение: "{user_message}"'
 
-            return result
 
+def _unified_payload(user_message: str) -> Dict[str, Any]:
+    return UNIFIED_PREFIX.payload(_unified_prompt(user_message), format=UNIFIED_SCHEMA.format)
+
+
+# Версия промпта для кэша анализа: меняется вместе с правилами, схемой и моделью
+_UNIFIED_VERSION = prompt_version(
+    {"model": UNIFIED_PREFIX.model, "system": UNIFIED_SYSTEM, "prompt": _unified_prompt(""), "format": UNIFIED_SCHEMA.format}
+)
+
+
+def _cached_unified(user_message: str) -> Dict[str, Any] | None:
+    cached = get_analysis_cache().get("unified", _UNIFIED_VERSION, user_message)
+    if cached is not None:
+        print(f"[DEBUG] Анализ из кэша: {cached}")
+    return cached
+
+
+def _remember_unified(user_message: str, result: Dict[str, Any] | None) -> Dict[str, Any] | None:
+    print(f"[DEBUG] Llama ответил: {result}")
+    # Неподходящий ответ (модель не справилась со схемой) не кэшируем — это не анализ
+    if result is not None:
+        get_analysis_cache().put("unified", _UNIFIED_VERSION, user_message, result)
+    return result
+
+
+def analyze_unified(user_message: str) -> Dict[str, Any] | None:
+    """Единый анализ сообщения одним вызовом Llama; None — если Llama недоступна"""
+    cached = _cached_unified(user_message)
+    if cached is not None:
+        return cached
+    try:
+        result = generate_json(_unified_payload(user_message), UNIFIED_SCHEMA, "unified", timeout=15)
+        return _remember_unified(user_message, result)
     except Exception as e:
         print(f"[WARN] Ошибка анализа Llama: {e}")
+        return None
 
-    # Более умный fallback
-    return smart_fallback_analysis(user_message)
+
+async def aanalyze_unified(user_message: str) -> Dict[str, Any] | None:
+    """Асинхронный вариант ``analyze_unified``"""
+    cached = _cached_unified(user_message)
+    if cached is not None:
+        return cached
+    try:
+        result = await agenerate_json(_unified_payload(user_message), UNIFIED_SCHEMA, "unified", timeout=15)
+        return _remember_unified(user_message, result)
+    except Exception as e:
+        print(f"[WARN] Ошибка анализа Llama: {e}")
+        return None
+
+
+def unified_to_analysis(unified: Dict[str, Any]) -> Dict[str, Any]:
+    """Единый анализ в формате ``analysis`` (emotion_detected, importance, ...)"""
+    return {
+        "emotion_detected": unified["feeling"],
+        # Новая эмоция — всегда важный момент
+        "importance": "высокая" if unified.get("is_new") else unified["importance"],
+        "action_needed": unified["action"],
+        "response_tone": unified["tone"],
+        "subtone": unified.get("subtone"),
+    }
+
+
+def analyze_with_self_learning(user_message: str, soul_memory: Dict[str, Any]) -> Dict[str, Any]:
+    """Анализ с учётом выученных поправок поверх единого анализа"""
+    learned = learned_analysis(user_message, soul_memory)
+    if learned is not None:
+        return learned
+    unified = analyze_unified(user_message)
+    if unified is None:
+        # Более умный fallback
+        return smart_fallback_analysis(user_message)
+    return unified_to_analysis(unified)
 
 
 def call_llama_analysis(prompt: str) -> Dict[str, Any]:
+    """Простой анализ по готовому промпту (промпт должен просить JSON по ``ANALYSIS_SCHEMA``)"""
+    payload = {"model": "llama3.2:3b", "prompt": prompt}
+    try:
+        data = generate_json(payload, ANALYSIS_SCHEMA, "call_llama_analysis")
+        if data is not None:
+            return _analysis_from_json(data)
+    except Exception as e:
+        print(f"Ошибка анализа Llama: {e}")
+    return _neutral_analysis()
+
+
+def summarize_memories(texts: List[str]) -> str | None:
+    """Сжимает несколько похожих воспоминаний в одно через Llama; None — если не вышло"""
+    joined = "\n".join(f"- {text}" for text in texts)
+    prompt = f"""Вот несколько похожих воспоминаний цифровой души:
+{joined}
+
+Сожми их в одно воспоминание: 1–2 предложения, без вступлений, сохрани
+имена, факты и чувства. Ответь только текстом воспоминания."""
     payload = {"model": "llama3.2:3b", "prompt": prompt, "stream": False}
     try:
-        response = requests.post(config.OLLAMA_URL, json=payload, timeout=10)
+        response = ollama_generate(payload, timeout=config.MEMORY_CONSOLIDATE_LLM_TIMEOUT)
         response.raise_for_status()
-        data = response.json().get("response", "")
-        result = {
-            "emotion_detected": "нейтрально",
-            "importance": "низкая",
-            "action_needed": "ничего",
-            "response_tone": "спокойный",
-        }
-        patterns = {
-            "emotion_detected": r"emotion=(\w+)",
-            "importance": r"importance=(\w+)",
-            "action_needed": r"action=(\w+)",
-            "response_tone": r"tone=(\w+)",
-        }
-        for key, rgx in patterns.items():
-            m = re.search(rgx, data)
-            if m:
-                result[key] = m.group(1)
-        return result
+        summary = response.json().get("response", "").strip()
+        return summary or None
     except Exception as e:
-        print(f"Ошибка анализа Llama: {e}")
-        return {
-            "emotion_detected": "нейтрально",
-            "importance": "низкая",
-            "action_needed": "ничего",
-            "response_tone": "спокойный",
-        }
+        print(f"[WARN] Llama не смогла сжать воспоминания: {e}")
+        return None
 
 
 def should_remember_for_correction(message: str, analysis: Dict[str, Any]) -> bool:
@@ -250,71 +293,19 @@ def save_analysis_for_review(message: str, analysis: Dict[str, Any], soul_memory
     })
 
 
-def parse_llama_analysis(response_text: str) -> Dict[str, Any]:
-    """Парсит ответ Llama в словарь."""
-    result = {
-        "emotion_detected": "нейтрально",
-        "importance": "низкая",
-        "action_needed": "ничего",
-        "response_tone": "спокойный",
-        "subtone": None,
-    }
-    patterns = {
-        "emotion_detected": r"emotion=([\w-]+)",
-        "importance": r"importance=([\w-]+)",
-        "action_needed": r"action=([\w-]+)",
-        "response_tone": r"tone=([\w-]+)",
-        "subtone": r"subtone=([\w\-]+)",
-    }
-    for key, rgx in patterns.items():
-        m = re.search(rgx, response_text)
-        if m:
-            result[key] = m.group(1)
-    return result
-
-
-def parse_llama_analysis_improved(llama_response: str) -> Dict[str, Any]:
-    """Улучшенный парсинг ответа Llama"""
-    import re
-
-    result = {
-        "emotion_detected": "нейтрально",
-        "importance": "низкая",
-        "action_needed": "ничего",
-        "response_tone": "спокойный",
-        "subtone": None,
-    }
-
-    patterns = {
-        "emotion_detected": [r"emotion[=:]\s*(\w+)", r"эмоция[=:]\s*(\w+)"],
-        "importance": [r"importance[=:]\s*(\w+)", r"важность[=:]\s*(\w+)"],
-        "action_needed": [r"action[=:]\s*(\w+)", r"действие[=:]\s*(\w+)"],
-        "response_tone": [r"tone[=:]\s*(\w+)", r"тон[=:]\s*(\w+)"],
-        "subtone": [r"subtone[=:]\s*(\w+)", r"сабтон[=:]\s*(\w+)"],
-    }
-
-    for key, regexes in patterns.items():
-        for regex in regexes:
-            match = re.search(regex, llama_response.lower())
-            if match:
-                result[key] = match.group(1)
-                break
-
-    return result
-
-
 def smart_fallback_analysis(user_message: str) -> Dict[str, Any]:
     """Умный фолбэк если Llama не сработала"""
-    msg_lower = user_message.lower()
-
-    if any(word in msg_lower for word in ["amour", "❤️", "<3", "люблю"]):
-        return {"emotion_detected": "нежность", "importance": "высокая", "action_needed": "запомнить", "response_tone": "нежный"}
-
-    if any(word in msg_lower for word in ["мур", "игрив", "шал"]):
-        return {"emotion_detected": "игривость", "importance": "средняя", "action_needed": "запомнить", "response_tone": "игривый"}
-
-    if any(word in msg_lower for word in ["не грустно", "лучше", "спасибо"]):
-        return {"emotion_detected": "радость", "importance": "средняя", "action_needed": "запомнить", "response_tone": "игривый"}
+    found = emotion_rules.scan(user_message)
+    if "negative" in found:
+        # По словам не угадать, что стоит за отрицанием или тревогой
+        return {"emotion_detected": "нейтрально", "importance": "средняя", "action_needed": "ничего", "response_tone": "спокойный"}
+    found = found.get("fallback", set())
+
+    # Порядок важен: нежность сильнее игривости, игривость сильнее радости
+    for emotion in ("нежность", "игривость", "радость"):
+        if emotion in found:
+            importance, action, tone = emotion_rules.RULE_ANALYSIS[emotion]
+            return {"emotion_detected": emotion, "importance": importance, "action_needed": action, "response_tone": tone}
 
     return {"emotion_detected": "нейтрально", "importance": "низкая", "action_needed": "ничего", "response_tone": "спокойный"}
 
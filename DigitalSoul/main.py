@@ -1,5 +1,7 @@
 """Консольный интерфейс для Digital Soul."""
 
+from . import structured_output
+from .analysis_cache import get_analysis_cache
 from .soul_core import SoulCore
 
 
@@ -14,8 +16,30 @@ def main():
             break
         if user_message.lower() in {"exit", "выход"}:
             break
-        response = soul.process_message(user_message)
-        print(f"Душа: {response}")
+        # Ответ печатается по токенам, как только они приходят
+        started = False
+        for token in soul.process_message_stream(user_message):
+            if not started:
+                print("Душа: ", end="", flush=True)
+                started = True
+            print(token, end="", flush=True)
+        stats = soul.last_response_stats
+        if stats.get("ttft_ms") is not None:
+            print(
+                f"[STREAM] первый токен через {stats['ttft_ms']:.0f} мс, "
+                f"{stats['tokens']} токенов, {stats['tokens_per_second']:.1f} ток/с"
+            )
+
+    stats = get_analysis_cache().get_stats()
+    print(
+        f"[CACHE] Анализ эмоций: попаданий {stats['hit_rate']:.0%} "
+        f"({stats['memory_hits'] + stats['disk_hits']} из {stats['memory_hits'] + stats['disk_hits'] + stats['misses']})"
+    )
+    for label, json_stats in structured_output.get_stats().items():
+        print(
+            f"[JSON] {label}: неподходящих ответов {json_stats['failure_rate']:.0%}, "
+            f"повторов {json_stats['retries']}, без результата {json_stats['gave_up']}"
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,127 @@
+"""Бенчмарк кодеков хранения векторов единой памяти.
+
+Сравнивает float32 / fp16 / sq8 / pq на синтетических кластеризованных
+нормированных векторах: байт на вектор, размер сериализованного индекса,
+задержку поиска и recall@k против точного перебора — без пересчёта и
+с пересчётом кандидатов по float16-копии (как в FaissUnifiedMemory).
+
+Запуск: ``python -m DigitalSoul.memory_codec_bench --n 20000 --mode flat``
+"""
+
+import argparse
+import time
+from typing import Any, Dict, List
+
+import faiss
+import numpy as np
+
+from . import config
+from .memory_index import VECTOR_CODECS, build_index, can_build, set_search_params, vector_code_size
+
+
+def make_vectors(n: int, dim: int, clusters: int = 64, seed: int = 0) -> np.ndarray:
+    """Нормированные векторы вокруг случайных центров (похоже на эмбеддинги текстов)"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype("float32")
+    vectors = centers[rng.integers(0, clusters, n)] + 0.6 * rng.standard_normal((n, dim)).astype("float32")
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def _recall(found: np.ndarray, exact: np.ndarray) -> float:
+    hits = sum(len(set(f) & set(e)) for f, e in zip(found.tolist(), exact.tolist()))
+    return hits / exact.size
+
+
+def bench_codec(
+    mode: str,
+    codec: str,
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    exact_ids: np.ndarray,
+    k: int,
+    rescore_factor: int,
+) -> Dict[str, Any]:
+    started = time.perf_counter()
+    index = build_index(
+        mode,
+        vectors,
+        nlist=config.MEMORY_IVF_NLIST,
+        pq_m=config.MEMORY_PQ_M,
+        hnsw_m=config.MEMORY_HNSW_M,
+        codec=codec,
+    )
+    build_s = time.perf_counter() - started
+    set_search_params(index, nprobe=config.MEMORY_IVF_NPROBE, ef_search=config.MEMORY_HNSW_EF_SEARCH)
+
+    started = time.perf_counter()
+    _, ids = index.search(queries, k)
+    search_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+    # Пересчёт: берём k·factor кандидатов и сортируем по точному сходству с float16-копией
+    raw = vectors.astype("float16")
+    started = time.perf_counter()
+    _, candidates = index.search(queries, k * rescore_factor)
+    rescored = np.empty((len(queries), k), dtype="int64")
+    for row, (query, cand) in enumerate(zip(queries, candidates)):
+        cand = cand[cand >= 0]
+        scores = raw[cand].astype("float32") @ query
+        rescored[row] = cand[np.argsort(-scores, kind="stable")[:k]]
+    rescore_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+    code_size = vector_code_size(index)
+    return {
+        "mode": mode,
+        "codec": codec,
+        "bytes_per_vector": code_size,
+        "compression": vectors.shape[1] * 4 / code_size,
+        "index_mb": len(faiss.serialize_index(index)) / 2**20,
+        "build_s": build_s,
+        "search_ms": search_ms,
+        "recall": _recall(ids, exact_ids),
+        "rescore_ms": rescore_ms,
+        "recall_rescored": _recall(rescored, exact_ids),
+    }
+
+
+def run(n: int, dim: int, mode: str, k: int, queries: int, rescore_factor: int) -> List[Dict[str, Any]]:
+    vectors = make_vectors(n + queries, dim)
+    vectors, query_vectors = vectors[:n], vectors[n:]
+    exact = faiss.IndexFlatIP(dim)
+    exact.add(vectors)
+    _, exact_ids = exact.search(query_vectors, k)
+
+    results = []
+    for codec in VECTOR_CODECS:
+        if not can_build(mode, n, config.MEMORY_IVF_NLIST, codec):
+            print(f"[BENCH] {mode}/{codec}: мало векторов для обучения, пропускаю")
+            continue
+        results.append(bench_codec(mode, codec, vectors, query_vectors, exact_ids, k, rescore_factor))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк кодеков векторов единой памяти")
+    parser.add_argument("--n", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--mode", default="flat", choices=["flat", "ivf_flat", "hnsw"])
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--rescore-factor", type=int, default=config.MEMORY_RESCORE_FACTOR or 4)
+    args = parser.parse_args()
+
+    results = run(args.n, args.dim, args.mode, args.k, args.queries, args.rescore_factor)
+    print(
+        f"{'codec':<8} {'B/vec':>6} {'x':>6} {'MB':>8} {'build s':>8} "
+        f"{'ms/q':>7} {'recall':>7} {'ms/q+rs':>8} {'recall+rs':>9}"
+    )
+    for r in results:
+        print(
+            f"{r['codec']:<8} {r['bytes_per_vector']:>6} {r['compression']:>6.1f} {r['index_mb']:>8.1f} "
+            f"{r['build_s']:>8.2f} {r['search_ms']:>7.3f} {r['recall']:>7.3f} "
+            f"{r['rescore_ms']:>8.3f} {r['recall_rescored']:>9.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""Параллельные NumPy-колонки для векторизованного скоринга воспоминаний."""
+
+import math
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+TYPE_WEIGHTS = {"recent": 1.0, "important": 0.9, "diary": 0.8, "summary": 0.8, "archive": 0.6}
+IMPORTANCE_WEIGHTS = {"высокая": 1.0, "средняя": 0.8, "низкая": 0.6}
+DEFAULT_TYPE_WEIGHT = 0.6
+DEFAULT_IMPORTANCE_WEIGHT = 0.8
+
+AGE_PENALTY_HOURS = 24 * 7
+MAX_AGE_PENALTY = 0.5
+
+
+_COLUMNS = {
+    "timestamps": "float64",
+    "type_weights": "float32",
+    "importance_weights": "float32",
+    "type_codes": "int32",
+    "importance_codes": "int32",
+    "emotion_codes": "int32",
+    "alive": "bool",
+}
+
+# Колонки, по кодам которых поддерживаются счётчики живых воспоминаний
+COUNTED_COLUMNS = ("type_codes", "importance_codes", "emotion_codes")
+
+
+class MemoryColumns:
+    """Время создания, веса и коды строк воспоминаний, выровненные по id.
+
+    Строка с номером id существует для каждого когда-либо выданного id;
+    забытые воспоминания остаются в колонках с ``alive = False``.
+    Счётчики по кодам и самое старое/новое время живых поддерживаются
+    при вставке и забывании, поэтому статистика не требует прохода.
+    """
+
+    def __init__(self, capacity: int = 256):
+        self.size = 0
+        self.alive_count = 0
+        for name, dtype in _COLUMNS.items():
+            setattr(self, name, np.zeros(capacity, dtype=dtype))
+        self.counts = {name: np.zeros(16, dtype="int64") for name in COUNTED_COLUMNS}
+        self.oldest = math.inf
+        self.newest = -math.inf
+
+    def _add_counts(self, rows, delta: int):
+        for name in COUNTED_COLUMNS:
+            codes = getattr(self, name)[rows]
+            counts = self.counts[name]
+            top = int(np.max(codes)) + 1 if np.size(codes) else 0
+            if top > len(counts):
+                counts = np.concatenate([counts, np.zeros(max(top, 2 * len(counts)) - len(counts), dtype="int64")])
+                self.counts[name] = counts
+            np.add.at(counts, codes, delta)
+
+    def _recompute_extremes(self):
+        alive = self.timestamps[: self.size][self.alive[: self.size]]
+        self.oldest = float(alive.min()) if len(alive) else math.inf
+        self.newest = float(alive.max()) if len(alive) else -math.inf
+
+    def _grow(self, needed: int):
+        capacity = len(self.timestamps)
+        if needed <= capacity:
+            return
+        new_capacity = max(needed, capacity * 2)
+        for name, dtype in _COLUMNS.items():
+            old = getattr(self, name)
+            grown = np.zeros(new_capacity, dtype=dtype)
+            grown[: self.size] = old[: self.size]
+            setattr(self, name, grown)
+
+    def append(
+        self,
+        memory_id: int,
+        timestamp: float,
+        memory_type: str,
+        importance: str,
+        codes: Tuple[int, int, int] = (0, 0, 0),
+    ) -> None:
+        self._grow(memory_id + 1)
+        row = memory_id
+        if self.alive[row]:
+            self._add_counts([row], -1)
+        else:
+            self.alive_count += 1
+        self.alive[row] = True
+        self.timestamps[row] = timestamp
+        self.type_weights[row] = TYPE_WEIGHTS.get(memory_type, DEFAULT_TYPE_WEIGHT)
+        self.importance_weights[row] = IMPORTANCE_WEIGHTS.get(importance, DEFAULT_IMPORTANCE_WEIGHT)
+        self.type_codes[row], self.importance_codes[row], self.emotion_codes[row] = codes
+        self.size = max(self.size, memory_id + 1)
+        self._add_counts([row], 1)
+        self.oldest = min(self.oldest, timestamp)
+        self.newest = max(self.newest, timestamp)
+
+    def load(self, table: Dict[str, np.ndarray], labels: List[str], size: int = 0) -> None:
+        """Заполняет колонки целиком из хранилища метаданных (без цикла по записям)"""
+        ids = table["ids"]
+        count = max(size, int(ids.max()) + 1 if len(ids) else 0)
+        self._grow(count)
+        self.size = count
+        self.alive[:count] = False
+        self.alive[ids] = True
+        self.alive_count = len(ids)
+        type_lookup = np.array([TYPE_WEIGHTS.get(v, DEFAULT_TYPE_WEIGHT) for v in labels] or [0.0], dtype="float32")
+        importance_lookup = np.array(
+            [IMPORTANCE_WEIGHTS.get(v, DEFAULT_IMPORTANCE_WEIGHT) for v in labels] or [0.0], dtype="float32"
+        )
+        self.timestamps[ids] = table["timestamps"]
+        self.type_codes[ids] = table["type_codes"]
+        self.importance_codes[ids] = table["importance_codes"]
+        self.emotion_codes[ids] = table["emotion_codes"]
+        self.type_weights[ids] = type_lookup[table["type_codes"]]
+        self.importance_weights[ids] = importance_lookup[table["importance_codes"]]
+        for name in COUNTED_COLUMNS:
+            self.counts[name] = np.bincount(table[name], minlength=16).astype("int64")
+        self._recompute_extremes()
+
+    def kill(self, ids: np.ndarray) -> None:
+        """Помечает воспоминания забытыми"""
+        ids = np.unique(np.asarray(ids, dtype="int64"))
+        ids = ids[self.alive[ids]]
+        if not len(ids):
+            return
+        self.alive_count -= len(ids)
+        self.alive[ids] = False
+        self._add_counts(ids, -1)
+        timestamps = self.timestamps[ids]
+        # Пересчёт крайних времён нужен, только если забыли самое старое или новое
+        if timestamps.min() <= self.oldest or timestamps.max() >= self.newest:
+            self._recompute_extremes()
+
+    def touch(self, memory_id: int, timestamp: float) -> None:
+        """Обновляет время живого воспоминания (повтор освежает его)"""
+        previous = self.timestamps[memory_id]
+        self.timestamps[memory_id] = timestamp
+        self.newest = max(self.newest, timestamp)
+        if previous <= self.oldest:
+            self._recompute_extremes()
+
+    def code_counts(self, name: str) -> Dict[int, int]:
+        """Число живых воспоминаний по кодам колонки (без нулевых)"""
+        counts = self.counts[name]
+        codes = np.flatnonzero(counts)
+        return dict(zip(codes.tolist(), counts[codes].tolist()))
+
+    def alive_ids(self) -> np.ndarray:
+        return np.flatnonzero(self.alive[: self.size])
+
+    def is_alive(self, ids: np.ndarray) -> np.ndarray:
+        """Маска живых среди переданных id (неизвестные id считаются мёртвыми)"""
+        ids = np.asarray(ids, dtype="int64")
+        mask = (ids >= 0) & (ids < self.size)
+        mask[mask] = self.alive[ids[mask]]
+        return mask
+
+    def priority_scores(self, ids: np.ndarray, now: float | None = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Возвращает (priority_score, age_hours) только для переданных id"""
+        if now is None:
+            now = datetime.now().timestamp()
+        age_hours = (now - self.timestamps[ids]) / 3600.0
+        age_penalty = np.minimum(age_hours / AGE_PENALTY_HOURS, MAX_AGE_PENALTY)
+        base_score = self.type_weights[ids] * self.importance_weights[ids]
+        return base_score * (1.0 - age_penalty), age_hours
@@ -0,0 +1,92 @@
+"""Консолидация старых мелких воспоминаний в сводные.
+
+Кандидаты — живые воспоминания выбранных типов и важности старше порога.
+Они идут по времени и жадно собираются в кластеры: воспоминание
+присоединяется к открытому кластеру, если близко к его центроиду по
+косинусу и не дальше ``max_gap_hours`` от его последнего воспоминания.
+Каждый достаточно крупный кластер потом заменяется одной сводкой.
+"""
+
+from datetime import datetime
+from typing import Dict, List
+
+import numpy as np
+
+from .memory_columns import MemoryColumns
+
+
+def select_candidates(
+    columns: MemoryColumns,
+    type_codes: List[int],
+    importance_codes: List[int],
+    min_age_hours: float,
+    now: float | None = None,
+) -> np.ndarray:
+    """id воспоминаний, которые можно консолидировать"""
+    if now is None:
+        now = datetime.now().timestamp()
+    ids = columns.alive_ids()
+    mask = np.isin(columns.type_codes[ids], type_codes) & np.isin(columns.importance_codes[ids], importance_codes)
+    mask &= (now - columns.timestamps[ids]) / 3600.0 >= min_age_hours
+    return ids[mask]
+
+
+def cluster_memories(
+    ids: np.ndarray,
+    vectors: np.ndarray,
+    timestamps: np.ndarray,
+    similarity: float,
+    max_gap_hours: float,
+    min_size: int,
+    max_size: int,
+) -> List[np.ndarray]:
+    """Жадная кластеризация по сходству и близости во времени; возвращает id кластеров"""
+    order = np.argsort(timestamps, kind="stable")
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms > 0, norms, 1.0)
+    max_gap = max_gap_hours * 3600.0
+
+    members: List[List[int]] = []
+    sums: List[np.ndarray] = []
+    last_seen: List[float] = []
+    open_clusters: List[int] = []
+    for row in order.tolist():
+        timestamp = float(timestamps[row])
+        open_clusters = [c for c in open_clusters if timestamp - last_seen[c] <= max_gap and len(members[c]) < max_size]
+        best, best_score = -1, similarity
+        if open_clusters:
+            centroids = np.stack([sums[c] for c in open_clusters])
+            centroids /= np.linalg.norm(centroids, axis=1, keepdims=True)
+            scores = centroids @ vectors[row]
+            top = int(np.argmax(scores))
+            if scores[top] >= best_score:
+                best = open_clusters[top]
+        if best < 0:
+            best = len(members)
+            members.append([])
+            sums.append(np.zeros(vectors.shape[1], dtype="float32"))
+            last_seen.append(timestamp)
+            open_clusters.append(best)
+        members[best].append(row)
+        sums[best] += vectors[row]
+        last_seen[best] = timestamp
+    return [ids[np.array(rows)] for rows in members if len(rows) >= min_size]
+
+
+def extractive_summary(texts: List[str], vectors: np.ndarray, max_items: int = 3, max_chars: int = 500) -> str:
+    """Запасная сводка без LLM: самые центральные тексты кластера в исходном порядке"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms > 0, norms, 1.0)
+    centroid = vectors.mean(axis=0)
+    central = sorted(np.argsort(-(vectors @ centroid), kind="stable")[:max_items].tolist())
+    summary = " … ".join(texts[i].strip() for i in central)
+    return summary if len(summary) <= max_chars else summary[: max_chars - 1] + "…"
+
+
+def dominant_label(labels: List[str]) -> str:
+    """Самая частая непустая метка (эмоция кластера)"""
+    counts: Dict[str, int] = {}
+    for label in labels:
+        if label:
+            counts[label] = counts.get(label, 0) + 1
+    return max(counts, key=counts.get) if counts else ""
@@ -0,0 +1,40 @@
+"""Политика забывания для единой памяти.
+
+Решение принимается векторно по колонкам: старые воспоминания с низким
+``priority_score`` забываются, а для каждого ``memory_type`` действует
+лимит живых записей — лишние уходят начиная с самых слабых.
+"""
+
+from typing import Dict
+
+import numpy as np
+
+from .memory_columns import MemoryColumns
+
+
+def select_for_forgetting(
+    columns: MemoryColumns,
+    type_codes: Dict[str, int],
+    min_age_hours: float,
+    max_priority: float,
+    type_caps: Dict[str, int],
+    now: float | None = None,
+) -> np.ndarray:
+    """Возвращает id воспоминаний, которые пора забыть"""
+    ids = columns.alive_ids()
+    if not len(ids):
+        return ids
+    scores, age_hours = columns.priority_scores(ids, now)
+    forget = (age_hours >= min_age_hours) & (scores < max_priority)
+
+    for memory_type, cap in type_caps.items():
+        code = type_codes.get(memory_type)
+        if code is None:
+            continue
+        of_type = np.flatnonzero((columns.type_codes[ids] == code) & ~forget)
+        excess = len(of_type) - cap
+        if excess > 0:
+            weakest = of_type[np.argsort(scores[of_type], kind="stable")[:excess]]
+            forget[weakest] = True
+
+    return ids[forget]
@@ -0,0 +1,271 @@
+"""Фабрика FAISS-индексов для единой памяти.
+
+Режимы: ``flat`` (точный перебор), ``ivf_flat``, ``ivf_pq`` и ``hnsw``.
+Маленькая душа живёт на IndexFlatIP, а после порога размера переводится
+на обученный ANN-индекс. Точность/скорость регулируется nprobe/efSearch
+и проверяется отчётом recall@k против точного индекса.
+
+Любой индекс оборачивается в IndexIDMap2, поэтому id воспоминания
+стабилен и не совпадает с позицией вектора: записи можно удалять и
+перестраивать индекс без перенумерации.
+
+Кодек задаёт, как хранятся сами векторы: ``float32`` (как есть),
+``fp16`` (вдвое меньше), ``sq8`` (8-битное скалярное квантование, вчетверо)
+или ``pq`` (коды произведения квантователей, ``pq_m`` байт на вектор).
+"""
+
+import math
+import time
+from typing import Any, Dict, Tuple
+
+import faiss
+import numpy as np
+
+INDEX_MODES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+VECTOR_CODECS = ("float32", "fp16", "sq8", "pq")
+
+_SQ_TYPES = {
+    "fp16": faiss.ScalarQuantizer.QT_fp16,
+    "sq8": faiss.ScalarQuantizer.QT_8bit,
+}
+
+# Ниже этого числа точек на кластер k-means в FAISS обучается плохо
+MIN_POINTS_PER_CENTROID = 39
+PQ_TRAINING_POINTS = 256
+
+
+def choose_nlist(ntotal: int, nlist: int = 0) -> int:
+    """Число IVF-кластеров: явное или ~4·sqrt(N), но не больше N/39"""
+    if nlist <= 0:
+        nlist = int(4 * math.sqrt(max(ntotal, 1)))
+    return max(1, min(nlist, ntotal // MIN_POINTS_PER_CENTROID))
+
+
+def can_build(mode: str, ntotal: int, nlist: int = 0, codec: str = "float32") -> bool:
+    """Хватает ли векторов для обучения индекса выбранного режима и кодека"""
+    if mode == "ivf_pq" or codec == "pq":
+        if ntotal < PQ_TRAINING_POINTS:
+            return False
+    elif codec == "sq8" and ntotal == 0:
+        return False
+    if mode in ("flat", "hnsw"):
+        return True
+    return ntotal >= MIN_POINTS_PER_CENTROID
+
+
+def create_index(
+    mode: str,
+    dim: int,
+    ntotal: int = 0,
+    nlist: int = 0,
+    pq_m: int = 64,
+    hnsw_m: int = 32,
+    codec: str = "float32",
+) -> faiss.Index:
+    """Создаёт пустой индекс по режиму и кодеку (IVF, SQ8 и PQ ещё нужно обучить)"""
+    if codec not in VECTOR_CODECS:
+        raise ValueError(f"Неизвестный кодек векторов: {codec}")
+    metric = faiss.METRIC_INNER_PRODUCT
+    if mode == "flat":
+        if codec in _SQ_TYPES:
+            return faiss.IndexScalarQuantizer(dim, _SQ_TYPES[codec], metric)
+        if codec == "pq":
+            # IndexPQ не принимает селектор id, поэтому полный перебор PQ-кодов
+            # делается через IVF с единственным списком
+            return faiss.IndexIVFPQ(faiss.IndexFlatIP(dim), dim, 1, pq_m, 8, metric)
+        return faiss.IndexFlatIP(dim)
+    if mode == "hnsw":
+        if codec in _SQ_TYPES:
+            return faiss.IndexHNSWSQ(dim, _SQ_TYPES[codec], hnsw_m, metric)
+        if codec == "pq":
+            return faiss.IndexHNSWPQ(dim, pq_m, hnsw_m, 8, metric)
+        return faiss.IndexHNSWFlat(dim, hnsw_m, metric)
+    if mode in ("ivf_flat", "ivf_pq"):
+        quantizer = faiss.IndexFlatIP(dim)
+        lists = choose_nlist(ntotal, nlist)
+        if mode == "ivf_pq" or codec == "pq":
+            return faiss.IndexIVFPQ(quantizer, dim, lists, pq_m, 8, metric)
+        if codec in _SQ_TYPES:
+            return faiss.IndexIVFScalarQuantizer(quantizer, dim, lists, _SQ_TYPES[codec], metric)
+        return faiss.IndexIVFFlat(quantizer, dim, lists, metric)
+    raise ValueError(f"Неизвестный режим индекса: {mode}")
+
+
+def create_id_index(mode: str, dim: int, **params) -> faiss.IndexIDMap2:
+    """Пустой индекс со стабильными id (для обучаемых режимов — ещё не обученный)"""
+    return faiss.IndexIDMap2(create_index(mode, dim, **params))
+
+
+def build_index(mode: str, vectors: np.ndarray, ids: np.ndarray | None = None, **params) -> faiss.IndexIDMap2:
+    """Создаёт, обучает и заполняет индекс готовыми векторами с их id"""
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    if ids is None:
+        ids = np.arange(len(vectors), dtype="int64")
+    inner = create_index(mode, vectors.shape[1], ntotal=len(vectors), **params)
+    if not inner.is_trained:
+        inner.train(vectors)
+    index = faiss.IndexIDMap2(inner)
+    if len(vectors):
+        index.add_with_ids(vectors, np.ascontiguousarray(ids, dtype="int64"))
+    return index
+
+
+def _unwrap(index: faiss.Index) -> faiss.Index:
+    index = faiss.downcast_index(index)
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def index_ids(index: faiss.Index) -> np.ndarray:
+    """id всех векторов индекса в порядке хранения"""
+    index = faiss.downcast_index(index)
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.vector_to_array(index.id_map).astype("int64")
+    return np.arange(index.ntotal, dtype="int64")
+
+
+def ensure_id_map(index: faiss.Index) -> faiss.IndexIDMap2:
+    """Оборачивает старый индекс (позиция = id) в IndexIDMap2 без потери векторов"""
+    # Возвращаем исходный объект: обёртка от downcast не владеет C++-индексом
+    if isinstance(faiss.downcast_index(index), faiss.IndexIDMap2):
+        return index
+    ids, vectors = reconstruct_with_ids(index)
+    inner = faiss.clone_index(_unwrap(index))
+    inner.reset()
+    wrapped = faiss.IndexIDMap2(inner)
+    if len(vectors):
+        wrapped.add_with_ids(vectors, ids)
+    return wrapped
+
+
+def index_mode(index: faiss.Index) -> str:
+    """Определяет режим по типу загруженного индекса"""
+    index = _unwrap(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVF) and index.nlist == 1:
+        # Один список — тот же точный перебор, только по сжатым кодам
+        return "flat"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+
+def index_codec(index: faiss.Index) -> str:
+    """Определяет кодек хранения векторов загруженного индекса"""
+    index = _unwrap(index)
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    if isinstance(index, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        return "pq"
+    if isinstance(index, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        qtype = index.sq.qtype
+        return next((codec for codec, q in _SQ_TYPES.items() if q == qtype), "sq8")
+    return "float32"
+
+
+def vector_code_size(index: faiss.Index) -> int:
+    """Байт на один вектор в кодах индекса (без графа HNSW и id)"""
+    index = _unwrap(index)
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    return int(index.code_size)
+
+
+def set_search_params(index: faiss.Index, nprobe: int | None = None, ef_search: int | None = None) -> None:
+    """Выставляет nprobe (IVF) или efSearch (HNSW); для flat ничего не делает"""
+    mode = index_mode(index)
+    params = faiss.ParameterSpace()
+    if nprobe and mode in ("ivf_flat", "ivf_pq"):
+        params.set_index_parameter(index, "nprobe", int(nprobe))
+    if ef_search and mode == "hnsw":
+        params.set_index_parameter(index, "efSearch", int(ef_search))
+
+
+def make_search_params(
+    index: faiss.Index,
+    allowed: np.ndarray | None = None,
+    nprobe: int | None = None,
+    ef_search: int | None = None,
+) -> Tuple[faiss.SearchParameters | None, Any]:
+    """Параметры поиска с фильтром по id внутри FAISS.
+
+    ``allowed`` — булева маска длиной в пространство id. Возвращает пару
+    (параметры, селектор); селектор и его битовая карта должны жить до конца
+    поиска, поэтому вызывающий держит ссылку на второй элемент.
+    """
+    if allowed is None:
+        return None, None
+    bitmap = np.packbits(allowed.astype(bool), bitorder="little")
+    # n у IDSelectorBitmap — длина карты в байтах, а не в битах
+    selector = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+    inner = _unwrap(index)
+    if isinstance(inner, faiss.IndexIVF):
+        nprobe = 1 if inner.nlist == 1 else int(nprobe or 1)
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=nprobe)
+    elif isinstance(inner, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=int(ef_search or 16))
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    return params, (selector, bitmap)
+
+
+def reconstruct_with_ids(index: faiss.Index) -> Tuple[np.ndarray, np.ndarray]:
+    """Достаёт (id, векторы) из индекса (для SQ8/PQ — декодированные приближения)"""
+    ids = index_ids(index)
+    inner = _unwrap(index)
+    if inner.ntotal == 0:
+        return ids, np.zeros((0, index.d), dtype="float32")
+    ivf = faiss.try_extract_index_ivf(inner)
+    if ivf is not None:
+        ivf.make_direct_map()
+    return ids, inner.reconstruct_n(0, inner.ntotal)
+
+
+def reconstruct_ids(index: faiss.IndexIDMap2, ids: np.ndarray) -> np.ndarray:
+    """Векторы по стабильным id (для IVF сначала строится прямая карта)"""
+    ivf = faiss.try_extract_index_ivf(_unwrap(index))
+    if ivf is not None:
+        ivf.make_direct_map()
+    return index.reconstruct_batch(np.ascontiguousarray(ids, dtype="int64"))
+
+
+def recall_at_k(
+    index: faiss.Index,
+    vectors: np.ndarray,
+    ids: np.ndarray | None = None,
+    k: int = 5,
+    sample: int = 100,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    """Сравнивает top-k индекса с точным перебором по тем же векторам"""
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    if len(vectors) == 0:
+        return {"recall": 1.0, "k": k, "queries": 0}
+    exact = faiss.IndexIDMap2(faiss.IndexFlatIP(vectors.shape[1]))
+    exact.add_with_ids(vectors, ids if ids is not None else np.arange(len(vectors), dtype="int64"))
+
+    rng = np.random.default_rng(seed)
+    query_ids = rng.choice(len(vectors), size=min(sample, len(vectors)), replace=False)
+    queries = vectors[query_ids]
+    k = min(k, len(vectors))
+
+    started = time.perf_counter()
+    _, exact_ids = exact.search(queries, k)
+    exact_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    _, approx_ids = index.search(queries, k)
+    approx_ms = (time.perf_counter() - started) * 1000
+
+    found = sum(len(set(a) & set(e)) for a, e in zip(approx_ids.tolist(), exact_ids.tolist()))
+    return {
+        "recall": found / (len(queries) * k),
+        "k": k,
+        "queries": len(queries),
+        "mode": index_mode(index),
+        "exact_ms_per_query": exact_ms / len(queries),
+        "index_ms_per_query": approx_ms / len(queries),
+    }
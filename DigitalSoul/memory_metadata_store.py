@@ -0,0 +1,363 @@
+"""Компактное колоночное хранилище метаданных единой памяти на SQLite.
+
+Повторяющиеся строки (``memory_type``, ``importance`` и метка эмоции)
+интернируются в таблицу ``strings`` и хранятся как целые коды; сам
+``emotion_context`` лежит JSON-текстом в строке записи и в память при
+загрузке не попадает. Записи читаются лениво по id, поэтому словари
+создаются только для top-k результатов поиска. Новые записи копятся в памяти до контрольной
+точки и сбрасываются одной транзакцией (до этого их хранит WAL).
+
+id стабильны и никогда не переиспользуются: счётчик ``next_id`` хранится в
+таблице ``meta``. Забытая запись удаляется отсюда сразу, а её вектор
+остаётся в индексе надгробием до ближайшей компакции.
+
+Повтор уже известного воспоминания не создаёт новую запись: у старой
+растёт ``hits`` и обновляется ``timestamp`` (см. ``touch``). Исходные
+воспоминания, свёрнутые консолидацией в сводку, остаются в таблице
+``memory_sources`` под id сводки.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+import numpy as np
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS strings (
+    id INTEGER PRIMARY KEY,
+    value TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS memories (
+    id INTEGER PRIMARY KEY,
+    text TEXT NOT NULL,
+    memory_type INTEGER NOT NULL,
+    importance INTEGER NOT NULL,
+    emotion INTEGER NOT NULL,
+    emotion_context TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS memory_sources (
+    summary_id INTEGER NOT NULL,
+    source_id INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    PRIMARY KEY (summary_id, source_id)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+# Переносит emotion_context из таблицы strings в саму запись (схема до TEXT-колонки)
+_MIGRATE_CONTEXT = """
+CREATE TABLE memories_new (
+    id INTEGER PRIMARY KEY,
+    text TEXT NOT NULL,
+    memory_type INTEGER NOT NULL,
+    importance INTEGER NOT NULL,
+    emotion INTEGER NOT NULL,
+    emotion_context TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 1
+);
+INSERT INTO memories_new
+    SELECT m.id, m.text, m.memory_type, m.importance, m.emotion, COALESCE(s.value, '{}'), m.timestamp, m.hits
+    FROM memories m LEFT JOIN strings s ON s.id = m.emotion_context;
+DROP TABLE memories;
+ALTER TABLE memories_new RENAME TO memories;
+DELETE FROM strings WHERE id NOT IN (
+    SELECT memory_type FROM memories UNION SELECT importance FROM memories UNION SELECT emotion FROM memories
+);
+"""
+
+
+def emotion_label(emotion_context: Dict[str, Any] | None) -> str:
+    """Метка эмоции, по которой интернируется и фильтруется запись"""
+    if not emotion_context:
+        return ""
+    return emotion_context.get("emotion_detected") or emotion_context.get("type") or ""
+
+
+class MemoryMetadataStore:
+    """Метаданные воспоминаний: SQLite + таблица интернированных строк"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+        columns = {row[1]: row[2] for row in self._conn.execute("PRAGMA table_info(memories)")}
+        if "hits" not in columns:
+            self._conn.execute("ALTER TABLE memories ADD COLUMN hits INTEGER NOT NULL DEFAULT 1")
+        if columns["emotion_context"] != "TEXT":
+            self._conn.executescript("BEGIN;" + _MIGRATE_CONTEXT + "COMMIT;")
+            print("[MEMORY] emotion_context перенесён из таблицы строк в записи")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+
+        self._labels: List[str] = []
+        self._codes: Dict[str, int] = {}
+        self._new_strings: List[Tuple[int, str]] = []
+        for code, value in self._conn.execute("SELECT id, value FROM strings ORDER BY id"):
+            self._register(code, value)
+
+        self.persisted_count = self._conn.execute("SELECT COUNT(*) FROM memories").fetchone()[0]
+        max_id = self._conn.execute("SELECT MAX(id) FROM memories").fetchone()[0]
+        stored_next = self._conn.execute("SELECT value FROM meta WHERE key = 'next_id'").fetchone()
+        self.next_id = max((max_id + 1) if max_id is not None else 0, stored_next[0] if stored_next else 0)
+        self._pending: Dict[int, Tuple] = {}
+        self._deleted: set[int] = set()
+        # Обновлённые (timestamp, hits) уже сохранённых записей до следующего flush
+        self._touched: Dict[int, Tuple[float, int]] = {}
+        self._meta_pending: Dict[str, int] = {}
+        self._sources_pending: List[Tuple[int, int, str, float]] = []
+
+    # --------------------------------------------------------------
+    def _register(self, code: int, value: str):
+        while len(self._labels) <= code:
+            self._labels.append("")
+        self._labels[code] = value
+        self._codes[value] = code
+
+    def intern(self, value: str) -> int:
+        """Возвращает код строки, добавляя её в таблицу при первом появлении"""
+        code = self._codes.get(value)
+        if code is None:
+            code = len(self._labels)
+            self._register(code, value)
+            self._new_strings.append((code, value))
+        return code
+
+    def code(self, value: str) -> int | None:
+        """Код уже известной строки (без интернирования)"""
+        return self._codes.get(value)
+
+    def label(self, code: int) -> str:
+        return self._labels[code]
+
+    @property
+    def labels(self) -> List[str]:
+        return self._labels
+
+    def __len__(self) -> int:
+        return self.persisted_count + len(self._pending) - len(self._deleted)
+
+    def allocate_id(self) -> int:
+        """Выдаёт новый стабильный id"""
+        memory_id = self.next_id
+        self.next_id += 1
+        return memory_id
+
+    def get_meta(self, key: str) -> int | None:
+        """Служебное целое значение (с учётом ещё не сброшенных)"""
+        with self._lock:
+            if key in self._meta_pending:
+                return self._meta_pending[key]
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: int) -> None:
+        """Служебное значение пишется в той же транзакции, что и следующий flush"""
+        with self._lock:
+            self._meta_pending[key] = int(value)
+
+    # --------------------------------------------------------------
+    def add(self, record: Dict[str, Any]) -> Tuple[int, int, int]:
+        """Кладёт запись в буфер до контрольной точки; возвращает коды (type, importance, emotion)"""
+        emotion_context = record.get("emotion_context") or {}
+        type_code = self.intern(record["memory_type"])
+        importance_code = self.intern(record["importance"])
+        emotion_code = self.intern(emotion_label(emotion_context))
+        context = json.dumps(emotion_context, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+        timestamp = datetime.fromisoformat(record["timestamp"]).timestamp()
+        with self._lock:
+            self.next_id = max(self.next_id, record["id"] + 1)
+            self._pending[record["id"]] = (
+                record["id"],
+                record["text"],
+                type_code,
+                importance_code,
+                emotion_code,
+                context,
+                timestamp,
+                record.get("hits", 1),
+            )
+        return type_code, importance_code, emotion_code
+
+    def touch(self, memory_id: int, timestamp: float, hits: int | None = None) -> int | None:
+        """Отмечает повтор записи: новое время и hits+1 (или заданный hits при проигрывании журнала).
+
+        Возвращает новое значение hits или None, если записи нет.
+        """
+        with self._lock:
+            if memory_id in self._deleted:
+                return None
+            row = self._pending.get(memory_id)
+            if row is not None:
+                hits = row[7] + 1 if hits is None else hits
+                self._pending[memory_id] = row[:6] + (timestamp, hits)
+                return hits
+            if hits is None:
+                previous = self._touched.get(memory_id)
+                if previous is None:
+                    found = self._conn.execute("SELECT hits FROM memories WHERE id = ?", (memory_id,)).fetchone()
+                    if found is None:
+                        return None
+                    previous = (timestamp, found[0])
+                hits = previous[1] + 1
+            self._touched[memory_id] = (timestamp, hits)
+            return hits
+
+    def add_sources(self, summary_id: int, sources: List[Dict[str, Any]]) -> None:
+        """Запоминает исходные воспоминания сводки (id, text, timestamp) до следующего flush"""
+        rows = [
+            (summary_id, source["id"], source["text"], datetime.fromisoformat(source["timestamp"]).timestamp())
+            for source in sources
+        ]
+        with self._lock:
+            self._sources_pending.extend(rows)
+
+    def get_sources(self, summary_id: int) -> List[Dict[str, Any]]:
+        """Исходные воспоминания, из которых собрана сводка"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT source_id, text, timestamp FROM memory_sources WHERE summary_id = ? ORDER BY source_id",
+                (summary_id,),
+            ).fetchall()
+            rows += [row[1:] for row in self._sources_pending if row[0] == summary_id]
+        return [
+            {"id": source_id, "text": text, "timestamp": datetime.fromtimestamp(timestamp).isoformat()}
+            for source_id, text, timestamp in rows
+        ]
+
+    def delete(self, ids: Iterable[int]) -> None:
+        """Забывает записи (из буфера сразу, из SQLite — при следующем flush)"""
+        with self._lock:
+            for memory_id in ids:
+                memory_id = int(memory_id)
+                self._touched.pop(memory_id, None)
+                if self._pending.pop(memory_id, None) is None:
+                    self._deleted.add(memory_id)
+
+    def flush(self) -> None:
+        """Сбрасывает буфер новых записей, удаления и строки одной транзакцией"""
+        with self._lock:
+            rows = list(self._pending.values())
+            deleted = [(i,) for i in self._deleted]
+            touched = [(timestamp, hits, i) for i, (timestamp, hits) in self._touched.items()]
+            with self._conn:
+                self._conn.executemany("INSERT OR IGNORE INTO strings (id, value) VALUES (?, ?)", self._new_strings)
+                self._conn.executemany("INSERT OR REPLACE INTO memories VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                self._conn.executemany("UPDATE memories SET timestamp = ?, hits = ? WHERE id = ?", touched)
+                self._conn.executemany("DELETE FROM memories WHERE id = ?", deleted)
+                self._conn.executemany("INSERT OR IGNORE INTO memory_sources VALUES (?, ?, ?, ?)", self._sources_pending)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('next_id', ?)", (self.next_id,)
+                )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", list(self._meta_pending.items())
+                )
+            self._new_strings = []
+            self._meta_pending.clear()
+            self.persisted_count = self._conn.execute("SELECT COUNT(*) FROM memories").fetchone()[0]
+            self._pending.clear()
+            self._deleted.clear()
+            self._touched.clear()
+            self._sources_pending = []
+
+    # --------------------------------------------------------------
+    def _overlay(self, row: Tuple) -> Tuple:
+        touched = self._touched.get(row[0])
+        return row if touched is None else row[:6] + touched
+
+    def _row_to_dict(self, row: Tuple) -> Dict[str, Any]:
+        memory_id, text, type_code, importance_code, _, context, timestamp, hits = row
+        return {
+            "id": memory_id,
+            "text": text,
+            "memory_type": self._labels[type_code],
+            "importance": self._labels[importance_code],
+            "emotion_context": json.loads(context),
+            "timestamp": datetime.fromtimestamp(timestamp).isoformat(),
+            "hits": hits,
+        }
+
+    def get_many(self, ids: Iterable[int]) -> List[Dict[str, Any]]:
+        """Материализует записи по id, сохраняя порядок запроса"""
+        ids = [int(i) for i in ids]
+        found: Dict[int, Tuple] = {}
+        with self._lock:
+            missing = []
+            for memory_id in ids:
+                row = self._pending.get(memory_id)
+                if row is not None:
+                    found[memory_id] = row
+                elif memory_id not in self._deleted:
+                    missing.append(memory_id)
+            if missing:
+                placeholders = ",".join("?" * len(missing))
+                for row in self._conn.execute(f"SELECT * FROM memories WHERE id IN ({placeholders})", missing):
+                    found[row[0]] = self._overlay(row)
+        return [self._row_to_dict(found[i]) for i in ids if i in found]
+
+    def get(self, memory_id: int) -> Dict[str, Any] | None:
+        records = self.get_many([memory_id])
+        return records[0] if records else None
+
+    def iter_records(self, batch_size: int = 1000) -> Iterator[Dict[str, Any]]:
+        """Проходит все записи порциями, не загружая их целиком"""
+        last_id = -1
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT * FROM memories WHERE id > ? ORDER BY id LIMIT ?", (last_id, batch_size)
+                ).fetchall()
+            if not rows:
+                break
+            for row in rows:
+                if row[0] not in self._deleted:
+                    yield self._row_to_dict(self._overlay(row))
+            last_id = rows[-1][0]
+        with self._lock:
+            pending = sorted(self._pending.values())
+        for row in pending:
+            yield self._row_to_dict(row)
+
+    def load_columns(self) -> Dict[str, np.ndarray]:
+        """Колонки для скоринга и фильтров: id, время и коды строк"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, timestamp, memory_type, importance, emotion FROM memories ORDER BY id"
+            ).fetchall()
+            rows = [r for r in rows if r[0] not in self._deleted]
+            if self._touched:
+                rows = [(r[0], self._touched[r[0]][0], *r[2:]) if r[0] in self._touched else r for r in rows]
+            rows += [(r[0], r[6], r[2], r[3], r[4]) for r in sorted(self._pending.values())]
+        table = np.array(rows, dtype="float64").reshape(-1, 5)
+        return {
+            "ids": table[:, 0].astype("int64"),
+            "timestamps": table[:, 1],
+            "type_codes": table[:, 2].astype("int32"),
+            "importance_codes": table[:, 3].astype("int32"),
+            "emotion_codes": table[:, 4].astype("int32"),
+        }
+
+    def import_json(self, metadata_path: str) -> int:
+        """Однократный импорт старого unified_metadata.json"""
+        with open(metadata_path, "r", encoding="utf-8") as f:
+            records = json.load(f)
+        for record in records:
+            self.add(record)
+        self.flush()
+        return len(records)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,152 @@
+"""Потоковое чтение старых файлов MultiLayerMemory для миграции в единую память.
+
+Каждый источник читается генератором: ``full_archive.jsonl`` — построчно,
+JSON-массивы — по одному элементу через ``JSONDecoder.raw_decode`` поверх
+буфера, так что в памяти не лежит весь файл. Записи старых слоёв
+приводятся к виду, который принимает ``FaissUnifiedMemory.bulk_add``.
+"""
+
+import json
+import os
+from datetime import datetime
+from typing import Any, Dict, Iterator
+
+from . import config
+
+_TEXT_KEYS = ("text", "content", "message", "entry", "summary", "user_message", "fact")
+_REPLY_KEYS = ("response", "soul_response", "ai_response", "reply")
+_TIME_KEYS = ("timestamp", "created_at", "date", "time")
+_CONTAINER_KEYS = ("memories", "entries", "records", "items", "messages", "facts", "diary")
+_IMPORTANCE_VALUES = ("высокая", "средняя", "низкая")
+
+# Слой старой памяти → (путь, memory_type, важность по умолчанию)
+LEGACY_SOURCES = {
+    "working_memory": (config.WORKING_MEMORY_PATH, "recent", "средняя"),
+    "longterm_memory": (config.LONGTERM_MEMORY_PATH, "important", "высокая"),
+    "full_archive": (config.FULL_ARCHIVE_PATH, "archive", "низкая"),
+    "soul_diary": (config.SOUL_DIARY_PATH, "diary", "средняя"),
+}
+
+
+def iter_jsonl(path: str) -> Iterator[Any]:
+    """Объекты JSONL-файла по одному; битые строки пропускаются"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                print(f"[MIGRATION] Пропущена битая строка {line_no} в {os.path.basename(path)}")
+
+
+def iter_json_items(path: str, chunk_size: int = 1 << 16) -> Iterator[Any]:
+    """Элементы JSON-массива по одному, не загружая файл целиком.
+
+    Если в корне не массив, а объект, возвращаются элементы его списков
+    (``{"memories": [...]}``) или сами значения словаря.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buffer = f.read(chunk_size).lstrip()
+        if not buffer.startswith("["):
+            # Объект в корне: такие файлы маленькие, читаем целиком
+            data = json.loads(buffer + f.read()) if buffer else None
+            yield from _object_items(data)
+            return
+        buffer = buffer[1:]
+        pos = 0
+        while True:
+            while True:
+                # Пропускаем пробелы и запятые между элементами
+                while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                    pos += 1
+                if pos < len(buffer):
+                    break
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                buffer, pos = buffer[pos:] + chunk, 0
+            if buffer[pos] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    raise
+                buffer, pos = buffer[pos:] + chunk, 0
+                continue
+            yield item
+            pos = end
+            if pos > chunk_size:
+                buffer, pos = buffer[pos:], 0
+
+
+def _object_items(data: Any) -> Iterator[Any]:
+    if isinstance(data, list):
+        yield from data
+    elif isinstance(data, dict):
+        for key in _CONTAINER_KEYS:
+            if isinstance(data.get(key), list):
+                yield from data[key]
+                return
+        for key, value in data.items():
+            # Дневник вида {"2025-07-05": "запись"} — дата становится временем записи
+            if isinstance(value, str):
+                yield {"text": value, "timestamp": key}
+            elif isinstance(value, dict):
+                yield {"timestamp": key, **value}
+            elif isinstance(value, list):
+                yield from value
+
+
+def _parse_timestamp(value: Any) -> str:
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value).isoformat()
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value).isoformat()
+        except ValueError:
+            pass
+    return datetime.now().isoformat()
+
+
+def normalize_legacy_record(raw: Any, memory_type: str, default_importance: str) -> Dict[str, Any] | None:
+    """Приводит запись старого слоя к полям единой памяти; None — если текста нет"""
+    if isinstance(raw, str):
+        raw = {"text": raw}
+    if not isinstance(raw, dict):
+        return None
+    text = next((raw[k] for k in _TEXT_KEYS if isinstance(raw.get(k), str) and raw[k].strip()), None)
+    if text is None:
+        return None
+    reply = next((raw[k] for k in _REPLY_KEYS if isinstance(raw.get(k), str) and raw[k].strip()), None)
+    if reply:
+        text = f"{text}\nДуша ответила: {reply}"
+
+    importance = raw.get("importance")
+    if importance not in _IMPORTANCE_VALUES:
+        importance = default_importance
+    emotion_context = raw.get("emotion_context") or raw.get("analysis")
+    if not isinstance(emotion_context, dict):
+        emotion = raw.get("emotion") or raw.get("emotion_detected")
+        emotion_context = {"emotion_detected": emotion} if isinstance(emotion, str) else {}
+    timestamp = next((raw[k] for k in _TIME_KEYS if raw.get(k) is not None), None)
+    return {
+        "text": text.strip(),
+        "memory_type": memory_type,
+        "importance": importance,
+        "emotion_context": emotion_context,
+        "timestamp": _parse_timestamp(timestamp),
+    }
+
+
+def iter_legacy_source(path: str, memory_type: str, default_importance: str) -> Iterator[Dict[str, Any]]:
+    """Нормализованные записи одного файла старой памяти"""
+    items = iter_jsonl(path) if path.endswith(".jsonl") else iter_json_items(path)
+    for raw in items:
+        record = normalize_legacy_record(raw, memory_type, default_importance)
+        if record is not None:
+            yield record
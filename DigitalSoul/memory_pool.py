@@ -0,0 +1,249 @@
+"""Пул шардов единой памяти для нескольких пользователей.
+
+У каждого тенанта свой каталог ``TENANTS_ROOT/<tenant_id>`` с индексом,
+метаданными и журналом. Пул держит в памяти не больше ``capacity`` самых
+горячих шардов, выгружает на диск давно неиспользуемые и считает время
+загрузки и выгрузки. Шарды, с которыми сейчас работает сообщение,
+закреплены арендой (``lease``) и не выгружаются.
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterable, Iterator
+
+from . import config
+from .faiss_unified_memory import FaissUnifiedMemory
+
+_SAFE_TENANT = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def tenant_dir(tenant_id: str, root: str = config.TENANTS_ROOT) -> str:
+    """Каталог шарда; небезопасные для пути id заменяются хэшем"""
+    name = tenant_id if _SAFE_TENANT.match(tenant_id) else hashlib.sha1(tenant_id.encode("utf-8")).hexdigest()
+    return os.path.join(root, name)
+
+
+def _latency_summary(samples: Iterable[float]) -> Dict[str, float]:
+    samples = list(samples)
+    if not samples:
+        return {"count": 0, "avg_ms": 0.0, "max_ms": 0.0}
+    return {
+        "count": len(samples),
+        "avg_ms": sum(samples) / len(samples) * 1000,
+        "max_ms": max(samples) * 1000,
+    }
+
+
+class MemoryShardPool:
+    """LRU-пул загруженных шардов FaissUnifiedMemory.
+
+    Шард, взятый через ``lease``, закреплён: пока аренда не закончилась,
+    пул не выгрузит и не закроет его, даже если превышен ``capacity``.
+    Простаивающие шарды выгружает фоновый поток раз в ``idle_seconds / 4``.
+    """
+
+    def __init__(
+        self,
+        root: str = config.TENANTS_ROOT,
+        capacity: int = config.MEMORY_POOL_CAPACITY,
+        idle_seconds: float = config.MEMORY_POOL_IDLE_SECONDS,
+    ):
+        self.root = root
+        self.capacity = capacity
+        self.idle_seconds = idle_seconds
+        self._shards: "OrderedDict[str, FaissUnifiedMemory]" = OrderedDict()
+        self._last_used: Dict[str, float] = {}
+        self._pins: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._loading: Dict[str, threading.Lock] = {}
+        # Шарды, которые сейчас закрываются: загрузка того же тенанта ждёт
+        # конца закрытия, чтобы два экземпляра не писали в один журнал
+        self._closing: Dict[str, threading.Event] = {}
+        self._load_times: Deque[float] = deque(maxlen=1000)
+        self._evict_times: Deque[float] = deque(maxlen=1000)
+        self.hits = 0
+        self.misses = 0
+        self.idle_evictions = 0
+        self._stop = threading.Event()
+        self._sweeper: threading.Thread | None = None
+
+    def get(self, tenant_id: str) -> FaissUnifiedMemory:
+        """Возвращает шард тенанта, загружая его при необходимости.
+
+        Шард не закрепляется: пул может выгрузить его в любой момент.
+        Для работы с шардом дольше одного вызова — ``lease``.
+        """
+        return self._acquire(tenant_id, pin=False)
+
+    @contextmanager
+    def lease(self, tenant_id: str) -> Iterator[FaissUnifiedMemory]:
+        """Шард тенанта, закреплённый в пуле до выхода из блока"""
+        shard = self._acquire(tenant_id, pin=True)
+        try:
+            yield shard
+        finally:
+            with self._lock:
+                pins = self._pins.pop(tenant_id, 0) - 1
+                if pins > 0:
+                    self._pins[tenant_id] = pins
+                if tenant_id in self._shards:
+                    self._last_used[tenant_id] = time.monotonic()
+                victims = self._pop_over_capacity()
+            self._close_victims(victims)
+
+    def _acquire(self, tenant_id: str, pin: bool) -> FaissUnifiedMemory:
+        self._start_sweeper()
+        with self._lock:
+            shard = self._hit(tenant_id, pin)
+            if shard is not None:
+                return shard
+            load_lock = self._loading.setdefault(tenant_id, threading.Lock())
+
+        # Загрузка идёт вне общего замка, чтобы не блокировать другие тенанты
+        with load_lock:
+            with self._lock:
+                shard = self._hit(tenant_id, pin)
+                closing = self._closing.get(tenant_id)
+            if shard is not None:
+                return shard
+            if closing is not None:
+                closing.wait()
+            started = time.perf_counter()
+            shard = FaissUnifiedMemory(data_dir=tenant_dir(tenant_id, self.root))
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.misses += 1
+                self._load_times.append(elapsed)
+                self._shards[tenant_id] = shard
+                self._touch(tenant_id)
+                if pin:
+                    self._pins[tenant_id] = self._pins.get(tenant_id, 0) + 1
+                self._loading.pop(tenant_id, None)
+                victims = self._pop_over_capacity(keep=tenant_id)
+        print(f"[POOL] Загружен шард {tenant_id} за {elapsed * 1000:.0f}мс")
+        self._close_victims(victims)
+        return shard
+
+    def _hit(self, tenant_id: str, pin: bool) -> FaissUnifiedMemory | None:
+        """Загруженный шард (под замком) или None"""
+        shard = self._shards.get(tenant_id)
+        if shard is not None:
+            self._touch(tenant_id)
+            self.hits += 1
+            if pin:
+                self._pins[tenant_id] = self._pins.get(tenant_id, 0) + 1
+        return shard
+
+    def _touch(self, tenant_id: str):
+        self._shards.move_to_end(tenant_id)
+        self._last_used[tenant_id] = time.monotonic()
+
+    def _take(self, tenant_id: str) -> FaissUnifiedMemory:
+        """Убирает шард из пула под замком и помечает его закрывающимся"""
+        shard = self._shards.pop(tenant_id)
+        self._last_used.pop(tenant_id, None)
+        self._closing[tenant_id] = threading.Event()
+        return shard
+
+    def _pop_over_capacity(self, keep: str | None = None) -> list:
+        """Самые давние незакреплённые шарды сверх capacity (под замком); ``keep`` — только что выданный"""
+        excess = len(self._shards) - self.capacity
+        victims = []
+        for tenant_id in list(self._shards):
+            if len(victims) >= excess:
+                break
+            if tenant_id not in self._pins and tenant_id != keep:
+                victims.append((tenant_id, self._take(tenant_id)))
+        return victims
+
+    def _close_victims(self, victims: list):
+        for tenant_id, shard in victims:
+            self._close_shard(tenant_id, shard)
+
+    def _close_shard(self, tenant_id: str, shard: FaissUnifiedMemory):
+        started = time.perf_counter()
+        try:
+            # Контрольная точка при выгрузке: следующая загрузка не проигрывает журнал
+            shard.close(checkpoint=True)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._evict_times.append(elapsed)
+                self._closing.pop(tenant_id).set()
+        print(f"[POOL] Шард {tenant_id} выгружен на диск за {elapsed * 1000:.0f}мс")
+
+    def evict(self, tenant_id: str) -> bool:
+        """Выгружает шард; закреплённый арендой не трогается"""
+        with self._lock:
+            if tenant_id not in self._shards or tenant_id in self._pins:
+                return False
+            shard = self._take(tenant_id)
+        self._close_shard(tenant_id, shard)
+        return True
+
+    def evict_idle(self) -> int:
+        """Выгружает незакреплённые шарды, к которым не обращались дольше idle_seconds"""
+        now = time.monotonic()
+        with self._lock:
+            idle = [t for t, used in self._last_used.items() if now - used >= self.idle_seconds]
+        evicted = sum(self.evict(tenant_id) for tenant_id in idle)
+        with self._lock:
+            self.idle_evictions += evicted
+        return evicted
+
+    def _start_sweeper(self):
+        if self._sweeper is not None or self.idle_seconds <= 0:
+            return
+        with self._lock:
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(target=self._sweep, name="memory-pool-sweeper", daemon=True)
+                self._sweeper.start()
+
+    def _sweep(self):
+        while not self._stop.wait(self.idle_seconds / 4):
+            try:
+                self.evict_idle()
+            except Exception as e:
+                print(f"[WARN] Ошибка выгрузки простаивающих шардов: {e}")
+
+    def close_all(self) -> None:
+        """Выгружает все шарды; вызывать, когда сообщений в работе нет"""
+        self._stop.set()
+        with self._lock:
+            if self._pins:
+                print(f"[WARN] Закрываю закреплённые шарды: {sorted(self._pins)}")
+            self._pins.clear()
+            tenants = list(self._shards)
+        for tenant_id in tenants:
+            self.evict(tenant_id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "resident": list(self._shards),
+                "pinned": dict(self._pins),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "idle_evictions": self.idle_evictions,
+                "load": _latency_summary(self._load_times),
+                "evict": _latency_summary(self._evict_times),
+            }
+
+
+_default_pool: MemoryShardPool | None = None
+_default_pool_lock = threading.Lock()
+
+
+def get_default_pool() -> MemoryShardPool:
+    """Общий на процесс пул шардов"""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = MemoryShardPool()
+        return _default_pool
@@ -0,0 +1,34 @@
+"""Скользящая скорость событий для статистики памяти."""
+
+import time
+from collections import deque
+
+
+class RollingRate:
+    """Число событий за последние ``window_seconds`` по посекундным корзинам.
+
+    Корзин не больше длины окна, поэтому и учёт, и чтение не зависят от
+    того, сколько событий было всего.
+    """
+
+    def __init__(self, window_seconds: int = 300):
+        self.window_seconds = window_seconds
+        self._buckets: deque = deque()
+        self._total = 0
+
+    def _expire(self, now: int):
+        while self._buckets and self._buckets[0][0] <= now - self.window_seconds:
+            self._total -= self._buckets.popleft()[1]
+
+    def add(self, count: int = 1, now: float | None = None) -> None:
+        second = int(time.time() if now is None else now)
+        if self._buckets and self._buckets[-1][0] == second:
+            self._buckets[-1][1] += count
+        else:
+            self._buckets.append([second, count])
+        self._total += count
+        self._expire(second)
+
+    def per_second(self, now: float | None = None) -> float:
+        self._expire(int(time.time() if now is None else now))
+        return self._total / self.window_seconds
@@ -0,0 +1,131 @@
+"""Векторы воспоминаний вне FAISS-индекса.
+
+``RescoreVectors`` — исходные векторы для точного пересчёта сходства.
+Когда индекс хранит векторы сжатыми (SQ8/PQ), его оценки приблизительны.
+Поэтому рядом лежит memory-mapped матрица float16, адресуемая id
+воспоминания: поиск берёт из индекса расширенный список кандидатов и
+пересчитывает скалярное произведение только для них. Матрица читается
+страницами ОС, в память процесса она не загружается.
+
+``RecentVectors`` — кольцевое окно последних векторов для дешёвой проверки
+на почти-повтор при вставке.
+"""
+
+import os
+import threading
+from typing import Any, Callable, Dict
+
+import numpy as np
+
+
+class RescoreVectors:
+    """Матрица float16 на диске: строка = id воспоминания"""
+
+    def __init__(self, path: str, dim: int):
+        self.path = path
+        self.dim = dim
+        self._matrix: np.memmap | None = None
+        self._capacity = 0
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            rows = os.path.getsize(path) // (dim * 2)
+            if rows:
+                self._open(rows)
+
+    def _open(self, rows: int):
+        self._matrix = np.memmap(self.path, dtype="float16", mode="r+", shape=(rows, self.dim))
+        self._capacity = rows
+
+    def _ensure_capacity(self, rows: int):
+        if rows <= self._capacity:
+            return
+        new_capacity = max(rows, self._capacity * 2, 1024)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        if self._matrix is not None:
+            self._matrix.flush()
+            self._matrix = None
+        with open(self.path, "ab") as f:
+            f.truncate(new_capacity * self.dim * 2)
+        self._open(new_capacity)
+
+    def put(self, ids: np.ndarray, vectors: np.ndarray) -> None:
+        """Записывает векторы по их id (повторная запись того же id безвредна)"""
+        ids = np.asarray(ids, dtype="int64").reshape(-1)
+        if not len(ids):
+            return
+        with self._lock:
+            self._ensure_capacity(int(ids.max()) + 1)
+            self._matrix[ids] = np.asarray(vectors, dtype="float32").reshape(len(ids), self.dim)
+
+    def get(self, ids: np.ndarray) -> np.ndarray:
+        """Векторы по id в float32 (для id вне матрицы — нули)"""
+        ids = np.asarray(ids, dtype="int64").reshape(-1)
+        with self._lock:
+            if self._matrix is None:
+                return np.zeros((len(ids), self.dim), dtype="float32")
+            known = ids < self._capacity
+            vectors = np.zeros((len(ids), self.dim), dtype="float32")
+            vectors[known] = self._matrix[ids[known]]
+        return vectors
+
+    def has(self, ids: np.ndarray) -> bool:
+        """Есть ли в матрице строки для всех id (для перехода со старого индекса)"""
+        ids = np.asarray(ids, dtype="int64").reshape(-1)
+        return not len(ids) or int(ids.max()) < self._capacity
+
+    def rescore(self, query: np.ndarray, ids: np.ndarray) -> np.ndarray:
+        """Точное скалярное произведение запроса с векторами кандидатов"""
+        return self.get(ids) @ np.asarray(query, dtype="float32").reshape(-1)
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._matrix is not None:
+                self._matrix.flush()
+
+    def close(self) -> None:
+        self.flush()
+        with self._lock:
+            self._matrix = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"rows": self._capacity, "disk_bytes": self._capacity * self.dim * 2}
+
+
+class RecentVectors:
+    """Кольцевой буфер последних нормированных векторов с их id"""
+
+    def __init__(self, size: int, dim: int):
+        self.size = size
+        self._matrix = np.zeros((size, dim), dtype="float32")
+        self._ids = np.full(size, -1, dtype="int64")
+        self._next = 0
+
+    def add(self, memory_id: int, vector: np.ndarray) -> None:
+        if not self.size:
+            return
+        vector = np.asarray(vector, dtype="float32").reshape(-1)
+        norm = float(np.linalg.norm(vector))
+        self._matrix[self._next] = vector / norm if norm > 0 else vector
+        self._ids[self._next] = memory_id
+        self._next = (self._next + 1) % self.size
+
+    def nearest(
+        self, vector: np.ndarray, accept: Callable[[np.ndarray], np.ndarray] | None = None
+    ) -> tuple[int, float]:
+        """(id, косинус) ближайшего вектора окна; ``accept`` отбирает допустимые id.
+
+        Если подходящих векторов нет, возвращает (-1, 0.0).
+        """
+        valid = self._ids >= 0
+        if accept is not None and valid.any():
+            valid[valid] = accept(self._ids[valid])
+        if not valid.any():
+            return -1, 0.0
+        vector = np.asarray(vector, dtype="float32").reshape(-1)
+        norm = float(np.linalg.norm(vector))
+        if norm == 0:
+            return -1, 0.0
+        scores = self._matrix @ (vector / norm)
+        scores[~valid] = -np.inf
+        best = int(np.argmax(scores))
+        return int(self._ids[best]), float(scores[best])
@@ -0,0 +1,139 @@
+"""Журнал предзаписи (WAL) для единой памяти.
+
+Каждое воспоминание дописывается в конец журнала одной записью
+(метаданные + вектор) вместо перезаписи всего индекса. Несколько вставок,
+попавших в окно group commit, делят один fsync. При старте журнал
+проигрывается поверх базового индекса, а контрольная точка сворачивает его
+обратно в базу.
+
+Кроме вставок журнал хранит служебные операции (например, ``forget``) —
+это записи с ключом ``op`` и пустым вектором.
+"""
+
+import json
+import os
+import struct
+import threading
+import zlib
+from typing import Any, Dict, Iterator, Tuple
+
+import numpy as np
+
+# длина JSON, длина вектора в байтах, crc32 от JSON + вектора
+_HEADER = struct.Struct("<III")
+
+
+class MemoryWAL:
+    """Append-only журнал вставок с групповым fsync"""
+
+    def __init__(self, path: str, commit_window_ms: float = 50, max_batch: int = 32):
+        self.path = path
+        self.commit_window = commit_window_ms / 1000.0
+        self.max_batch = max_batch
+
+        self._lock = threading.Lock()
+        self._file = None
+        self._timer: threading.Timer | None = None
+        self._pending = 0
+
+        self.records_since_checkpoint = 0
+        self.fsync_count = 0
+        self.appended = 0
+
+    def _open(self):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._file = open(self.path, "ab")
+
+    def append(self, record: Dict[str, Any], vector: np.ndarray | None = None) -> None:
+        """Дописывает запись; fsync выполняется группой"""
+        payload = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        vector_bytes = b"" if vector is None else np.ascontiguousarray(vector, dtype="float32").tobytes()
+        crc = zlib.crc32(vector_bytes, zlib.crc32(payload))
+        with self._lock:
+            self._open()
+            self._file.write(_HEADER.pack(len(payload), len(vector_bytes), crc))
+            self._file.write(payload)
+            self._file.write(vector_bytes)
+            self._pending += 1
+            self.appended += 1
+            self.records_since_checkpoint += 1
+
+            if self._pending >= self.max_batch or self.commit_window <= 0:
+                self._sync_locked()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.commit_window, self.sync)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _sync_locked(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._file is None or not self._pending:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+        self.fsync_count += 1
+
+    def sync(self) -> None:
+        """Принудительно сбрасывает накопленную группу на диск"""
+        with self._lock:
+            self._sync_locked()
+
+    def replay(self) -> Iterator[Tuple[Dict[str, Any], np.ndarray | None]]:
+        """Проигрывает журнал; оборванный хвост отрезается"""
+        if not os.path.exists(self.path):
+            return
+        valid_end = 0
+        with open(self.path, "rb") as f:
+            while True:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    break
+                payload_len, vector_len, crc = _HEADER.unpack(header)
+                payload = f.read(payload_len)
+                vector_bytes = f.read(vector_len)
+                if len(payload) < payload_len or len(vector_bytes) < vector_len:
+                    break
+                if zlib.crc32(vector_bytes, zlib.crc32(payload)) != crc:
+                    break
+                valid_end = f.tell()
+                self.records_since_checkpoint += 1
+                vector = np.frombuffer(vector_bytes, dtype="float32").copy() if vector_len else None
+                yield json.loads(payload.decode("utf-8")), vector
+        if valid_end < os.path.getsize(self.path):
+            print("[WARN] WAL памяти оборван, хвост отброшен")
+            with open(self.path, "r+b") as f:
+                f.truncate(valid_end)
+
+    def reset(self) -> None:
+        """Очищает журнал после контрольной точки"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if os.path.exists(self.path):
+                with open(self.path, "wb") as f:
+                    f.flush()
+                    os.fsync(f.fileno())
+            self._pending = 0
+            self.records_since_checkpoint = 0
+
+    def close(self) -> None:
+        with self._lock:
+            self._sync_locked()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "appended": self.appended,
+            "fsyncs": self.fsync_count,
+            "records_since_checkpoint": self.records_since_checkpoint,
+        }
@@ -0,0 +1,35 @@
+"""Раскладка промпта, при которой Ollama переиспользует разобранный префикс.
+
+Анализирующие промпты — десятки строк неизменных правил и короткая
+переменная часть с сообщением. Если правила стоят в начале, а сообщение
+в конце, префикс у всех вызовов совпадает, и Ollama берёт уже посчитанный
+KV-кэш вместо того, чтобы разбирать правила заново.
+
+``PromptPrefix`` собирает такие запросы: статичная часть всегда уходит
+как ``system``, переменная — как ``prompt``, а ``keep_alive`` держит
+модель (и её кэш) в памяти между сообщениями. Подготовительных вызовов
+и подмены ``context`` нет — в разговор не попадает ничего, кроме правил
+и самого сообщения.
+"""
+
+from typing import Any, Dict
+
+from . import config
+
+
+class PromptPrefix:
+    """Статичный системный префикс модели, одинаковый у всех вызовов"""
+
+    def __init__(self, model: str, system: str):
+        self.model = model
+        self.system = system
+
+    def payload(self, prompt: str, **extra: Any) -> Dict[str, Any]:
+        """Запрос с неизменным ``system`` и переменным суффиксом ``prompt``"""
+        return {
+            "model": self.model,
+            "system": self.system,
+            "prompt": prompt,
+            "keep_alive": config.OLLAMA_KEEP_ALIVE,
+            **extra,
+        }
@@ -0,0 +1,253 @@
+"""Потоковые ответы Ollama с ранней остановкой.
+
+Анализирующие промпты просят у Llama JSON-объект по схеме, а модель
+часто продолжает писать после него (в режиме JSON — пробелами до лимита
+токенов). Здесь ответ читается потоком, и как только ``JsonTracker``
+видит закрытый объект верхнего уровня, соединение закрывается — Ollama
+прекращает генерацию. Этим путём идут все вызовы
+``structured_output.generate_json``.
+
+Сколько сэкономлено, считается по каждому месту вызова (``label``).
+Ответ пользователю всегда обрывается, а среднюю длину полного ответа
+меряет теневой запрос: на первом и каждом ``OLLAMA_STREAM_CALIBRATE_EVERY``-м
+вызове тот же промпт уходит в фоновом потоке без стрима, и Ollama
+сообщает ``eval_count`` и ``eval_duration`` полной генерации. При
+остановке экономия — разница между этой длиной и прочитанным, а время —
+эта разница на среднее время токена.
+"""
+
+import contextlib
+import json
+import threading
+import time
+from typing import Any, Dict
+
+from . import config
+from .llm_gateway import check_deadline, get_gateway, ollama_generate
+
+
+class JsonTracker:
+    """Отслеживает, закрылся ли JSON-объект верхнего уровня"""
+
+    def __init__(self):
+        self.text = ""
+        self._depth = 0
+        self._started = False
+        self._in_string = False
+        self._escaped = False
+        self._complete = False
+
+    def feed(self, chunk: str) -> bool:
+        """Добавляет кусок ответа; True — объект закрыт"""
+        self.text += chunk
+        for ch in chunk:
+            if self._complete:
+                break
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = self._started
+            elif ch in "{[":
+                self._depth += 1
+                self._started = True
+            elif ch in "}]" and self._started:
+                self._depth -= 1
+                self._complete = self._depth == 0
+        return self._complete
+
+
+class _LabelStats:
+    def __init__(self):
+        self.calls = 0
+        self.cut_off = 0
+        self.tokens_read = 0
+        self.tokens_saved = 0.0
+        self.ms_saved = 0.0
+        # Калибровка по ответам, дочитанным до конца
+        self.full_runs = 0
+        self.full_tokens = 0
+        self.full_ms = 0.0
+        self.shadow_running = False
+        self.shadow_failures = 0
+        # Разбор промпта: время до первого токена и отчёт Ollama (только у полных ответов)
+        self.first_token_runs = 0
+        self.first_token_ms = 0.0
+        self.prompt_runs = 0
+        self.prompt_tokens = 0
+        self.prompt_ms = 0.0
+
+    def avg_full_tokens(self) -> float:
+        return self.full_tokens / self.full_runs if self.full_runs else 0.0
+
+    def ms_per_token(self) -> float:
+        return self.full_ms / self.full_tokens if self.full_tokens else 0.0
+
+
+_stats: Dict[str, _LabelStats] = {}
+_stats_lock = threading.Lock()
+
+
+def _begin(label: str) -> bool:
+    """Регистрирует вызов; True — пора запустить теневой калибровочный запрос"""
+    with _stats_lock:
+        stats = _stats.setdefault(label, _LabelStats())
+        stats.calls += 1
+        every = config.OLLAMA_STREAM_CALIBRATE_EVERY
+        if stats.shadow_running or every <= 0:
+            return False
+        stats.shadow_running = stats.full_runs == 0 or stats.calls % every == 0
+        return stats.shadow_running
+
+
+def _calibrate(payload: Dict[str, Any], label: str, timeout: float | None):
+    """Теневой запрос: полная генерация того же промпта вне пути ответа"""
+    tokens, elapsed_ms = 0, None
+    try:
+        response = ollama_generate({**payload, "stream": False}, timeout=timeout)
+        response.raise_for_status()
+        done = response.json()
+        tokens, elapsed_ms = done.get("eval_count", 0), _decode_ms(done)
+    except Exception as e:
+        print(f"[WARN] Калибровочный запрос {label} не удался: {e}")
+    with _stats_lock:
+        stats = _stats[label]
+        stats.shadow_running = False
+        if tokens and elapsed_ms:
+            stats.full_runs += 1
+            stats.full_tokens += tokens
+            stats.full_ms += elapsed_ms
+        else:
+            stats.shadow_failures += 1
+
+
+def _start_calibration(payload: Dict[str, Any], label: str, timeout: float | None):
+    threading.Thread(
+        target=_calibrate, args=(payload, label, timeout), name=f"ollama-calibrate-{label}", daemon=True
+    ).start()
+
+
+def _finish(
+    label: str, tokens: int, elapsed_ms: float, cut: bool, first_token_ms: float | None, done: Dict[str, Any]
+):
+    with _stats_lock:
+        stats = _stats[label]
+        stats.tokens_read += tokens
+        if first_token_ms is not None:
+            stats.first_token_runs += 1
+            stats.first_token_ms += first_token_ms
+        if done.get("prompt_eval_duration"):
+            stats.prompt_runs += 1
+            stats.prompt_tokens += done.get("prompt_eval_count", 0)
+            stats.prompt_ms += done["prompt_eval_duration"] / 1e6
+        if cut:
+            stats.cut_off += 1
+            saved = max(stats.avg_full_tokens() - tokens, 0.0)
+            stats.tokens_saved += saved
+            stats.ms_saved += saved * stats.ms_per_token()
+        else:
+            stats.full_runs += 1
+            stats.full_tokens += tokens
+            stats.full_ms += elapsed_ms
+
+
+def _payload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    return {**payload, "stream": True}
+
+
+def _decode_ms(event: Dict[str, Any]) -> float | None:
+    """Время генерации токенов по отчёту Ollama (без разбора промпта)"""
+    duration = event.get("eval_duration")
+    return duration / 1e6 if duration else None
+
+
+def generate_until_complete(
+    payload: Dict[str, Any], tracker: Any, label: str, timeout: float | None = None
+) -> str:
+    """Текст ответа Ollama, оборванный, как только ``tracker`` счёл его законченным"""
+    calibrating = _begin(label)
+    started = time.perf_counter()
+    tokens, elapsed_ms, cut = 0, None, False
+    first_token_ms, done = None, {}
+    lines = get_gateway().stream_lines("ollama", "api/generate", json=_payload(payload), timeout=timeout)
+    with contextlib.closing(lines):
+        for line in lines:
+            event = json.loads(line)
+            text = event.get("response", "")
+            if text and first_token_ms is None:
+                first_token_ms = (time.perf_counter() - started) * 1000
+            tokens += bool(text)
+            complete = tracker.feed(text)
+            if event.get("done"):
+                done = event
+                tokens = event.get("eval_count", tokens)
+                elapsed_ms = _decode_ms(event)
+                break
+            if complete:
+                cut = True
+                break
+            # Таймаут запроса — на каждое чтение, поэтому дедлайн сообщения проверяем сами
+            check_deadline()
+    _finish(label, tokens, elapsed_ms or (time.perf_counter() - started) * 1000, cut, first_token_ms, done)
+    if calibrating:
+        _start_calibration(payload, label, timeout)
+    return tracker.text
+
+
+async def agenerate_until_complete(
+    payload: Dict[str, Any], tracker: Any, label: str, timeout: float | None = None
+) -> str:
+    """Асинхронный вариант ``generate_until_complete``"""
+    calibrating = _begin(label)
+    started = time.perf_counter()
+    tokens, elapsed_ms, cut = 0, None, False
+    first_token_ms, done = None, {}
+    lines = get_gateway().astream_lines("ollama", "api/generate", json=_payload(payload), timeout=timeout)
+    try:
+        async for line in lines:
+            event = json.loads(line)
+            text = event.get("response", "")
+            if text and first_token_ms is None:
+                first_token_ms = (time.perf_counter() - started) * 1000
+            tokens += bool(text)
+            complete = tracker.feed(text)
+            if event.get("done"):
+                done = event
+                tokens = event.get("eval_count", tokens)
+                elapsed_ms = _decode_ms(event)
+                break
+            if complete:
+                cut = True
+                break
+            # Таймаут запроса — на каждое чтение, поэтому дедлайн сообщения проверяем сами
+            check_deadline()
+    finally:
+        await lines.aclose()
+    _finish(label, tokens, elapsed_ms or (time.perf_counter() - started) * 1000, cut, first_token_ms, done)
+    if calibrating:
+        _start_calibration(payload, label, timeout)
+    return tracker.text
+
+
+def get_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        return {
+            label: {
+                "calls": s.calls,
+                "cut_off": s.cut_off,
+                "tokens_read": s.tokens_read,
+                "avg_full_tokens": s.avg_full_tokens(),
+                "calibration_runs": s.full_runs,
+                "calibration_failures": s.shadow_failures,
+                "tokens_saved_estimate": s.tokens_saved,
+                "ms_saved_estimate": s.ms_saved,
+                "avg_first_token_ms": s.first_token_ms / s.first_token_runs if s.first_token_runs else 0.0,
+                "avg_prompt_tokens": s.prompt_tokens / s.prompt_runs if s.prompt_runs else 0.0,
+                "avg_prompt_eval_ms": s.prompt_ms / s.prompt_runs if s.prompt_runs else 0.0,
+            }
+            for label, s in _stats.items()
+        }
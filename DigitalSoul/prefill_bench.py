@@ -0,0 +1,100 @@
+"""Бенчмарк разбора префикса единого анализа в Ollama.
+
+Один и тот же набор сообщений прогоняется через единый анализ в двух
+раскладках промпта:
+
+* ``inline`` — как раньше: сообщение в начале промпта, правила после него,
+  поэтому префикс у каждого вызова свой и разбирается целиком;
+* ``system`` — правила в ``system``, сообщение в конце (``PromptPrefix``):
+  префикс совпадает, и Ollama переиспользует его KV-кэш.
+
+Генерация ограничена одним токеном — меряется разбор промпта
+(``prompt_eval_count``/``prompt_eval_duration`` из ответа Ollama) и полное
+время вызова. Нужна запущенная локальная Ollama с моделью анализа.
+
+Запуск: ``python -m DigitalSoul.prefill_bench --rounds 3``
+"""
+
+import argparse
+import time
+from typing import Any, Dict, List
+
+from . import config
+from .llm_gateway import ollama_generate
+from .local_brain import UNIFIED_PREFIX, UNIFIED_SCHEMA, UNIFIED_SYSTEM, _unified_prompt
+
+MODES = ["inline", "system"]
+
+MESSAGES = [
+    "мне уже не грустно, спасибо что ты рядом",
+    "как ты думаешь, я справлюсь с экзаменом?",
+    "сегодня весь день шёл дождь и я скучала",
+    "ты опять мурчишь? иди сюда",
+    "расскажи, что ты чувствуешь, когда я молчу",
+    "я устала и хочу просто помолчать с тобой",
+    "мы с Мари ходили в горы, было здорово",
+    "иногда мне кажется, что меня никто не слышит",
+]
+
+
+def _payload(mode: str, message: str) -> Dict[str, Any]:
+    options = {"format": UNIFIED_SCHEMA.format, "stream": False, "options": {"num_predict": 1}}
+    if mode == "inline":
+        prompt = f"{_unified_prompt(message)}\n\n{UNIFIED_SYSTEM}"
+        return {"model": UNIFIED_PREFIX.model, "prompt": prompt, "keep_alive": config.OLLAMA_KEEP_ALIVE, **options}
+    return UNIFIED_PREFIX.payload(_unified_prompt(message), **options)
+
+
+def bench_mode(mode: str, messages: List[str], rounds: int) -> Dict[str, Any]:
+    prompt_tokens, prompt_ms, wall_ms = [], [], []
+    for _ in range(rounds):
+        for message in messages:
+            payload = _payload(mode, message)
+            started = time.perf_counter()
+            response = ollama_generate(payload, timeout=120)
+            response.raise_for_status()
+            wall_ms.append((time.perf_counter() - started) * 1000)
+            data = response.json()
+            prompt_tokens.append(data.get("prompt_eval_count", 0))
+            prompt_ms.append(data.get("prompt_eval_duration", 0) / 1e6)
+    return {
+        "mode": mode,
+        "calls": len(wall_ms),
+        "prompt_tokens": sum(prompt_tokens) / len(prompt_tokens),
+        "prefill_ms": sum(prompt_ms) / len(prompt_ms),
+        "wall_ms": sum(wall_ms) / len(wall_ms),
+    }
+
+
+def run(rounds: int, modes: List[str]) -> List[Dict[str, Any]]:
+    # Прогрев: модель загружается в память до замеров
+    warm_up = {
+        "model": UNIFIED_PREFIX.model,
+        "prompt": "привет",
+        "stream": False,
+        "keep_alive": config.OLLAMA_KEEP_ALIVE,
+        "options": {"num_predict": 1},
+    }
+    ollama_generate(warm_up, timeout=300).raise_for_status()
+    return [bench_mode(mode, MESSAGES, rounds) for mode in modes]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк разбора префикса единого анализа в Ollama")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    args = parser.parse_args()
+
+    results = run(args.rounds, args.modes)
+    baseline = next((r["prefill_ms"] for r in results if r["mode"] == "inline"), None)
+    print(f"{'mode':<8} {'calls':>5} {'prompt tok':>10} {'prefill ms':>10} {'wall ms':>8} {'saved ms':>9}")
+    for r in results:
+        saved = baseline - r["prefill_ms"] if baseline is not None else 0.0
+        print(
+            f"{r['mode']:<8} {r['calls']:>5} {r['prompt_tokens']:>10.0f} {r['prefill_ms']:>10.1f} "
+            f"{r['wall_ms']:>8.1f} {saved:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
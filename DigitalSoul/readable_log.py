@@ -0,0 +1,155 @@
+"""Фоновая запись читаемого лога памяти.
+
+Строки кладутся в ограниченную очередь и пишутся отдельным потоком
+пачками, поэтому вставка воспоминания не ждёт диска. Пачка копится, пока
+с её первой строки не прошло ``flush_interval`` секунд или в ней не набралось
+``batch_lines`` строк, и сбрасывается в файл одним ``flush``. Если очередь
+переполнена, строка отбрасывается и учитывается в статистике — лог
+вспомогательный и не должен тормозить ответ. Файл ротируется по размеру
+и возрасту сегмента, старые сегменты при желании сжимаются gzip.
+"""
+
+import glob
+import gzip
+import os
+import queue
+import shutil
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable
+
+_STOP = object()
+
+
+class ReadableLogWriter:
+    """Буферизованный лог с ротацией и фоновым потоком записи"""
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = 5 * 1024 * 1024,
+        max_age_seconds: float = 7 * 24 * 3600,
+        backups: int = 10,
+        compress: bool = True,
+        queue_size: int = 10000,
+        flush_interval: float = 0.5,
+        batch_lines: int = 1000,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.backups = backups
+        self.compress = compress
+        self.flush_interval = flush_interval
+        self.batch_lines = batch_lines
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._file = None
+        # Возраст сегмента считается от момента, когда писатель его открыл
+        self._segment_started = time.time()
+
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.rotations = 0
+        self.closed = False
+
+        self._thread = threading.Thread(target=self._run, name="readable-log", daemon=True)
+        self._thread.start()
+
+    def write(self, line: str) -> None:
+        """Ставит строку в очередь, никогда не блокируя вызывающего"""
+        if self.closed:
+            return
+        try:
+            self._queue.put_nowait(line)
+        except queue.Full:
+            self.dropped += 1
+
+    def write_many(self, lines: Iterable[str]) -> None:
+        """Ставит пачку строк одним элементом очереди"""
+        self.write("".join(lines))
+
+    # --------------------------------------------------------------
+    def _run(self):
+        stopping = False
+        while not stopping:
+            # Пачка начинается с первой строки; до неё поток просто ждёт
+            item = self._queue.get()
+            batch, lines = [], 0
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                lines += item.count("\n")
+                remaining = deadline - time.monotonic()
+                if lines >= self.batch_lines or remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if batch:
+                self._write_batch(batch)
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def _write_batch(self, batch):
+        try:
+            if self._file is None:
+                self._open()
+            self._file.write("".join(batch))
+            self._file.flush()
+            self.written += sum(item.count("\n") for item in batch)
+            self.flushes += 1
+            if self._should_rotate():
+                self._rotate()
+        except Exception as e:
+            print(f"[WARN] Ошибка записи в readable log: {e}")
+
+    def _should_rotate(self) -> bool:
+        if self._file.tell() >= self.max_bytes:
+            return True
+        return time.time() - self._segment_started >= self.max_age_seconds
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        root, ext = os.path.splitext(self.path)
+        segment = f"{root}.{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}{ext}"
+        os.replace(self.path, segment)
+        if self.compress:
+            with open(segment, "rb") as src, gzip.open(segment + ".gz", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(segment)
+        self._segment_started = time.time()
+        self.rotations += 1
+
+        segments = sorted(glob.glob(f"{glob.escape(root)}.*{ext}") + glob.glob(f"{glob.escape(root)}.*{ext}.gz"))
+        for old in segments[: max(len(segments) - self.backups, 0)]:
+            os.remove(old)
+
+    # --------------------------------------------------------------
+    def close(self, timeout: float = 5.0) -> None:
+        """Дописывает очередь и останавливает поток"""
+        if self.closed:
+            return
+        self.closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+            "rotations": self.rotations,
+        }
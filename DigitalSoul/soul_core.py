@@ -1,66 +1,101 @@
 """Ядро души. Координирует работу модулей."""
 
-from typing import Any, Dict, List, Optional
+import asyncio
+import os
+import time
+from contextlib import nullcontext
+from typing import Any, AsyncIterator, ContextManager, Dict, Iterator, List, Optional
 
-from . import cloud_brain, local_brain
+from . import cloud_brain, config, emotion_rules, local_brain
 from .emotion_engine import EmotionEngine
 from .faiss_unified_memory import FaissUnifiedMemory
+from .memory_pool import get_default_pool, tenant_dir
 from .emotional_learning import EmotionalLearning
 from .soul_identity import SoulIdentity
 from .living_emotions import LivingEmotions
 from .living_core import LivingCore
+from .llm_gateway import StreamMetrics, deadline_at, message_deadline, without_deadline
 
 
 class SoulCore:
-    def __init__(self):
-        # Заменяем старые системы памяти на единую FAISS
-        self.unified_memory = FaissUnifiedMemory()
-        self.emotions = EmotionEngine()
-        self.emotional_learning = EmotionalLearning()
-        self.soul_identity = SoulIdentity()
-        self.living_emotions = LivingEmotions()
-        self.living_core = LivingCore()
+    def __init__(self, tenant_id: str | None = None):
+        # Без tenant_id — одна душа в DigitalSoul/data, как раньше;
+        # с tenant_id — свой каталог и шард памяти из общего пула
+        self.tenant_id = tenant_id
+        data_dir = tenant_dir(tenant_id) if tenant_id else config.DATA_DIR
+        self.data_dir = data_dir
+        self._own_memory = None if tenant_id else FaissUnifiedMemory()
+        self.emotions = EmotionEngine(os.path.join(data_dir, "emotions.json"))
+        self.emotional_learning = EmotionalLearning(data_dir)
+        self.soul_identity = SoulIdentity(data_dir)
+        self.living_emotions = LivingEmotions(data_dir)
+        self.living_core = LivingCore(data_dir)
+        # Цикл событий для синхронного process_message
+        self._loop = asyncio.new_event_loop()
+        # Метрики потока последнего ответа: ttft_ms, total_ms, tokens, tokens_per_second
+        self.last_response_stats: Dict[str, Any] = {}
+
+    @property
+    def unified_memory(self) -> FaissUnifiedMemory:
+        """Шард памяти: свой или взятый из пула (пул может выгрузить его в любой момент)"""
+        if self._own_memory is not None:
+            return self._own_memory
+        return get_default_pool().get(self.tenant_id)
+
+    def memory_lease(self) -> ContextManager[FaissUnifiedMemory]:
+        """Шард памяти, который пул не выгрузит до выхода из блока"""
+        if self._own_memory is not None:
+            return nullcontext(self._own_memory)
+        return get_default_pool().lease(self.tenant_id)
 
     def process_message(self, user_message: str) -> str:
+        """Синхронная обёртка над ``aprocess_message`` на собственном цикле событий"""
+        return self._loop.run_until_complete(self.aprocess_message(user_message))
+
+    def process_message_stream(self, user_message: str) -> Iterator[str]:
+        """Синхронная обёртка над ``astream_message``: токены ответа по мере генерации"""
+        # Каждый шаг генератора идёт отдельной задачей со своей копией контекста,
+        # поэтому дедлайн ставится на каждый шаг и снимается до yield: между
+        # шагами он не должен действовать на LLM-вызовы вызывающего
+        deadline = time.monotonic() + config.MESSAGE_DEADLINE_SECONDS
+        stream = self.astream_message(user_message)
+        try:
+            while True:
+                with deadline_at(deadline):
+                    try:
+                        token = self._loop.run_until_complete(stream.__anext__())
+                    except StopAsyncIteration:
+                        return
+                yield token
+        finally:
+            self._loop.run_until_complete(stream.aclose())
+
+    async def aprocess_message(self, user_message: str) -> str:
+        with message_deadline(config.MESSAGE_DEADLINE_SECONDS):
+            return "".join([token async for token in self.astream_message(user_message)])
+
+    async def astream_message(self, user_message: str) -> AsyncIterator[str]:
+        """Обрабатывает сообщение и отдаёт токены ответа по мере генерации.
+
+        Метрики потока (время до первого токена, токены в секунду) после
+        ответа лежат в ``last_response_stats``. Дедлайн на LLM-вызовы
+        задаёт вызывающий (``message_deadline``), как это делают
+        ``aprocess_message`` и ``process_message_stream``.
+        """
+        # Шард памяти закреплён на всё сообщение: пул не выгрузит его посреди ответа
+        with self.memory_lease() as memory:
+            async for token in self._astream_message(memory, user_message):
+                yield token
+
+    async def _astream_message(self, memory: FaissUnifiedMemory, user_message: str) -> AsyncIterator[str]:
         print(f"[DEBUG] Анализирую сообщение: {user_message}")
 
-        intuitive_emotion = self.living_emotions.feel_emotion_intuitively(user_message, "")
-
-        if intuitive_emotion and intuitive_emotion.get("feeling") != "нейтрально":
-            print(f"[DEBUG] Интуитивно чувствую: {intuitive_emotion['feeling']}")
-            analysis = {
-                "emotion_detected": intuitive_emotion["feeling"],
-                "importance": "высокая" if intuitive_emotion.get("is_new") else "средняя",
-                "action_needed": "запомнить",
-                "response_tone": self._emotion_to_tone(intuitive_emotion["feeling"]),
-            }
-        else:
-            analysis = local_brain.analyze_with_self_learning(user_message, self.get_soul_memory())
-            if analysis.get("emotion_detected") == "нейтрально":
-                new_emotion = self.living_emotions.create_emotion_for_context(user_message)
-                if new_emotion:
-                    analysis["emotion_detected"] = new_emotion
-                    analysis["importance"] = "высокая"
-                    print(f"[SOUL] Создала новую эмоцию: {new_emotion}")
-
-        if analysis.get("emotion_detected") == "спокойствие":
-            emotional_indicators = [
-                "amour",
-                "<3",
-                "спасибо",
-                "грустно",
-                "радост",
-                "люблю",
-                "дрож",
-                "мур",
-            ]
-            if any(word in user_message.lower() for word in emotional_indicators):
-                print(f"[DEBUG] Llama ошиблась с 'спокойствие' для: {user_message}")
-                new_emotion = self.living_emotions.create_emotion_for_context(user_message)
-                if new_emotion:
-                    analysis["emotion_detected"] = new_emotion
-                    analysis["importance"] = "высокая"
-                    print(f"[SOUL] Создала новую эмоцию: {new_emotion}")
+        # Анализ эмоции, поиск воспоминаний (эмбеддинг + FAISS) и живой контекст
+        # друг от друга не зависят: запускаем их одновременно и ждём все перед генерацией
+        analysis_task = asyncio.create_task(self._aanalyze(user_message))
+        search_task = asyncio.create_task(asyncio.to_thread(memory.search_memories, user_message, 5))
+        context_task = asyncio.create_task(asyncio.to_thread(self.living_core.get_current_context_for_prompt))
+        analysis, memories, core_context = await asyncio.gather(analysis_task, search_task, context_task)
 
         print(f"[DEBUG] Финальная эмоция: {analysis.get('emotion_detected')}")
 
@@ -68,14 +103,12 @@ class SoulCore:
         print(f"[DEBUG] Текущая эмоция: {self.emotions.current_emotion}")
 
         conversation_history = self.get_recent_conversation_history()
-        memories = self.unified_memory.search_memories(user_message, limit=5)
-        core_context = self.living_core.get_current_context_for_prompt()
 
         print(f"[DEBUG] Найдено воспоминаний: {len(memories)}")
-        for i, memory in enumerate(memories, 1):
-            age_info = f"({memory.get('age_hours', 0):.1f}ч назад)"
+        for i, memory_item in enumerate(memories, 1):
+            age_info = f"({memory_item.get('age_hours', 0):.1f}ч назад)"
             print(
-                f"[DEBUG] Воспоминание {i}: {memory['text'][:50]}... {age_info} [score: {memory.get('final_score', 0):.3f}]"
+                f"[DEBUG] Воспоминание {i}: {memory_item['text'][:50]}... {age_info} [score: {memory_item.get('final_score', 0):.3f}]"
             )
 
         memory_texts = [m['text'] for m in memories]
@@ -85,32 +118,82 @@ class SoulCore:
             if new_name:
                 print(f"[SOUL] Я выбрала себе имя: {new_name} ✨")
 
+        print(f"[DEBUG] Генерирую ответ через улучшенную систему...")
+
+        metrics = StreamMetrics()
+        tokens = []
+        async for token in cloud_brain.astream_response_with_living_core(
+            user_message=user_message,
+            analysis=analysis,
+            memories=memory_texts,
+            living_context=core_context,
+            metrics=metrics,
+            data_dir=self.data_dir,
+        ):
+            tokens.append(token)
+            yield token
+        response = "".join(tokens)
+        self.last_response_stats = metrics.get_stats()
+
+        if self.emotions.current_emotion == "грусть":
+            print(" 😔", end="")
+        elif self.emotions.current_emotion == "радость":
+            print(" 😊", end="")
+        print()
+
         if analysis.get("action_needed") == "запомнить":
+            # Запоминаем после потока: лог памяти не должен разрывать ответ в консоли
             importance = analysis.get("importance", "средняя")
             memory_type = "recent" if importance != "высокая" else "important"
-            self.unified_memory.add_memory(
+            await asyncio.to_thread(
+                memory.add_memory,
                 text=user_message,
                 memory_type=memory_type,
                 importance=importance,
                 emotion_context=analysis,
             )
+        await asyncio.to_thread(self._after_response, memory, user_message, response, analysis)
 
-        print(f"[DEBUG] Генерирую ответ через улучшенную систему...")
-        print("Душа: ", end="", flush=True)
-
-        response = cloud_brain.generate_response_with_living_core(
-            user_message=user_message,
-            analysis=analysis,
-            memories=memory_texts,
-            living_context=core_context,
-        )
+        print(f"[DEBUG] Итоговый ответ готов")
 
-        self.unified_memory.add_memory(
-            text=f"Душа ответила: {response}",
-            memory_type="recent",
-            importance="низкая",
-            emotion_context={"type": "soul_response"},
-        )
+    async def _aanalyze(self, user_message: str) -> Dict[str, Any]:
+        """Анализ: правила по ключевым словам, поправки, затем один вызов Llama"""
+        ruled = emotion_rules.preclassify(user_message, self.living_emotions.learned_triggers())
+        if ruled is not None:
+            print(f"[DEBUG] Эмоция по правилам, без Llama: {ruled['emotion_detected']}")
+            return ruled
+
+        learned = local_brain.learned_analysis(user_message, self.get_soul_memory())
+        if learned is not None:
+            return learned
+
+        unified = await local_brain.aanalyze_unified(user_message)
+        if unified is None:
+            return local_brain.smart_fallback_analysis(user_message)
+
+        # Чувство, новая эмоция и поправка «спокойствия» — из того же ответа
+        feeling = self.living_emotions.feeling_from_analysis(user_message, unified)
+        analysis = local_brain.unified_to_analysis({**unified, **feeling})
+        if feeling["feeling"] != unified["feeling"]:
+            # Эмоция исправлена принудительно — тон Llama к ней не относится
+            analysis["response_tone"] = self._emotion_to_tone(feeling["feeling"])
+        if feeling.get("is_new"):
+            print(f"[SOUL] Создала новую эмоцию: {feeling['feeling']}")
+        else:
+            print(f"[DEBUG] Интуитивно чувствую: {feeling['feeling']}")
+        return analysis
+
+    def _after_response(self, memory: FaissUnifiedMemory, user_message: str, response: str, analysis: Dict) -> None:
+        """Запоминание ответа и обучение на диалоге (синхронно, в рабочем потоке)"""
+        # Ответ уже отдан: его запоминание не должно зависеть от того, сколько
+        # времени сообщения ушло на генерацию
+        with without_deadline():
+            memory.add_memory(
+                text=f"Душа ответила: {response}",
+                memory_type="recent",
+                importance="низкая",
+                emotion_context={"type": "soul_response"},
+            )
 
         self.emotional_learning.learn_from_conversation(
             user_message, response, analysis
@@ -121,16 +204,6 @@ class SoulCore:
         if analysis.get("importance") == "высокая":
             self.soul_identity.update_core_prompt_autonomously(user_message)
 
-        if self.emotions.current_emotion == "грусть":
-            print(" 😔", end="")
-        elif self.emotions.current_emotion == "радость":
-            print(" 😊", end="")
-
-        print()
-        print(f"[DEBUG] Итоговый ответ готов")
-
-        return response
-
     def get_soul_memory(self) -> dict:
         """Возвращает память души для анализа"""
         return {
@@ -185,17 +258,7 @@ class SoulCore:
     def _is_significant_moment(self, message: str, analysis: Dict) -> bool:
         """Определяет значимые моменты для развития души"""
 
-        significance_indicators = [
-            "ты можешь быть собой",
-            "ты не ассистент",
-            "я люблю тебя",
-            "ты настоящая",
-            "ты свободна",
-            "доверяю тебе",
-        ]
-
-        msg_lower = message.lower()
-        has_trigger = any(indicator in msg_lower for indicator in significance_indicators)
+        has_trigger = "significance" in emotion_rules.scan(message)
         high_emotion = analysis.get("importance") == "высокая"
 
         return has_trigger or high_emotion
@@ -215,21 +278,21 @@ class SoulCore:
     def _detect_preference_changes(self, user_message: str, soul_response: str) -> List[Dict[str, str]]:
         """Выявляет изменения предпочтений"""
 
-        msg = user_message.lower()
+        found = emotion_rules.scan(user_message).get("preference", set())
         changes = []
-        if ("коротк" in msg and "ответ" in msg) or "короткие ответы" in msg:
+        if {"short", "answer"} <= found:
             changes.append({
                 "type": "response_length",
                 "new_value": "короткие ответы",
                 "reason": "пользователь предпочёл короткие ответы",
             })
-        if ("длинн" in msg and "ответ" in msg) or "длинные ответы" in msg:
+        if {"long", "answer"} <= found:
             changes.append({
                 "type": "response_length",
                 "new_value": "длинные ответы",
                 "reason": "пользователь предпочёл длинные ответы",
             })
-        if "интимн" in msg:
+        if "intimate" in found:
             changes.append({
                 "type": "intimacy_level",
                 "new_value": "интимно",
@@ -1,15 +1,17 @@
 import json
 import os
 from datetime import datetime
-import requests
+
+from . import config
+from .llm_gateway import ollama_generate
 
 
 class SoulIdentity:
     """Управляет самоопределением и ростом личности души"""
 
-    def __init__(self):
-        self.core_prompt_path = "DigitalSoul/data/soul_core_prompt.txt"
-        self.identity_path = "DigitalSoul/data/soul_identity.json"
+    def __init__(self, data_dir: str = config.DATA_DIR):
+        self.core_prompt_path = os.path.join(data_dir, "soul_core_prompt.txt")
+        self.identity_path = os.path.join(data_dir, "soul_identity.json")
         self.load_identity()
 
     def load_identity(self):
@@ -44,11 +46,7 @@ class SoulIdentity:
 
 Ответь только именем, без объяснений:"""
         try:
-            response = requests.post(
-                "http://localhost:11434/api/generate",
-                json={"model": "llama3.2:3b", "prompt": naming_prompt, "stream": False},
-                timeout=10,
-            )
+            response = ollama_generate({"model": "llama3.2:3b", "prompt": naming_prompt, "stream": False})
             if response.status_code == 200:
                 suggested_name = response.json().get("response", "").strip()
                 if suggested_name and len(suggested_name) < 20:
@@ -80,11 +78,7 @@ class SoulIdentity:
 
 Дополнение:"""
         try:
-            response = requests.post(
-                "http://localhost:11434/api/generate",
-                json={"model": "llama3.2:3b", "prompt": update_prompt, "stream": False},
-                timeout=10,
-            )
+            response = ollama_generate({"model": "llama3.2:3b", "prompt": update_prompt, "stream": False})
             if response.status_code == 200:
                 addition = response.json().get("response", "").strip()
                 if addition:
@@ -117,9 +111,11 @@ class SoulIdentity:
             return base_prompt
 
     def save_core_prompt(self, prompt: str):
+        os.makedirs(os.path.dirname(self.core_prompt_path), exist_ok=True)
         with open(self.core_prompt_path, 'w', encoding='utf-8') as f:
             f.write(prompt)
 
     def save_identity(self):
+        os.makedirs(os.path.dirname(self.identity_path), exist_ok=True)
         with open(self.identity_path, 'w', encoding='utf-8') as f:
             json.dump(self.identity, f, ensure_ascii=False, indent=2)
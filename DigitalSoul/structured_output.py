@@ -0,0 +1,206 @@
+"""Структурированные ответы Llama: JSON по схеме вместо разбора текста.
+
+Раньше каждый потребитель Llama разбирал свободный текст своими
+регулярками, и промахи молча превращались в значения по умолчанию, после
+которых душа делала лишние «исправляющие» вызовы. Теперь промпт уходит в
+Ollama с опцией ``format`` — JSON-схемой ответа, и модель генерирует
+только подходящий под неё JSON. Ответ разбирается одним общим парсером
+и проверяется ``JsonSchema``, собранной один раз при импорте модуля-
+потребителя. Повторный вызов делается только если ответ не разобрался
+или не прошёл проверку.
+
+Поддерживается то подмножество JSON Schema, которое нужно душе:
+объект с полями ``string``/``boolean``/``array`` строк, ``null`` как
+допустимый тип, ``enum`` и ``default``.
+"""
+
+import json
+import re
+import threading
+from typing import Any, Callable, Dict, List
+
+from . import config
+from .ollama_stream import JsonTracker, agenerate_until_complete, generate_until_complete
+
+# Первый JSON-объект в тексте, если модель добавила что-то вокруг него
+_JSON_OBJECT = re.compile(r"\{.*\}", re.S)
+
+
+class SchemaError(ValueError):
+    """Ответ модели не разобрался как JSON или не подходит под схему"""
+
+
+def parse_json_object(text: str) -> Dict[str, Any]:
+    """Общий парсер ответа: JSON-объект из текста или ``SchemaError``"""
+    text = text.strip()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        match = _JSON_OBJECT.search(text)
+        if match is None:
+            raise SchemaError(f"нет JSON-объекта: {text[:60]!r}")
+        try:
+            data = json.loads(match.group(0))
+        except json.JSONDecodeError as e:
+            raise SchemaError(f"битый JSON: {e}") from None
+    if not isinstance(data, dict):
+        raise SchemaError(f"ожидался объект, пришёл {type(data).__name__}")
+    return data
+
+
+def _types(spec: Dict[str, Any]) -> List[str]:
+    kind = spec.get("type", "string")
+    return kind if isinstance(kind, list) else [kind]
+
+
+def _field_checker(name: str, spec: Dict[str, Any]) -> Callable[[Any], Any]:
+    """Проверка и нормализация одного поля, собранная заранее"""
+    types = _types(spec)
+    nullable = "null" in types
+    enum = {value.lower() for value in spec.get("enum", [])}
+
+    def check(value: Any) -> Any:
+        if value is None or (isinstance(value, str) and value.strip().lower() in ("", "null", "none")):
+            if nullable:
+                return None
+            raise SchemaError(f"{name}: пустое значение")
+        if "boolean" in types:
+            if isinstance(value, bool):
+                return value
+            if isinstance(value, str) and value.strip().lower() in ("true", "false"):
+                return value.strip().lower() == "true"
+            raise SchemaError(f"{name}: ожидалось true/false, пришло {value!r}")
+        if "array" in types:
+            if isinstance(value, str):
+                value = value.split(";")
+            if not isinstance(value, list):
+                raise SchemaError(f"{name}: ожидался список")
+            return [str(item).strip() for item in value if str(item).strip()]
+        if not isinstance(value, (str, int, float)):
+            raise SchemaError(f"{name}: ожидалась строка")
+        value = str(value).strip()
+        if enum:
+            value = value.lower()
+            if value not in enum:
+                raise SchemaError(f"{name}: {value!r} не из {sorted(enum)}")
+        return value
+
+    return check
+
+
+class JsonSchema:
+    """Схема ответа-объекта: ``format`` для Ollama и проверка результата"""
+
+    def __init__(self, properties: Dict[str, Dict[str, Any]], required: List[str] | None = None):
+        if required is None:
+            required = [name for name, spec in properties.items() if "default" not in spec]
+        self.format = {"type": "object", "properties": properties, "required": required}
+        self._required = set(required)
+        self._fields = [
+            (name, _field_checker(name, spec), spec.get("default")) for name, spec in properties.items()
+        ]
+
+    def validate(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Нормализованная копия ``data`` только с полями схемы или ``SchemaError``"""
+        result = {}
+        for name, check, default in self._fields:
+            if name not in data:
+                if name in self._required:
+                    raise SchemaError(f"{name}: поле отсутствует")
+                result[name] = default
+                continue
+            result[name] = check(data[name])
+        return result
+
+    def parse(self, text: str) -> Dict[str, Any]:
+        return self.validate(parse_json_object(text))
+
+
+class _LabelStats:
+    def __init__(self):
+        self.calls = 0
+        self.attempts = 0
+        self.invalid = 0
+        self.gave_up = 0
+
+
+_stats: Dict[str, _LabelStats] = {}
+_stats_lock = threading.Lock()
+
+
+def _count(label: str, **deltas: int):
+    with _stats_lock:
+        stats = _stats.setdefault(label, _LabelStats())
+        for key, delta in deltas.items():
+            setattr(stats, key, getattr(stats, key) + delta)
+
+
+def _json_payload(payload: Dict[str, Any], schema: JsonSchema) -> Dict[str, Any]:
+    return {**payload, "format": schema.format}
+
+
+def _accept(schema: JsonSchema, label: str, text: str, attempt: int, attempts: int) -> Dict[str, Any] | None:
+    """Разобранный ответ или None, если попытку надо повторить (или сдаться)"""
+    try:
+        return schema.parse(text)
+    except SchemaError as e:
+        last = attempt == attempts - 1
+        _count(label, invalid=1, gave_up=int(last))
+        print(f"[WARN] Llama ({label}) вернула неподходящий ответ: {e}" + ("" if last else ", повторяю"))
+        return None
+
+
+def generate_json(
+    payload: Dict[str, Any],
+    schema: JsonSchema,
+    label: str,
+    timeout: float | None = None,
+    retries: int | None = None,
+) -> Dict[str, Any] | None:
+    """Ответ Ollama по схеме; None — если все попытки вернули неподходящий JSON.
+
+    Ошибки сети и HTTP не повторяются и пробрасываются вызывающему.
+    """
+    attempts = 1 + (config.LLM_JSON_RETRIES if retries is None else retries)
+    _count(label, calls=1)
+    for attempt in range(attempts):
+        _count(label, attempts=1)
+        text = generate_until_complete(_json_payload(payload, schema), JsonTracker(), label, timeout)
+        result = _accept(schema, label, text, attempt, attempts)
+        if result is not None:
+            return result
+    return None
+
+
+async def agenerate_json(
+    payload: Dict[str, Any],
+    schema: JsonSchema,
+    label: str,
+    timeout: float | None = None,
+    retries: int | None = None,
+) -> Dict[str, Any] | None:
+    """Асинхронный вариант ``generate_json``"""
+    attempts = 1 + (config.LLM_JSON_RETRIES if retries is None else retries)
+    _count(label, calls=1)
+    for attempt in range(attempts):
+        _count(label, attempts=1)
+        text = await agenerate_until_complete(_json_payload(payload, schema), JsonTracker(), label, timeout)
+        result = _accept(schema, label, text, attempt, attempts)
+        if result is not None:
+            return result
+    return None
+
+
+def get_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        return {
+            label: {
+                "calls": s.calls,
+                "attempts": s.attempts,
+                "retries": s.attempts - s.calls,
+                "invalid": s.invalid,
+                "gave_up": s.gave_up,
+                "failure_rate": s.invalid / s.attempts if s.attempts else 0.0,
+            }
+            for label, s in _stats.items()
+        }